@@ -1,23 +1,38 @@
+import json
+import os
 import threading
+import time
 import tkinter as tk
 from tkinter import ttk, messagebox
 
-from config_loader import load_imap_config, save_config, PersonalConfig, CorporateConfig
-from email_code_fetcher import get_auth_code_from_email, get_auth_code_from_sms, PLATFORM_OTP_SUBJECT_MARKERS
-
-
-def run_in_thread(func, on_done):
-    def run():
-        try:
-            result = func()
-        except Exception as e:
-            result = str(e)
-        if on_done:
-            root = tk._default_root
-            if root:
-                root.after(0, lambda: on_done(result))
-
-    threading.Thread(target=run, daemon=True).start()
+from code_sources import CORPORATE_ACCOUNT, MODE_SMS, PERSONAL_ACCOUNT, Account
+from config_loader import (
+    load_imap_config, load_fetch_options, load_code_rules, load_sources, save_config, PersonalConfig, CorporateConfig,
+)
+from fetch_stats import (
+    STATUS_AUTH_FAILED, STATUS_ERROR, STATUS_TIMEOUT, STATUS_UNAVAILABLE, FetchStats, JsonlStatsWriter, add_stats_hook,
+    remove_stats_hook,
+)
+from settings_store import load_settings, save_settings
+
+# Движок поиска (email_code_fetcher, fetch_executor, imap_pool — а с ними imap_tools, email, SSL
+# и asyncio) здесь не импортируется: окно появляется сразу, движок догружается в фоне (load_engine)
+
+# Замеры запуска (bench_startup.py): файл, куда писать отметки времени, и источник для первого кода
+STARTUP_PROBE_ENV = "ENERGOCHAIN_STARTUP_PROBE"
+STARTUP_SOURCE_ENV = "ENERGOCHAIN_STARTUP_SOURCE"
+# Сколько папок одного ящика (самых используемых) держать выбранными в пуле заранее
+PREWARM_FOLDERS = 3
+ALL_SOURCES = "all"  # режим кнопки «Все папки»: все источники с in_all
+# Высота окна: кнопки «Настройки», «Все папки», «Копировать» и результат — плюс строка на каждый источник
+WINDOW_BASE_HEIGHT = 222
+BUTTON_ROW_HEIGHT = 29
+# Что показать вместо кода, если искать не удалось (итог запроса — fetch_stats.STATUS_*)
+FAILURE_TEXTS = {
+    STATUS_TIMEOUT: "(сервер не ответил вовремя)",
+    STATUS_AUTH_FAILED: "(неверный логин или пароль)",
+    STATUS_UNAVAILABLE: "(почтовый сервер недоступен)",
+}
 
 
 class SettingsWindow:
@@ -120,10 +135,24 @@ def copy_to_clipboard(root: tk.Tk, text: str):
     root.update_idletasks()
 
 
+def load_engine() -> None:
+    """Импортирует движок поиска кодов; повторные вызовы ничего не стоят."""
+    import email_code_fetcher  # noqa: F401
+    import fetch_executor  # noqa: F401
+
+
+def startup_event(event: str, **extra) -> None:
+    """Отметка времени для bench_startup.py (строка JSON в файл из STARTUP_PROBE_ENV), если замер идёт."""
+    path = os.environ.get(STARTUP_PROBE_ENV)
+    if not path:
+        return
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"event": event, "t": time.time(), **extra}) + "\n")
+
+
 def main():
     root = tk.Tk()
     root.title("Коды")
-    root.geometry("170x360")
     root.resizable(False, False)
     root.columnconfigure(0, weight=1)
     root.columnconfigure(1, weight=0)
@@ -132,11 +161,46 @@ def main():
     root.rowconfigure(1, weight=1)
 
     imap_host, imap_port, personal, corporate, ui = load_imap_config()
+    fetch_options = load_fetch_options()
+    code_rules, rule_errors = load_code_rules()
+    accounts, sources, source_errors = load_sources()
     root.attributes("-topmost", bool(ui.get("always_on_top", False)))
+    stats_writer = JsonlStatsWriter()
+    settings = load_settings()
+    # Счётчик запросов по источникам (в settings.json — под прежним именем folder_usage)
+    folder_usage: dict[str, int] = dict(settings.get("folder_usage") or {})
+
+    def apply_stats_log():
+        if fetch_options.stats_log:
+            add_stats_hook(stats_writer)
+        else:
+            remove_stats_hook(stats_writer)
+
+    apply_stats_log()
+
+    def show_config_errors(errors: list[str]):
+        if errors:
+            messagebox.showwarning("Настройки", "Секции config.ini с ошибками пропущены:\n\n" + "\n".join(errors))
 
     def apply_after_save(new_personal: PersonalConfig, new_corporate: CorporateConfig):
-        nonlocal personal, corporate, ui
+        nonlocal personal, corporate, ui, fetch_options, code_rules, accounts, sources
+        old_accounts = {(a.host, a.port, a.email, a.password) for a in accounts}
         _, _, personal, corporate, ui = load_imap_config()
+        fetch_options = load_fetch_options()
+        code_rules, errors = load_code_rules()
+        accounts, sources, source_errors = load_sources()
+        show_config_errors(errors + source_errors)
+        apply_stats_log()
+        # Сессии ящиков, убранных из настроек, закрываем; новые подключаем заранее
+        new_accounts = {(a.host, a.port, a.email, a.password) for a in accounts}
+        from imap_pool import get_default_pool, run_background
+
+        pool = get_default_pool()
+        for host, port, email, _ in old_accounts - new_accounts:
+            if email:
+                run_background(pool.discard(host, port, email))
+        build_buttons()
+        prewarm()
         root.attributes("-topmost", bool(ui.get("always_on_top", False)))
 
     # Центральная колонка (кнопки + результат)
@@ -151,96 +215,180 @@ def main():
     btn_frame.grid(row=0, column=0, sticky=tk.N)
     btn_frame.columnconfigure(0, weight=0)
 
-    buttons_config = [
-        ("Настройки", None),
-        ("Моя почта", "my"),
-        ("uneco", "uneco"),
-        ("eak", "eak"),
-        ("sale", "sale"),
-        ("svet1", "svet1"),
-        ("sms", "sms"),
-        ("autotest", "autotest"),
-    ]
+    def note_usage(name: str):
+        folder_usage[name] = folder_usage.get(name, 0) + 1
+        settings["folder_usage"] = folder_usage
+        try:
+            save_settings(settings)
+        except OSError:
+            pass
+
+    def prewarm():
+        """
+        Подключает и авторизует ящики в фоне, не дожидаясь клика, и сразу выбирает папки
+        их источников: все, если их не больше PREWARM_FOLDERS, иначе — самые используемые.
+        Дальше сессии держит пул (NOOP keepalive).
+        """
+        from imap_pool import get_default_pool, run_background
+
+        pool = get_default_pool()
+        for account in accounts:
+            if not account.configured:
+                continue
+            own = [s for s in sources if s.account == account.name]
+            if len(own) > PREWARM_FOLDERS:
+                own = sorted((s for s in own if folder_usage.get(s.name)), key=lambda s: -folder_usage[s.name])
+            folders = list(dict.fromkeys(s.folder for s in own))[:PREWARM_FOLDERS]
+            pool.set_max_busy(account.host, account.port, account.email, account.max_busy)
+            run_background(pool.prewarm(account.host, account.port, account.email, account.password, folders))
 
     last_result = [""]
     result_label = None
+    stats_label = None
 
-    def set_result(value: str):
+    def set_result(value: str, note: str | None = None):
         last_result[0] = value or ""
         if result_label:
-            result_label.config(text=value or "")
+            result_label.config(text=f"{value} ({note})" if value and note else value or "")
         if value and ui.get("copy_to_clipboard", True):
             copy_to_clipboard(root, value)
 
+    # Запросы выполняются в фоновом цикле событий; новый запрос режима отменяет прежний того же режима.
+    # Исполнитель (и цикл событий) создаётся при первом запросе
+    executor = [None]
+    engine_ready = threading.Event()
+
+    def get_executor():
+        if executor[0] is None:
+            from fetch_executor import FetchExecutor
+
+            executor[0] = FetchExecutor()
+        return executor[0]
+
+    def start_engine():
+        """Догружает движок в фоновом потоке, когда окно уже на экране; затем подключает ящики заранее."""
+        def load():
+            load_engine()
+            engine_ready.set()
+            try:
+                root.after(0, engine_loaded)
+            except (RuntimeError, tk.TclError):
+                pass  # окно успели закрыть
+
+        threading.Thread(target=load, name="engine-import", daemon=True).start()
+
+    def engine_loaded():
+        startup_event("engine")
+        prewarm()
+        if os.environ.get(STARTUP_PROBE_ENV) and not os.environ.get(STARTUP_SOURCE_ENV):
+            root.destroy()  # замер только окна и движка
+
+    # Номер последнего запроса: в окно попадает только его результат
+    latest_request = [0]
+
+    def show_stats(stats: FetchStats, request_id: int):
+        # Вызывается в фоновом цикле событий — в окно передаём через root.after
+        summary = stats.summary()
+
+        def show():
+            if request_id == latest_request[0] and stats_label:
+                stats_label.config(text=summary)
+
+        root.after(0, show)
+
+    def account_title(account: Account) -> str:
+        if account.name == PERSONAL_ACCOUNT:
+            return "личную почту"
+        if account.name == CORPORATE_ACCOUNT:
+            return "корпоративную почту"
+        return f"ящик «{account.name}» (секция [account:{account.name}])"
+
     def do_fetch(mode: str):
-        if mode == "my":
-            if not personal.email or not personal.password:
+        """mode — имя источника или ALL_SOURCES."""
+        # Клик раньше, чем движок догрузился в фоне, подождёт его здесь
+        from email_code_fetcher import WAIT_TIMEOUT, fetch_code_from_source_async, fetch_code_from_sources_async
+
+        latest_request[0] += 1
+        request_id = latest_request[0]
+
+        def on_stats(stats: FetchStats):
+            show_stats(stats, request_id)
+
+        common = dict(
+            wait=WAIT_TIMEOUT,
+            senders=fetch_options.senders,
+            max_age=fetch_options.max_age_minutes * 60 or None,
+            rules=code_rules,
+            on_stats=on_stats,
+        )
+        by_name = {a.name: a for a in accounts}
+        if mode == ALL_SOURCES:
+            targets = [s for s in sources if s.in_all]
+            if not targets:
+                set_result("")
+                messagebox.showwarning("Настройки", "Нет источников для «Все папки» (in_all = false у всех).")
+                return
+            if not any(by_name[s.account].configured for s in targets):
                 set_result("")
-                messagebox.showwarning("Настройки", "Укажите личную почту и пароль в настройках.")
+                messagebox.showwarning("Настройки", f"Укажите {account_title(by_name[targets[0].account])}: адрес и пароль.")
                 return
+
             def task():
-                return get_auth_code_from_email(
-                    recipient_email=personal.email,
-                    folder=personal.folder,
-                    imap_user=personal.email,
-                    imap_password=personal.password,
-                    imap_host=imap_host,
-                    imap_port=imap_port,
-                    subject_contains=PLATFORM_OTP_SUBJECT_MARKERS,
-                )
+                return fetch_code_from_sources_async(targets, by_name, **common)
         else:
-            if not corporate.email or not corporate.password:
+            source = next((s for s in sources if s.name == mode), None)
+            if source is None:
+                return  # источник убран из настроек, пока окно не обновилось
+            account = by_name[source.account]
+            if not account.configured:
                 set_result("")
-                messagebox.showwarning("Настройки", "Укажите корпоративную почту и пароль в настройках.")
+                messagebox.showwarning("Настройки", f"Укажите {account_title(account)}: адрес и пароль.")
                 return
-            if mode == "sms":
-                def task():
-                    return get_auth_code_from_sms(
-                        imap_user=corporate.email,
-                        imap_password=corporate.password,
-                        imap_host=imap_host,
-                        imap_port=imap_port,
-                        folder="sms",
-                    )
-            else:
-                folder = mode
-                def task():
-                    return get_auth_code_from_email(
-                        recipient_email=corporate.email,
-                        folder=folder,
-                        imap_user=corporate.email,
-                        imap_password=corporate.password,
-                        imap_host=imap_host,
-                        imap_port=imap_port,
-                        subject_contains=PLATFORM_OTP_SUBJECT_MARKERS,
-                    )
 
+            def task():
+                return fetch_code_from_source_async(source, account, **common)
+
+            note_usage(source.name)
         set_result("… ожидание кода …")
+        if stats_label:
+            stats_label.config(text="")
 
         def on_done(res):
-            if res is None:
+            if request_id != latest_request[0]:
+                return  # пока ждали, нажата другая кнопка — её результат новее
+            if os.environ.get(STARTUP_PROBE_ENV):
+                startup_event("code", found=res is not None and not isinstance(res, Exception) and res.found)
+                root.destroy()
+                return
+            if isinstance(res, Exception):
+                set_result(f"Ошибка: {str(res)[:200]}")
+            elif res.found:
+                set_result(res.code, note=res.label if mode == ALL_SOURCES else None)
+            elif res.status in FAILURE_TEXTS:
+                set_result(FAILURE_TEXTS[res.status])
+                error = res.error or ""
+                root.after(0, lambda: messagebox.showwarning("Ошибка почты", f"{FAILURE_TEXTS[res.status]}\n\n{error}"))
+            elif res.status == STATUS_ERROR:
+                set_result(f"Ошибка: {(res.error or '')[:200]}")
+            else:
                 set_result("(код не найден)")
-                if mode == "my":
+                if mode == ALL_SOURCES:
+                    names = ", ".join(s.name for s in targets)
                     root.after(0, lambda: messagebox.showinfo(
-                        "Моя почта",
-                        f"В указанной папке «{personal.folder}» не найдено подходящих писем.\n\nПроверьте папку (тема: пароль для входа или код подтверждения почты на Платформе).",
+                        "Все папки", f"Ни в одном из источников ({names}) не найдено подходящих писем.",
                     ))
-                elif mode == "sms":
+                elif source.mode == MODE_SMS:
                     root.after(0, lambda: messagebox.showinfo(
                         "SMS",
-                        "В папке «sms» не найдено подходящих писем.\n\nКод берётся из тела письма (тема — номер телефона).",
+                        f"В папке «{source.folder}» не найдено подходящих писем.\n\nКод берётся из тела письма (тема — номер телефона).",
                     ))
                 else:
                     root.after(0, lambda: messagebox.showinfo(
-                        "Корпоративная почта",
-                        f"В папке «{mode}» не найдено подходящих писем.\n\nПроверьте папку (тема: пароль для входа или код подтверждения почты на Платформе).",
+                        source.name,
+                        f"В папке «{source.folder}» не найдено подходящих писем.\n\nПроверьте папку (тема: пароль для входа или код подтверждения почты на Платформе).",
                     ))
-            elif isinstance(res, str) and not res.isdigit() and len(res) > 10:
-                set_result(f"Ошибка: {res[:200]}")
-            else:
-                set_result(str(res) if res is not None else "(код не найден)")
 
-        run_in_thread(task, on_done)
+        get_executor().submit(mode, task, lambda res: root.after(0, lambda: on_done(res)))
 
     def open_settings():
         _, _, p, c, u = load_imap_config()
@@ -254,22 +402,33 @@ def main():
         ttk.Separator(f, orient=tk.HORIZONTAL).pack(fill=tk.X)
         parent.columnconfigure(0, weight=0)
 
-    buttons = []
-    row = 0
-    for label, mode in buttons_config:
-        if mode is None:
-            btn = ttk.Button(btn_frame, text=label, command=open_settings)
-        else:
-            btn = ttk.Button(btn_frame, text=label, command=lambda m=mode: do_fetch(m))
-        btn.grid(row=row, column=0, padx=0, pady=2, sticky=tk.EW)
-        buttons.append(btn)
-        row += 1
-        if mode is None:
-            make_sep_row(btn_frame, row)
+    def build_buttons():
+        """Кнопки по источникам из config.ini; пересобираются после сохранения настроек."""
+        for child in btn_frame.winfo_children():
+            child.destroy()
+        buttons_config = [
+            ("Настройки", None),
+            *((source.name, source.name) for source in sources),
+            ("Все папки", ALL_SOURCES),
+        ]
+        row = 0
+        for label, mode in buttons_config:
+            if mode is None:
+                btn = ttk.Button(btn_frame, text=label, command=open_settings)
+            else:
+                btn = ttk.Button(btn_frame, text=label, command=lambda m=mode: do_fetch(m))
+            btn.grid(row=row, column=0, padx=0, pady=2, sticky=tk.EW)
             row += 1
+            if mode is None:
+                make_sep_row(btn_frame, row)
+                row += 1
 
-    make_sep_row(btn_frame, row)
-    row += 1
+        make_sep_row(btn_frame, row)
+        row += 1
+        copy_btn = ttk.Button(btn_frame, text="Копировать", command=lambda: copy_to_clipboard(root, last_result[0]))
+        copy_btn.grid(row=row, column=0, padx=0, pady=3, sticky=tk.EW)
+        # Высота окна — по числу кнопок (прежние 425 — на 7 источников)
+        root.geometry(f"170x{WINDOW_BASE_HEIGHT + BUTTON_ROW_HEIGHT * len(sources)}")
 
     # Результат: блок под кнопками, визуально отделён разделителем, тот же фон
     result_frame = ttk.Frame(center, padding=(8, 0))
@@ -283,12 +442,31 @@ def main():
     result_label = ttk.Label(result_frame, text="", font=("Consolas", 11), padding=(8, 6), style="Center.TLabel")
     result_label.grid(row=1, column=0, sticky=tk.EW)
     result_frame.rowconfigure(1, weight=1)
-
-    copy_btn = ttk.Button(btn_frame, text="Копировать", command=lambda: copy_to_clipboard(root, last_result[0]))
-    copy_btn.grid(row=row, column=0, padx=0, pady=3, sticky=tk.EW)
-    buttons.append(copy_btn)
-
+    # Замеры последнего запроса: общее время и фазы
+    stats_label = ttk.Label(result_frame, text="", font=("Consolas", 8), foreground="gray",
+                            wraplength=150, justify=tk.CENTER, style="Center.TLabel")
+    stats_label.grid(row=2, column=0, sticky=tk.EW)
+
+    def on_first_map(_event):
+        root.unbind("<Map>")
+        startup_event("window")
+        start_engine()
+        probe_source = os.environ.get(STARTUP_SOURCE_ENV)
+        if os.environ.get(STARTUP_PROBE_ENV) and probe_source:
+            root.after(0, lambda: do_fetch(probe_source))  # как клик сразу после появления окна
+
+    build_buttons()
+    # Движок и подключение заранее — после того как окно показано
+    root.bind("<Map>", on_first_map)
+    root.after(0, lambda: show_config_errors(rule_errors + source_errors))
     root.mainloop()
+    if executor[0] is not None:
+        executor[0].cancel_all()
+    if engine_ready.is_set():
+        # Сессии пула общие для всех кнопок; при выходе корректно закрываем их (LOGOUT)
+        from imap_pool import get_default_pool, run_sync
+
+        run_sync(get_default_pool().close())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,190 @@
+"""
+Замеры скорости получения кодов на локальной IMAP-заглушке (imap_standin).
+
+Для каждого размера папки поднимает заглушку, засевает её «шумом» и письмами с кодами
+и гоняет get_auth_code_from_email_async / get_auth_code_from_sms_async по сценариям:
+
+    email-oldest — письмо с кодом самое старое: полный обход всех непрочитанных
+    email-newest — письмо с кодом самое свежее: лучший случай
+    sms-oldest   — SMS-письмо самое старое, отбор по телу на сервере (SEARCH BODY)
+
+Каждый сценарий меряется «холодным» (без отметок UID) и «тёплым» (повтор с отметками).
+Соединение с сервером переиспользуется (пул), первое подключение в замеры не входит.
+Печатает перцентили задержки, байты и число команд (каждая команда — один round trip).
+
+    python bench_fetch.py
+    python bench_fetch.py --sizes 10,1000 --repeat 20 --latency 0.02 --json bench.json
+    python bench_fetch.py --baseline bench.json   # код возврата 1 при регрессии байт/команд
+    python bench_fetch.py --compress              # заглушка объявляет COMPRESS=DEFLATE: байты — сжатые
+"""
+import argparse
+import asyncio
+import functools
+import json
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from email_code_fetcher import get_auth_code_from_email_async, get_auth_code_from_sms_async
+from imap_client import ImapClient
+from imap_pool import ImapSessionPool
+from imap_standin import DEFAULT_CAPABILITIES, StandinServer, seed_folder
+from uid_watermarks import UidWatermarks
+
+DEFAULT_SIZES = (10, 100, 1000, 10000, 100000)
+DEFAULT_REPEAT = 5
+BENCH_FOLDER = "bench"
+BENCH_USER = "bench@example.com"
+BENCH_PASSWORD = "bench"
+NOISE_BODY_SIZE = 256
+# Допуск при сравнении с базовым прогоном (--baseline): байты и команды могут вырасти не больше чем на 10%
+BASELINE_TOLERANCE = 0.10
+
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def _measure(server: StandinServer, lookup, repeat: int, warm: bool) -> dict:
+    """Гоняет lookup(watermarks) repeat раз; возвращает сводку по задержке, байтам и командам."""
+    latencies: list[float] = []
+    counters = {"bytes_out": 0, "bytes_in": 0, "commands": 0}
+    codes = set()
+    with tempfile.TemporaryDirectory() as tmp:
+        shared = UidWatermarks(Path(tmp) / "warm.json")
+        if warm:
+            await lookup(shared)  # первый проход ставит отметки, в замер не входит
+        for i in range(repeat):
+            watermarks = shared if warm else UidWatermarks(Path(tmp) / f"cold{i}.json")
+            before = server.stats.snapshot()
+            started = time.perf_counter()
+            codes.add(await lookup(watermarks))
+            latencies.append(time.perf_counter() - started)
+            after = server.stats.snapshot()
+            for key in counters:
+                counters[key] += after[key] - before[key]
+    return {
+        "code_found": None not in codes,
+        "p50_ms": _percentile(latencies, 0.50) * 1000,
+        "p90_ms": _percentile(latencies, 0.90) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "max_ms": max(latencies) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "bytes_down": counters["bytes_out"] / repeat,
+        "bytes_up": counters["bytes_in"] / repeat,
+        "round_trips": counters["commands"] / repeat,
+    }
+
+
+async def bench_size(size: int, repeat: int, latency: float, compress: bool = False) -> list[dict]:
+    """Все сценарии для папки из size писем-«шума»; compress — сервер со сжатием DEFLATE."""
+    capabilities = DEFAULT_CAPABILITIES + (("COMPRESS=DEFLATE",) if compress else ())
+    server = StandinServer(users={BENCH_USER: BENCH_PASSWORD}, capabilities=capabilities).start_in_thread()
+    pool = ImapSessionPool(client_factory=functools.partial(ImapClient, tls=False))
+    try:
+        seed_folder(server, BENCH_FOLDER, 1, kind="otp", to=BENCH_USER)
+        seed_folder(server, BENCH_FOLDER, 1, kind="sms", to=BENCH_USER)
+        seed_folder(server, BENCH_FOLDER, size, to=BENCH_USER, body_size=NOISE_BODY_SIZE)
+        server.build_index(BENCH_FOLDER)
+        # Кэш результатов выключен: каждый повтор должен идти на сервер
+        account = dict(imap_user=BENCH_USER, imap_password=BENCH_PASSWORD, imap_host=server.host,
+                       imap_port=server.port, pool=pool, max_age=None, cache_ttl=0)
+
+        def email_lookup(watermarks):
+            return get_auth_code_from_email_async(
+                BENCH_USER, BENCH_FOLDER, subject_contains=(), watermarks=watermarks, **account
+            )
+
+        def sms_lookup(watermarks):
+            return get_auth_code_from_sms_async(folder=BENCH_FOLDER, watermarks=watermarks, **account)
+
+        async with pool.session(server.host, server.port, BENCH_USER, BENCH_PASSWORD):
+            pass  # подключение и LOGIN — вне замеров
+        server.latency = latency
+        results = []
+        scenarios = [("email-oldest", email_lookup), ("sms-oldest", sms_lookup)]
+        for name, lookup in scenarios:
+            for warm in (False, True):
+                results.append({"scenario": name, "size": size, "warm": warm,
+                                **await _measure(server, lookup, repeat, warm)})
+        server.latency = 0.0
+        seed_folder(server, BENCH_FOLDER, 1, kind="otp", to=BENCH_USER)
+        server.latency = latency
+        for warm in (False, True):
+            results.append({"scenario": "email-newest", "size": size, "warm": warm,
+                            **await _measure(server, email_lookup, repeat, warm)})
+        return results
+    finally:
+        await pool.close()
+        server.stop_thread()
+
+
+def _print_table(results: list[dict]) -> None:
+    header = f"{'сценарий':<14}{'писем':>8} {'режим':<6}{'p50 мс':>9}{'p90 мс':>9}{'p99 мс':>9}{'max мс':>9}" \
+             f"{'КБ вниз':>10}{'КБ вверх':>10}{'команд':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        mark = "" if r["code_found"] else "  (код не найден!)"
+        print(
+            f"{r['scenario']:<14}{r['size']:>8} {'тёпл' if r['warm'] else 'холод':<6}"
+            f"{r['p50_ms']:>9.1f}{r['p90_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['max_ms']:>9.1f}"
+            f"{r['bytes_down'] / 1024:>10.1f}{r['bytes_up'] / 1024:>10.1f}{r['round_trips']:>8.1f}{mark}"
+        )
+
+
+def check_baseline(results: list[dict], baseline: list[dict], tolerance: float = BASELINE_TOLERANCE) -> list[str]:
+    """
+    Сравнивает детерминированные метрики (байты и команды) с базовым прогоном.
+    Задержка не сравнивается: она зависит от машины. Возвращает список регрессий.
+    """
+    known = {(b["scenario"], b["size"], b["warm"]): b for b in baseline}
+    problems = []
+    for r in results:
+        b = known.get((r["scenario"], r["size"], r["warm"]))
+        if b is None:
+            continue
+        if b["code_found"] and not r["code_found"]:
+            problems.append(f"{r['scenario']}/{r['size']}: код больше не находится")
+        for metric in ("bytes_down", "bytes_up", "round_trips"):
+            if r[metric] > b[metric] * (1 + tolerance) + 1:
+                problems.append(
+                    f"{r['scenario']}/{r['size']}/{'warm' if r['warm'] else 'cold'}: "
+                    f"{metric} {b[metric]:.0f} -> {r[metric]:.0f}"
+                )
+    return problems
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Замеры получения кодов на локальной IMAP-заглушке")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="размеры папки через запятую (по умолчанию %(default)s)")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="повторов на сценарий")
+    parser.add_argument("--latency", type=float, default=0.0, help="имитируемая задержка ответа сервера, с")
+    parser.add_argument("--json", type=Path, help="сохранить результаты в JSON")
+    parser.add_argument("--baseline", type=Path, help="JSON прошлого прогона: сравнить байты и команды")
+    parser.add_argument("--compress", action="store_true", help="включить на заглушке COMPRESS=DEFLATE")
+    args = parser.parse_args(argv)
+
+    results: list[dict] = []
+    for size in (int(s) for s in args.sizes.split(",") if s.strip()):
+        results += asyncio.run(bench_size(size, args.repeat, args.latency, args.compress))
+    _print_table(results)
+    if args.json:
+        args.json.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    if args.baseline:
+        problems = check_baseline(results, json.loads(args.baseline.read_text(encoding="utf-8")))
+        for p in problems:
+            print(f"РЕГРЕССИЯ: {p}", file=sys.stderr)
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+Замеры запуска окна: от старта процесса до появления окна (window), до загрузки движка
+поиска в фоне (engine) и — с --source — до первого кода из источника (code).
+
+Приложение запускается отдельным процессом с переменной app.STARTUP_PROBE_ENV: оно пишет
+отметки времени в файл и само закрывается. Первый код ищется в ящике из config.ini рядом
+с приложением (или с исполняемым файлом), как при обычном клике сразу после запуска.
+
+    python bench_startup.py                                   # из исходников: python app.py
+    python bench_startup.py --exe dist/EnergoChainCodeFetcher.exe
+    python bench_startup.py --exe dist/EnergoChainCodeFetcher/EnergoChainCodeFetcher.exe   # сборка папкой
+    python bench_startup.py --source "Моя почта" --repeat 3
+    python bench_startup.py --budget 0.8                      # код возврата 1, если окно появляется позже
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from app import STARTUP_PROBE_ENV, STARTUP_SOURCE_ENV
+
+DEFAULT_REPEAT = 5
+WINDOW_BUDGET = 1.0  # Бюджет на появление окна (секунд, медиана); при превышении — код возврата 1
+RUN_TIMEOUT = 120  # Один запуск: окно, движок и, с --source, ожидание кода (секунд)
+EVENTS = ("window", "engine", "code")
+
+
+def run_once(command: list[str], source: str | None) -> dict[str, float]:
+    """Один запуск приложения; {событие: секунд от старта процесса}."""
+    with tempfile.TemporaryDirectory() as tmp:
+        probe = Path(tmp) / "startup.jsonl"
+        env = dict(os.environ, **{STARTUP_PROBE_ENV: str(probe)})
+        env.pop(STARTUP_SOURCE_ENV, None)
+        if source:
+            env[STARTUP_SOURCE_ENV] = source
+        started = time.time()
+        subprocess.run(command, env=env, timeout=RUN_TIMEOUT, check=False)
+        if not probe.exists():
+            raise RuntimeError(f"{' '.join(command)}: приложение не записало ни одной отметки")
+        result = {}
+        for line in probe.read_text(encoding="utf-8").splitlines():
+            event = json.loads(line)
+            result.setdefault(event["event"], event["t"] - started)
+            if event["event"] == "code" and not event.get("found"):
+                result["code_missing"] = 1.0
+        return result
+
+
+def _print_table(runs: list[dict[str, float]]) -> None:
+    header = f"{'событие':<10}{'p50 мс':>10}{'min мс':>10}{'max мс':>10}{'замеров':>9}"
+    print(header)
+    print("-" * len(header))
+    for name in EVENTS:
+        values = [r[name] for r in runs if name in r]
+        if values:
+            print(f"{name:<10}{statistics.median(values) * 1000:>10.0f}{min(values) * 1000:>10.0f}"
+                  f"{max(values) * 1000:>10.0f}{len(values):>9}")
+    if any("code_missing" in r for r in runs):
+        print("(в части запусков код не найден — время до ответа «не найдено»)")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Замеры запуска окна: до окна, до движка, до первого кода")
+    parser.add_argument("--exe", type=Path, help="собранное приложение (по умолчанию — python app.py)")
+    parser.add_argument("--source", help="источник (подпись кнопки) для замера до первого кода")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="запусков")
+    parser.add_argument("--budget", type=float, default=WINDOW_BUDGET,
+                        help="бюджет на появление окна, с (медиана; по умолчанию %(default)s)")
+    parser.add_argument("--json", type=Path, help="сохранить замеры в JSON")
+    args = parser.parse_args(argv)
+
+    command = [str(args.exe)] if args.exe else [sys.executable, str(Path(__file__).with_name("app.py"))]
+    runs = [run_once(command, args.source) for _ in range(args.repeat)]
+    _print_table(runs)
+    if args.json:
+        args.json.write_text(json.dumps(runs, ensure_ascii=False, indent=2), encoding="utf-8")
+    windows = [r["window"] for r in runs if "window" in r]
+    if not windows:
+        print("Окно ни разу не появилось", file=sys.stderr)
+        return 1
+    if statistics.median(windows) > args.budget:
+        print(f"ПРЕВЫШЕН БЮДЖЕТ: окно через {statistics.median(windows):.2f} с (бюджет {args.budget} с)", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,8 +7,16 @@ echo [1/2] Проверка зависимостей сборки...
 pip install -r requirements-build.txt -q
 pip install -r requirements.txt -q
 
+rem build.bat onedir — сборка папкой: запуск без распаковки, окно появляется быстрее
+set SPEC_ARGS=
+set RESULT=dist\EnergoChainCodeFetcher.exe
+if /i "%~1"=="onedir" (
+    set SPEC_ARGS=-- --onedir
+    set RESULT=dist\EnergoChainCodeFetcher\EnergoChainCodeFetcher.exe
+)
+
 echo [2/2] Сборка exe (PyInstaller)...
-python -m PyInstaller --noconfirm energochain_fetcher.spec
+python -m PyInstaller --noconfirm energochain_fetcher.spec %SPEC_ARGS%
 
 if %ERRORLEVEL% neq 0 (
     echo Ошибка сборки.
@@ -16,7 +24,6 @@ if %ERRORLEVEL% neq 0 (
 )
 
 echo.
-echo Готово. Исполняемый файл: dist\EnergoChainCodeFetcher.exe
-echo Запуск из консоли: dist\EnergoChainCodeFetcher.exe
-echo Или: cd dist ^&^& EnergoChainCodeFetcher.exe
+echo Готово. Исполняемый файл: %RESULT%
+echo Запуск из консоли: %RESULT%
 exit /b 0
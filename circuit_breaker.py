@@ -0,0 +1,105 @@
+"""
+Автомат отключения (circuit breaker) по серверам IMAP.
+
+После BREAKER_FAILURES сбоев связи подряд (обрыв, отказ в подключении, нет ответа вовремя)
+запросы к серверу BREAKER_COOLDOWN секунд сразу завершаются CircuitOpenError — окно и
+пакетные вызовы не копятся в очереди за недоступным сервером и не ждут каждый свой таймаут.
+По истечении паузы пропускается один пробный запрос: успех закрывает автомат, сбой снова
+открывает его на паузу. Отказ в авторизации и ответы NO/BAD сбоем связи не считаются:
+сервер при этом отвечает.
+
+Автомат общий для всех циклов событий (окно, сервис кодов): ключ — (host, port).
+"""
+import threading
+import time
+from typing import Callable
+
+from fetch_stats import STATUS_UNAVAILABLE
+
+BREAKER_FAILURES = 3  # Сбоев связи подряд, после которых сервер считается недоступным
+BREAKER_COOLDOWN = 30.0  # Пауза, в течение которой запросы к недоступному серверу не идут (секунд)
+
+
+class CircuitOpenError(Exception):
+    """Сервер недавно был недоступен: запрос не отправлялся. retry_after — через сколько секунд будет проба."""
+
+    fetch_status = STATUS_UNAVAILABLE
+
+    def __init__(self, host: str, port: int, failures: int, retry_after: float):
+        super().__init__(
+            f"{host}:{port}: сервер недоступен ({failures} сбоев подряд), повтор через {max(retry_after, 0):.0f} с"
+        )
+        self.retry_after = retry_after
+
+
+class _HostState:
+    __slots__ = ("failures", "opened_at", "trial_at")
+
+    def __init__(self):
+        self.failures = 0
+        self.opened_at: float | None = None  # когда автомат открылся (None — закрыт)
+        self.trial_at: float | None = None  # когда пропущен пробный запрос после паузы
+
+
+class CircuitBreaker:
+    """Счётчик сбоев по серверам; check() перед подключением, record_*() — по его итогу."""
+
+    def __init__(
+        self,
+        failures: int = BREAKER_FAILURES,
+        cooldown: float = BREAKER_COOLDOWN,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._clock = clock
+        self._hosts: dict[tuple[str, int], _HostState] = {}
+        self._lock = threading.Lock()
+
+    def check(self, host: str, port: int, probe: bool = True) -> None:
+        """
+        CircuitOpenError, если запросы к серверу сейчас не идут. После паузы пропускает
+        одну пробу; probe=False — только проверить, не занимая её (например, до очереди).
+        """
+        with self._lock:
+            state = self._hosts.get((host, port))
+            if state is None or state.opened_at is None:
+                return
+            now = self._clock()
+            # Проба, не вернувшая итога (отменена), не держит автомат дольше ещё одной паузы
+            since = max(state.opened_at, state.trial_at or state.opened_at)
+            if now - since < self.cooldown:
+                raise CircuitOpenError(host, port, state.failures, self.cooldown - (now - since))
+            if probe:
+                state.trial_at = now
+
+    def record_success(self, host: str, port: int) -> None:
+        with self._lock:
+            self._hosts.pop((host, port), None)
+
+    def record_failure(self, host: str, port: int) -> None:
+        with self._lock:
+            state = self._hosts.setdefault((host, port), _HostState())
+            state.failures += 1
+            if state.failures >= self.failures or state.trial_at is not None:
+                state.opened_at = self._clock()
+                state.trial_at = None
+
+    def is_open(self, host: str, port: int) -> bool:
+        with self._lock:
+            state = self._hosts.get((host, port))
+            return state is not None and state.opened_at is not None
+
+
+_default_breaker: CircuitBreaker | None = None
+_default_lock = threading.Lock()
+
+
+def get_default_breaker() -> CircuitBreaker:
+    """Общий автомат: им пользуются все пулы IMAP-сессий, если им не передан свой."""
+    global _default_breaker
+    if _default_breaker is None:
+        with _default_lock:
+            if _default_breaker is None:
+                _default_breaker = CircuitBreaker()
+    return _default_breaker
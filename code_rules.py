@@ -0,0 +1,197 @@
+"""
+Правила извлечения кода из письма: где искать (тема, заголовок, text/plain, HTML),
+каким выражением, какой длины код и от кого письмо.
+
+Правила задаются в config.ini секциями [rule:ИМЯ] (см. config_loader.load_code_rules)
+и компилируются один раз: выражения всех правил для одного источника склеиваются
+в одно регулярное выражение, так что каждый источник письма просматривается одним
+проходом, а поиск останавливается на первом найденном коде. Тело письма скачивается,
+только если какому-то правилу нужен text/plain, HTML декодируется — только если его
+просит правило.
+"""
+import hashlib
+import re
+from functools import lru_cache
+from typing import NamedTuple
+
+SOURCE_SUBJECT = "subject"
+SOURCE_TEXT = "text"  # text/plain-части письма
+SOURCE_HTML = "html"  # text/html-части, теги отбрасываются
+HEADER_SOURCE_PREFIX = "header:"  # header:X-Code — значение заголовка X-Code
+
+_NUMERIC_BACKREF = re.compile(r"(?<!\\)(?:\\\\)*\\[1-9]")  # \1…\9 (но не экранированный обратный слэш перед цифрой)
+
+# Алфавиты кода для правил без явного pattern
+ALPHABETS = {
+    "digits": r"[0-9]",
+    # Буквы и цифры (латиница в верхнем регистре), хотя бы одна цифра — иначе под правило попадёт любое слово
+    "alnum": r"[0-9A-Z]",
+}
+DEFAULT_CODE_LENGTH = 4
+
+
+class CodeRule(NamedTuple):
+    """
+    Одно правило. pattern — регулярное выражение; если в нём есть группа (?P<code>…),
+    кодом считается она, иначе всё совпадение.
+    """
+
+    name: str
+    pattern: str
+    # Где искать; сначала всегда тема и заголовки (уже скачаны), затем text/plain, затем HTML
+    sources: tuple[str, ...] = (SOURCE_SUBJECT, SOURCE_TEXT)
+    folders: tuple[str, ...] = ()  # пусто — во всех папках
+    senders: tuple[str, ...] = ()  # подстроки заголовка From; пусто — от любых
+    marker: str | None = None  # подстрока, которая должна быть в том же источнике (например, в теле SMS)
+    length: int | None = None  # если задано — коды другой длины пропускаются
+
+    def applies_to(self, folder: str) -> bool:
+        return not self.folders or folder.lower() in (f.lower() for f in self.folders)
+
+
+def code_pattern(length: int = DEFAULT_CODE_LENGTH, alphabet: str = "digits") -> str:
+    """Выражение для кода из length символов алфавита alphabet, не внутри более длинного слова или числа."""
+    if alphabet not in ALPHABETS:
+        raise ValueError(f"неизвестный алфавит кода: {alphabet!r} (допустимо: {', '.join(ALPHABETS)})")
+    char = ALPHABETS[alphabet]
+    lookahead = r"(?=[A-Z]*[0-9])" if alphabet == "alnum" else ""
+    return rf"(?<![0-9A-Za-z]){lookahead}(?P<code>{char}{{{length}}})(?![0-9A-Za-z])"
+
+
+def make_rule(
+    name: str,
+    pattern: str | None = None,
+    sources: tuple[str, ...] = (SOURCE_SUBJECT, SOURCE_TEXT),
+    folders: tuple[str, ...] = (),
+    senders: tuple[str, ...] = (),
+    marker: str | None = None,
+    length: int | None = None,
+    alphabet: str = "digits",
+) -> CodeRule:
+    """
+    Проверяет и собирает правило. Без pattern выражение строится по length и alphabet.
+    ValueError — при неизвестном источнике или алфавите и некорректном выражении.
+    """
+    sources = tuple(dict.fromkeys(_normalize_source(name, s) for s in sources if s.strip()))
+    if not sources:
+        raise ValueError(f"правило {name!r}: не указано, где искать код")
+    if pattern is None:
+        pattern = code_pattern(length or DEFAULT_CODE_LENGTH, alphabet)
+    if _NUMERIC_BACKREF.search(pattern):
+        # В склеенном выражении номера групп сдвигаются — \1 указывал бы на чужую группу
+        raise ValueError(f"правило {name!r}: ссылки на группы по номеру (\\1) не поддерживаются — используйте (?P=code)")
+    try:
+        compiled = re.compile(pattern)
+        # Выражение будет частью склеенного: глобальные флаги вроде (?i) там недопустимы — нужно (?i:…)
+        re.compile(f"(?P<r0>{_rename_code_group(pattern, 0)})")
+    except re.error as e:
+        raise ValueError(f"правило {name!r}: некорректное выражение: {e}") from None
+    if compiled.groupindex.keys() - {"code"}:
+        raise ValueError(f"правило {name!r}: именованная группа допустима только одна — (?P<code>…)")
+    return CodeRule(name, pattern, sources, tuple(folders), tuple(s.lower() for s in senders), marker or None, length)
+
+
+def _normalize_source(rule_name: str, source: str) -> str:
+    source = source.strip()
+    if source.lower().startswith(HEADER_SOURCE_PREFIX):
+        header = source[len(HEADER_SOURCE_PREFIX):].strip()
+        if header:
+            return HEADER_SOURCE_PREFIX + header.lower()
+    elif source.lower() in (SOURCE_SUBJECT, SOURCE_TEXT, SOURCE_HTML):
+        return source.lower()
+    raise ValueError(f"правило {rule_name!r}: неизвестный источник {source!r}")
+
+
+class CompiledRules:
+    """
+    Набор правил, готовый к поиску. Для каждого источника — одно склеенное выражение
+    (отдельное для каждого сочетания правил, подходящих письму по отправителю и маркеру;
+    такие сочетания кэшируются).
+    """
+
+    def __init__(self, rules: tuple[CodeRule, ...]):
+        self.rules = rules
+        ordered: list[str] = []
+        for rule in rules:
+            for source in rule.sources:
+                if source not in ordered:
+                    ordered.append(source)
+        self._by_source = {s: tuple(i for i, r in enumerate(rules) if s in r.sources) for s in ordered}
+        header_sources = [s for s in ordered if s not in (SOURCE_TEXT, SOURCE_HTML)]
+        # Тема и заголовки — до тела: их уже скачали в первой фазе обхода
+        self.header_sources = tuple(sorted(header_sources, key=lambda s: s != SOURCE_SUBJECT))
+        self.body_sources = tuple(s for s in (SOURCE_TEXT, SOURCE_HTML) if s in ordered)
+        self.needs_html = SOURCE_HTML in ordered
+        self.extra_headers = tuple(
+            dict.fromkeys(s[len(HEADER_SOURCE_PREFIX):].upper() for s in header_sources if s != SOURCE_SUBJECT)
+        )
+        self.fingerprint = hashlib.sha1(repr(rules).encode("utf-8")).hexdigest()[:12]
+        self._combined: dict[tuple[int, ...], re.Pattern] = {}
+
+    @property
+    def needs_body(self) -> bool:
+        return bool(self.body_sources)
+
+    def senders(self) -> tuple[str, ...]:
+        """Отправители, если каждое правило ограничено ими (тогда их можно проверить на сервере), иначе ()."""
+        if not self.rules or any(not r.senders for r in self.rules):
+            return ()
+        return tuple(dict.fromkeys(s for r in self.rules for s in r.senders))
+
+    def search(self, source: str, value: str | None, sender: str = "") -> str | None:
+        """Первый код в value по правилам источника source, подходящим письму от sender."""
+        indexes = self._by_source.get(source)
+        if not indexes or not value:
+            return None
+        sender = sender.lower()
+        active = tuple(
+            i for i in indexes
+            if (not self.rules[i].senders or any(s in sender for s in self.rules[i].senders))
+            and (self.rules[i].marker is None or self.rules[i].marker in value)
+        )
+        if not active:
+            return None
+        combined = self._combined.get(active)
+        if combined is None:
+            combined = self._combined[active] = re.compile(
+                "|".join(f"(?P<r{i}>{_rename_code_group(self.rules[i].pattern, i)})" for i in active)
+            )
+        for found in combined.finditer(value):
+            index = int(found.lastgroup[1:])
+            rule = self.rules[index]
+            code = found.group(f"c{index}") if f"c{index}" in combined.groupindex else found.group(0)
+            if code and (rule.length is None or len(code) == rule.length):
+                return code
+            # Склеенное выражение на каждой позиции пробует одно правило: совпавшее, но не той длины,
+            # заслонило бы следующие — дальше каждое правило ищем отдельно (редкий случай)
+            return self._search_each(active, value, found.start())
+        return None
+
+    def _search_each(self, active: tuple[int, ...], value: str, pos: int) -> str | None:
+        """Самый ранний код подходящей длины начиная с pos, каждое правило — своим выражением."""
+        best: tuple[int, str] | None = None
+        for i in active:
+            rule = self.rules[i]
+            pattern = re.compile(rule.pattern)
+            for found in pattern.finditer(value, pos):
+                code = found.group("code") if "code" in pattern.groupindex else found.group(0)
+                if code and (rule.length is None or len(code) == rule.length):
+                    # При равной позиции побеждает правило, стоящее раньше
+                    if best is None or found.start() < best[0]:
+                        best = (found.start(), code)
+                    break
+        return best[1] if best else None
+
+
+def _rename_code_group(pattern: str, index: int) -> str:
+    # В склеенном выражении имена групп должны быть уникальны: code -> c<номер правила>
+    return pattern.replace("(?P<code>", f"(?P<c{index}>").replace("(?P=code)", f"(?P=c{index})")
+
+
+@lru_cache(maxsize=64)
+def compile_rules(rules: tuple[CodeRule, ...]) -> CompiledRules:
+    return CompiledRules(rules)
+
+
+def rules_for_folder(rules: tuple[CodeRule, ...], folder: str) -> tuple[CodeRule, ...]:
+    return tuple(r for r in rules if r.applies_to(folder))
@@ -0,0 +1,378 @@
+"""
+Сервис кодов без окна: HTTP API на localhost для автотестов.
+
+Держит авторизованные IMAP-сессии (пул с подключением заранее и NOOP keepalive)
+и отдаёт коды по HTTP, так что тестам не нужно ни окно, ни холодное подключение
+из каждого процесса. Учётные данные и правила — из того же config.ini, что и у app.py
+(при изменении файла перечитываются).
+
+    python code_server.py                  # адрес и порт — из [server] в config.ini
+    python code_server.py --port 9000
+
+    GET /code?folder=autotest                          код из папки корпоративной почты
+    GET /code?folder=autotest&recipient=u@example.com  только письма на этот адрес (TO)
+    GET /code?folder=sms&wait=20                       ждать новое письмо до 20 секунд
+    GET /code?folder=all                               самый свежий код из источников «Все папки» (in_all)
+    GET /code?folder=my                                личная почта (папка из настроек)
+    GET /code?folder=autotest&fresh=1                  мимо кэша результатов (только с сервера)
+    GET /code?source=stand2                            источник [source:stand2] из config.ini (любой ящик)
+    GET /codes?folder=autotest&recipient=a@x&recipient=b@x   коды многих получателей одним проходом
+    GET /health
+
+Ответ — JSON: 200 {"code": "1234", "folder": "autotest", "elapsed": 0.05};
+/codes — 200 {"codes": {"a@x": "1234", "b@x": null}, "folder": "autotest", "elapsed": 0.05};
+404 — код не найден (ни одного); 400 — неверные параметры; 431 — слишком длинная строка запроса или заголовок; 502 — ошибка IMAP или отказ во входе;
+503 — не настроена почта или сервер временно отключён после сбоев подряд; 504 — сервер не ответил вовремя.
+В ответах с ошибкой поиска status — итог из fetch_stats: auth_failed, unavailable, timeout или error.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from app_dir import get_base_dir
+from config_loader import (
+    CONFIG_NAME,
+    load_code_rules,
+    load_fetch_options,
+    load_imap_config,
+    load_server_options,
+    load_sources,
+)
+from code_sources import MODE_EMAIL, MODE_SMS
+from email_code_fetcher import (
+    PLATFORM_OTP_SUBJECT_MARKERS,
+    RESULT_CACHE_TTL,
+    fetch_code_from_sources_async,
+    get_auth_code_from_email_async,
+    get_auth_code_from_sms_async,
+    get_auth_code_from_source_async,
+    get_auth_codes_for_recipients_async,
+)
+from fetch_stats import STATUS_TIMEOUT, STATUS_UNAVAILABLE, FetchStats
+from imap_pool import ImapSessionPool
+
+MAX_WAIT = 120  # Дольше ждать письмо по одному запросу нельзя (секунд)
+LISTEN_BACKLOG = 1024  # Очередь входящих соединений: сотни тестовых процессов подключаются разом
+MAX_HEADER_LINES = 100
+
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    431: "Request Header Fields Too Large",
+    502: "Bad Gateway",
+    503: "Service Unavailable",
+    504: "Gateway Timeout",
+}
+# HTTP-статус ответа по итогу неудачного поиска (FetchStats.status)
+_ERROR_STATUSES = {STATUS_TIMEOUT: 504, STATUS_UNAVAILABLE: 503}
+
+
+class CodeServer:
+    """Обработчик HTTP-запросов поверх общего пула IMAP-сессий (один цикл событий на все запросы)."""
+
+    def __init__(self, pool: ImapSessionPool, quiet: bool = False):
+        self.pool = pool
+        self.quiet = quiet
+        self._config_loaded = False
+        self._config_mtime: float | None = None
+        self._warmed: set[tuple[str, int, str]] = set()  # (host, port, email) ящиков, подключённых prewarm
+        self._reload_config()
+
+    def _reload_config(self) -> None:
+        """Перечитывает config.ini, если он изменился (например, сохранён из окна app.py)."""
+        path = get_base_dir() / CONFIG_NAME
+        mtime = path.stat().st_mtime if path.exists() else None
+        if self._config_loaded and mtime == self._config_mtime:
+            return
+        self._config_loaded = True
+        self._config_mtime = mtime
+        self.imap_host, self.imap_port, self.personal, self.corporate, _ = load_imap_config()
+        self.fetch_options = load_fetch_options()
+        self.rules, errors = load_code_rules()
+        self.accounts, self.sources, source_errors = load_sources()
+        for error in errors + source_errors:
+            print(f"Секция пропущена: {error}", file=sys.stderr)
+        self.prewarm()
+
+    def prewarm(self) -> None:
+        """
+        Подключает все ящики заранее, сразу с папками их источников (не больше max_idle на ящик).
+        Сессии ящиков, которых в config.ini больше нет, закрываются.
+        """
+        warmed = {(a.host, a.port, a.email) for a in self.accounts if a.configured}
+        for host, port, email in self._warmed - warmed:
+            self.pool.set_max_busy(host, port, email, None)
+            asyncio.ensure_future(self.pool.discard(host, port, email))
+        self._warmed = warmed
+        for account in self.accounts:
+            if not account.configured:
+                continue
+            folders = list(dict.fromkeys(s.folder for s in self.sources if s.account == account.name))
+            self.pool.set_max_busy(account.host, account.port, account.email, account.max_busy)
+            asyncio.ensure_future(self.pool.prewarm(
+                account.host, account.port, account.email, account.password, folders[: self.pool.max_idle]
+            ))
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Одно соединение: запросы по очереди, пока клиент держит keep-alive."""
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except ValueError:
+                    # Строка запроса или заголовок длиннее буфера StreamReader (LimitOverrunError):
+                    # дочитать такой запрос нельзя — отвечаем и закрываем соединение
+                    await _respond(writer, 431, {"error": "слишком длинная строка запроса или заголовок"}, False)
+                    break
+                if request is None:
+                    break
+                method, target, keep_alive = request
+                started = time.perf_counter()
+                status, body = await self.dispatch(method, target)
+                if not self.quiet:
+                    print(f"{method} {target} {status} {time.perf_counter() - started:.3f}s", flush=True)
+                await _respond(writer, status, body, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method: str, target: str) -> tuple[int, dict]:
+        if method != "GET":
+            return 405, {"error": "поддерживается только GET"}
+        url = urlsplit(target)
+        if url.path == "/health":
+            return 200, {"ok": True}
+        if url.path not in ("/code", "/codes"):
+            return 404, {"error": f"нет такого адреса: {url.path}"}
+        query = parse_qs(url.query)
+        params = {k: v[-1] for k, v in query.items()}
+        folder = params.get("folder", "").strip()
+        source = params.get("source", "").strip()
+        if not folder and not source:
+            return 400, {"error": "не указан параметр folder или source"}
+        try:
+            wait = max(0.0, min(float(params.get("wait") or 0), MAX_WAIT))
+        except ValueError:
+            return 400, {"error": "wait должен быть числом секунд"}
+        fresh = params.get("fresh", "") in ("1", "true", "yes")
+        if url.path == "/codes":
+            # Получатели — повтором параметра или через запятую
+            recipients = [r.strip() for v in query.get("recipient", []) for r in v.split(",") if r.strip()]
+            if not folder or folder in ("all", "sms") or not recipients:
+                return 400, {"error": "для /codes нужны папка (не all и не sms) и хотя бы один recipient"}
+            return await self.find_recipient_codes(folder, recipients, wait)
+        if source:
+            return await self.find_source_code(source, wait, fresh)
+        return await self.find_code(folder, params.get("recipient", "").strip() or None, wait, fresh)
+
+    async def find_code(self, folder: str, recipient: str | None, wait: float, fresh: bool = False) -> tuple[int, dict]:
+        """
+        Код из папки folder корпоративной почты («my» — личная почта, «all» — find_all_code).
+        С recipient ищутся письма на этот адрес (TO) без проверки формата темы платформы,
+        без него — как кнопки в окне. Одинаковые одновременные запросы обслуживает
+        один поиск, повтор сразу после найденного кода отвечается из памяти (fresh — мимо кэша).
+        """
+        self._reload_config()
+        if folder == "all":
+            return await self.find_all_code(recipient, wait, fresh)
+        account = self.personal if folder == "my" else self.corporate
+        if not account.email or not account.password:
+            return 503, {"error": f"в {CONFIG_NAME} не указана {'личная' if folder == 'my' else 'корпоративная'} почта"}
+        collected: list[FetchStats] = []
+        common = dict(
+            imap_user=account.email,
+            imap_password=account.password,
+            imap_host=self.imap_host,
+            imap_port=self.imap_port,
+            pool=self.pool,
+            wait=wait or None,
+            max_age=self.fetch_options.max_age_minutes * 60 or None,
+            rules=self.rules,
+            cache_ttl=0 if fresh else RESULT_CACHE_TTL,
+            on_stats=collected.append,
+        )
+        subject_contains = None if recipient else PLATFORM_OTP_SUBJECT_MARKERS
+        started = time.perf_counter()
+        if folder == "sms":
+            code, found_folder = await get_auth_code_from_sms_async(folder=folder, **common), folder
+        else:
+            found_folder = self.personal.folder if folder == "my" else folder
+            code = await get_auth_code_from_email_async(
+                recipient or account.email,
+                found_folder,
+                subject_contains=subject_contains,
+                senders=self.fetch_options.senders,
+                **common,
+            )
+        return _found(code, found_folder, collected, started)
+
+    async def find_all_code(self, recipient: str | None, wait: float, fresh: bool = False) -> tuple[int, dict]:
+        """
+        Код из всех источников с in_all — тот же набор, что у кнопки «Все папки» в окне
+        (и те же папки, что подключает prewarm). С recipient — только письма на этот адрес:
+        источники ищутся в режиме email, SMS-источники пропускаются.
+        """
+        sources = [s for s in self.sources if s.in_all]
+        if recipient:
+            sources = [s._replace(mode=MODE_EMAIL, recipient=recipient) for s in sources if s.mode != MODE_SMS]
+        used = {s.account for s in sources}
+        if not any(a.configured for a in self.accounts if a.name in used):
+            return 503, {"error": f"в {CONFIG_NAME} нет ящика с адресом и паролем для источников «Все папки»"}
+        collected: list[FetchStats] = []
+        started = time.perf_counter()
+        result = await fetch_code_from_sources_async(
+            sources,
+            self.accounts,
+            pool=self.pool,
+            wait=wait or None,
+            senders=self.fetch_options.senders,
+            max_age=self.fetch_options.max_age_minutes * 60 or None,
+            rules=self.rules,
+            cache_ttl=0 if fresh else RESULT_CACHE_TTL,
+            on_stats=collected.append,
+        )
+        found_folder = next((s.folder for s in sources if s.name == result.label), None)
+        return _found(result.code, found_folder, collected, started)
+
+    async def find_recipient_codes(self, folder: str, recipients: list[str], wait: float) -> tuple[int, dict]:
+        """
+        Коды для многих получателей (TO или Delivered-To) одним проходом по папке folder
+        («my» — личная почта); с wait — ждёт письма для тех, кому кода ещё нет.
+        """
+        self._reload_config()
+        account = self.personal if folder == "my" else self.corporate
+        if not account.email or not account.password:
+            return 503, {"error": f"в {CONFIG_NAME} не указана {'личная' if folder == 'my' else 'корпоративная'} почта"}
+        found_folder = self.personal.folder if folder == "my" else folder
+        collected: list[FetchStats] = []
+        started = time.perf_counter()
+        codes = await get_auth_codes_for_recipients_async(
+            recipients,
+            found_folder,
+            account.email,
+            account.password,
+            self.imap_host,
+            self.imap_port,
+            pool=self.pool,
+            wait=wait or None,
+            senders=self.fetch_options.senders,
+            max_age=self.fetch_options.max_age_minutes * 60 or None,
+            rules=self.rules,
+            on_stats=collected.append,
+        )
+        status, body = _found(next((c for c in codes.values() if c), None), found_folder, collected, started)
+        body.pop("code")
+        return status, {"codes": codes, **body}
+
+    async def find_source_code(self, name: str, wait: float, fresh: bool = False) -> tuple[int, dict]:
+        """Код из источника name (секция [source:ИМЯ] или кнопка окна по умолчанию) на его ящике."""
+        self._reload_config()
+        source = next((s for s in self.sources if s.name == name), None)
+        if source is None:
+            return 404, {"error": f"нет источника {name!r}"}
+        account = next(a for a in self.accounts if a.name == source.account)
+        if not account.configured:
+            return 503, {"error": f"в {CONFIG_NAME} не указан адрес или пароль ящика {account.name!r}"}
+        collected: list[FetchStats] = []
+        started = time.perf_counter()
+        code = await get_auth_code_from_source_async(
+            source,
+            account,
+            pool=self.pool,
+            wait=wait or None,
+            senders=self.fetch_options.senders,
+            max_age=self.fetch_options.max_age_minutes * 60 or None,
+            rules=self.rules,
+            cache_ttl=0 if fresh else RESULT_CACHE_TTL,
+            on_stats=collected.append,
+        )
+        return _found(code, source.folder, collected, started)
+
+
+def _found(code: str | None, folder: str | None, collected: list[FetchStats], started: float) -> tuple[int, dict]:
+    """Ответ на запрос кода: 200 с кодом, 404 или ошибка поиска из замеров (502, 503, 504)."""
+    elapsed = round(time.perf_counter() - started, 4)
+    if code is not None:
+        return 200, {"code": code, "folder": folder, "elapsed": elapsed}
+    stats = collected[-1] if collected else None
+    if stats is not None and stats.error:
+        body = {"code": None, "status": stats.status, "error": stats.error, "elapsed": elapsed}
+        return _ERROR_STATUSES.get(stats.status, 502), body
+    return 404, {"code": None, "elapsed": elapsed}
+
+
+async def _read_request(reader: asyncio.StreamReader) -> tuple[str, str, bool] | None:
+    """(метод, путь, keep-alive) очередного запроса или None, если клиент закрыл соединение."""
+    line = await reader.readline()
+    if not line:
+        return None
+    headers: dict[str, str] = {}
+    for _ in range(MAX_HEADER_LINES):
+        header = await reader.readline()
+        if header in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = header.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = headers.get("content-length", "0")
+    if length.isdigit() and int(length):
+        await reader.readexactly(int(length))  # тело GET не нужно, но его надо вычитать
+    parts = line.decode("latin-1").split()
+    if len(parts) != 3:
+        return "", "", False
+    method, target, version = parts
+    connection = headers.get("connection", "").lower()
+    keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+    return method.upper(), target, keep_alive
+
+
+async def _respond(writer: asyncio.StreamWriter, status: int, body: dict, keep_alive: bool) -> None:
+    payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+    head = (
+        f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+        "Content-Type: application/json; charset=utf-8\r\n"
+        f"Content-Length: {len(payload)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        "\r\n"
+    ).encode("ascii")
+    writer.write(head + payload)
+    await writer.drain()
+
+
+async def serve(host: str, port: int, max_busy: int, quiet: bool = False) -> None:
+    pool = ImapSessionPool(max_busy=max_busy)
+    handler = CodeServer(pool, quiet=quiet)
+    server = await asyncio.start_server(handler.handle, host, port, backlog=LISTEN_BACKLOG)
+    print(f"Сервис кодов: http://{host}:{port}/code?folder=autotest", flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await pool.close()
+
+
+def main(argv: list[str] | None = None) -> int:
+    options = load_server_options()
+    parser = argparse.ArgumentParser(description="Сервис кодов: HTTP API на localhost поверх IMAP")
+    parser.add_argument("--host", default=options.host, help="адрес (по умолчанию %(default)s)")
+    parser.add_argument("--port", type=int, default=options.port, help="порт (по умолчанию %(default)s)")
+    parser.add_argument("--max-busy", type=int, default=options.max_busy,
+                        help="сколько IMAP-сессий одного ящика работают одновременно (по умолчанию %(default)s)")
+    parser.add_argument("--quiet", action="store_true", help="не печатать строку на каждый запрос")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, max(1, args.max_busy), args.quiet))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
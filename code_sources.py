@@ -0,0 +1,76 @@
+"""
+Ящики и источники кодов.
+
+Ящик (Account) — IMAP-сервер и учётные данные. Источник (Source) — где и как искать код:
+ящик, папка и режим; каждому источнику в окне соответствует кнопка. В config.ini задаются
+секциями [account:ИМЯ] и [source:ИМЯ] (см. config_loader.load_sources). Без секций
+[source:…] источники прежние: личная почта и папки корпоративной (default_sources).
+"""
+from typing import Iterable, NamedTuple
+
+MODE_PLATFORM = "platform"  # письма платформы: тема «1234 — …», без фильтра по получателю
+MODE_EMAIL = "email"  # письма на адрес получателя (TO), тема любая
+MODE_SMS = "sms"  # SMS, пересланные письмом: тема — номер, код в теле с маркером
+SOURCE_MODES = (MODE_PLATFORM, MODE_EMAIL, MODE_SMS)
+
+# Ящики из [personal] и [corporate] (их правит окно настроек)
+PERSONAL_ACCOUNT = "personal"
+CORPORATE_ACCOUNT = "corporate"
+PERSONAL_SOURCE = "Моя почта"
+
+
+class Account(NamedTuple):
+    name: str
+    email: str
+    password: str
+    host: str
+    port: int
+    max_busy: int | None = None  # сколько сессий ящика работают одновременно; None — как у пула
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.email and self.password)
+
+
+class Source(NamedTuple):
+    name: str  # подпись кнопки; уникально
+    account: str  # имя ящика (Account.name)
+    folder: str
+    mode: str = MODE_PLATFORM
+    recipient: str | None = None  # для MODE_EMAIL: адрес получателя; None — адрес самого ящика
+    in_all: bool = True  # участвует в поиске по всем источникам («Все папки»)
+
+
+def make_source(
+    name: str,
+    account: str,
+    folder: str,
+    mode: str = MODE_PLATFORM,
+    recipient: str | None = None,
+    in_all: bool = True,
+    accounts: Iterable[str] = (),
+) -> Source:
+    """
+    Проверяет и собирает источник. accounts — имена известных ящиков.
+    ValueError — при неизвестном ящике или режиме и пустой папке.
+    """
+    mode = mode.strip().lower() or MODE_PLATFORM
+    if mode not in SOURCE_MODES:
+        raise ValueError(f"источник {name!r}: неизвестный режим {mode!r} (допустимо: {', '.join(SOURCE_MODES)})")
+    if account not in set(accounts):
+        raise ValueError(f"источник {name!r}: нет ящика {account!r} (секция [account:{account}])")
+    if not folder.strip():
+        raise ValueError(f"источник {name!r}: не указана папка")
+    return Source(name, account, folder.strip(), mode, recipient or None, in_all)
+
+
+def default_sources(personal_folder: str, corporate_folders: Iterable[str]) -> tuple[Source, ...]:
+    """Прежний набор кнопок: личная почта и папки корпоративной («sms» — в режиме SMS)."""
+    return (
+        # Личная почта в «Все папки» не входила: там ищутся только папки корпоративной
+        Source(PERSONAL_SOURCE, PERSONAL_ACCOUNT, personal_folder, MODE_PLATFORM, in_all=False),
+        *(
+            Source(folder, CORPORATE_ACCOUNT, folder, MODE_SMS if folder == "sms" else MODE_PLATFORM)
+            for folder in corporate_folders
+        ),
+    )
@@ -3,10 +3,22 @@ from pathlib import Path
 from typing import NamedTuple
 
 from app_dir import get_base_dir
+from code_rules import CodeRule, make_rule
+from code_sources import CORPORATE_ACCOUNT, PERSONAL_ACCOUNT, Account, Source, default_sources, make_source
 
 CONFIG_NAME = "config.ini"
 DEFAULT_HOST = "imap.yandex.ru"
 DEFAULT_PORT = 993
+DEFAULT_MAX_AGE_MINUTES = 15
+RULE_SECTION_PREFIX = "rule:"
+ACCOUNT_SECTION_PREFIX = "account:"
+SOURCE_SECTION_PREFIX = "source:"
+# Папки корпоративной почты с кодами (кнопки в окне, «Все папки», папки сервиса кодов), если в config.ini
+# не заданы свои источники [source:ИМЯ]
+CORPORATE_FOLDERS = ("uneco", "eak", "sale", "svet1", "sms", "autotest")
+DEFAULT_SERVER_HOST = "127.0.0.1"
+DEFAULT_SERVER_PORT = 8765
+DEFAULT_SERVER_MAX_BUSY = 8
 
 
 class PersonalConfig(NamedTuple):
@@ -20,6 +32,18 @@ class CorporateConfig(NamedTuple):
     password: str
 
 
+class ServerOptions(NamedTuple):
+    host: str
+    port: int
+    max_busy: int  # сколько IMAP-сессий одного ящика сервис кодов держит занятыми одновременно
+
+
+class FetchOptions(NamedTuple):
+    max_age_minutes: int  # 0 — без ограничения по возрасту письма
+    senders: tuple[str, ...]
+    stats_log: bool  # дописывать замеры каждого запроса в fetch_stats.jsonl
+
+
 def _path() -> Path:
     return get_base_dir() / CONFIG_NAME
 
@@ -72,6 +96,152 @@ def load_imap_config() -> tuple[str, int, PersonalConfig, CorporateConfig, dict]
     return host, port, personal_config, corporate_config, ui_dict
 
 
+def load_fetch_options() -> FetchOptions:
+    """
+    Читает секцию [fetch] из config.ini: условия, которые уходят в IMAP SEARCH.
+    max_age_minutes — письма старше не рассматриваются (0 — без ограничения);
+    senders — адреса отправителей кодов через запятую (пусто — любые);
+    stats_log — писать замеры запросов в fetch_stats.jsonl (по умолчанию нет).
+    """
+    cfg = configparser.ConfigParser()
+    if _path().exists():
+        cfg.read(_path(), encoding="utf-8")
+    fetch = _section(cfg, "fetch")
+    try:
+        max_age = max(0, int(fetch.get("max_age_minutes", str(DEFAULT_MAX_AGE_MINUTES)).strip()))
+    except ValueError:
+        max_age = DEFAULT_MAX_AGE_MINUTES
+    senders = _split(fetch.get("senders", ""))
+    stats_log = fetch.get("stats_log", "false").strip().lower() in ("1", "true", "yes")
+    return FetchOptions(max_age_minutes=max_age, senders=senders, stats_log=stats_log)
+
+
+def load_server_options() -> ServerOptions:
+    """Читает секцию [server] из config.ini (сервис кодов code_server.py): host, port, max_busy."""
+    cfg = configparser.ConfigParser()
+    if _path().exists():
+        cfg.read(_path(), encoding="utf-8")
+    server = _section(cfg, "server")
+    host = server.get("host", DEFAULT_SERVER_HOST).strip() or DEFAULT_SERVER_HOST
+    try:
+        port = int(server.get("port", str(DEFAULT_SERVER_PORT)).strip())
+    except ValueError:
+        port = DEFAULT_SERVER_PORT
+    try:
+        max_busy = max(1, int(server.get("max_busy", str(DEFAULT_SERVER_MAX_BUSY)).strip()))
+    except ValueError:
+        max_busy = DEFAULT_SERVER_MAX_BUSY
+    return ServerOptions(host=host, port=port, max_busy=max_busy)
+
+
+def _split(value: str) -> tuple[str, ...]:
+    return tuple(v.strip() for v in value.split(",") if v.strip())
+
+
+def load_code_rules() -> tuple[tuple[CodeRule, ...], list[str]]:
+    """
+    Читает правила извлечения кода — секции [rule:ИМЯ] из config.ini, в порядке следования:
+    pattern — регулярное выражение (группа (?P<code>…) — сам код); без него код собирается
+    по length (по умолчанию 4) и alphabet (digits или alnum);
+    where — где искать через запятую: subject, header:Имя-Заголовка, text, html (по умолчанию subject, text);
+    folders — папки через запятую (пусто — все); senders — отправители; marker — обязательная
+    подстрока рядом с кодом (в том же источнике); length — коды другой длины пропускаются.
+    Возвращает (правила, ошибки): некорректные правила пропускаются, ошибки — для показа пользователю.
+    """
+    cfg = configparser.ConfigParser()
+    if _path().exists():
+        cfg.read(_path(), encoding="utf-8")
+    rules: list[CodeRule] = []
+    errors: list[str] = []
+    for section in cfg.sections():
+        if not section.lower().startswith(RULE_SECTION_PREFIX):
+            continue
+        name = section[len(RULE_SECTION_PREFIX):].strip() or section
+        # raw: в регулярных выражениях бывает «%», интерполяция configparser его бы испортила
+        values = dict(cfg.items(section, raw=True))
+        try:
+            length = values.get("length", "").strip()
+            rules.append(make_rule(
+                name,
+                pattern=values.get("pattern") or None,
+                sources=_split(values.get("where", "subject, text")),
+                folders=_split(values.get("folders", "")),
+                senders=_split(values.get("senders", "")),
+                marker=values.get("marker", "").strip() or None,
+                length=int(length) if length else None,
+                alphabet=values.get("alphabet", "digits").strip().lower() or "digits",
+            ))
+        except ValueError as e:
+            errors.append(f"[{section}]: {e}")
+    return tuple(rules), errors
+
+
+def load_sources() -> tuple[tuple[Account, ...], tuple[Source, ...], list[str]]:
+    """
+    Читает ящики и источники кодов из config.ini.
+    Ящики: personal и corporate (секции [personal], [corporate], сервер — из [imap]) и секции
+    [account:ИМЯ]: email, password, host и port (по умолчанию — из [imap]), max_busy — сколько
+    сессий ящика работают одновременно. Секция [account:personal] заменяет [personal] и т.п.
+    Источники — секции [source:ИМЯ] в порядке следования: account, folder, mode (platform, email
+    или sms), recipient (для email; по умолчанию — адрес ящика), in_all (участвует в «Все папки»,
+    по умолчанию да). Без секций [source:…] — прежние кнопки: личная почта и CORPORATE_FOLDERS.
+    Возвращает (ящики, источники, ошибки): некорректные секции пропускаются.
+    """
+    host, port, personal, corporate, _ = load_imap_config()
+    accounts = {
+        PERSONAL_ACCOUNT: Account(PERSONAL_ACCOUNT, personal.email, personal.password, host, port),
+        CORPORATE_ACCOUNT: Account(CORPORATE_ACCOUNT, corporate.email, corporate.password, host, port),
+    }
+    cfg = configparser.ConfigParser()
+    if _path().exists():
+        cfg.read(_path(), encoding="utf-8")
+    errors: list[str] = []
+    source_sections: list[str] = []
+    for section in cfg.sections():
+        if section.lower().startswith(SOURCE_SECTION_PREFIX):
+            source_sections.append(section)
+        if not section.lower().startswith(ACCOUNT_SECTION_PREFIX):
+            continue
+        name = section[len(ACCOUNT_SECTION_PREFIX):].strip()
+        # raw: в паролях бывает «%», интерполяция configparser его бы испортила
+        values = dict(cfg.items(section, raw=True))
+        try:
+            account_port = values.get("port", "").strip()
+            max_busy = values.get("max_busy", "").strip()
+            accounts[name] = Account(
+                name=name,
+                email=values.get("email", "").strip(),
+                password=values.get("password", "").strip(),
+                host=values.get("host", "").strip() or host,
+                port=int(account_port) if account_port else port,
+                max_busy=max(1, int(max_busy)) if max_busy else None,
+            )
+        except ValueError as e:
+            errors.append(f"[{section}]: {e}")
+    if not source_sections:
+        return tuple(accounts.values()), default_sources(personal.folder, CORPORATE_FOLDERS), errors
+    sources: dict[str, Source] = {}
+    for section in source_sections:
+        name = section[len(SOURCE_SECTION_PREFIX):].strip() or section
+        values = dict(cfg.items(section, raw=True))
+        if name in sources:
+            errors.append(f"[{section}]: источник с таким именем уже есть")
+            continue
+        try:
+            sources[name] = make_source(
+                name,
+                account=values.get("account", CORPORATE_ACCOUNT).strip(),
+                folder=values.get("folder", "INBOX"),
+                mode=values.get("mode", ""),
+                recipient=values.get("recipient", "").strip() or None,
+                in_all=values.get("in_all", "true").strip().lower() in ("1", "true", "yes"),
+                accounts=accounts,
+            )
+        except ValueError as e:
+            errors.append(f"[{section}]: {e}")
+    return tuple(accounts.values()), tuple(sources.values()), errors
+
+
 def save_config(
     host: str,
     port: int,
@@ -80,8 +250,10 @@ def save_config(
     copy_to_clipboard: bool,
     always_on_top: bool,
 ) -> None:
-    """Перезаписывает config.ini новыми данными."""
+    """Перезаписывает config.ini новыми данными (прочие секции, например [fetch], сохраняются)."""
     cfg = configparser.ConfigParser()
+    if _path().exists():
+        cfg.read(_path(), encoding="utf-8")
     cfg["imap"] = {"host": host, "port": str(port)}
     cfg["personal"] = {
         "email": personal.email,
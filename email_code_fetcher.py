@@ -1,7 +1,40 @@
+import asyncio
+import base64
+import email
+import contextlib
+import hashlib
+import html
+import os
+import quopri
 import re
-from imap_tools import MailBox, AND
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from email.header import decode_header, make_header
+from email.utils import getaddresses, parsedate_to_datetime
+from typing import AsyncIterator, Awaitable, Callable, Collection, Iterable, Iterator, Mapping, NamedTuple, Sequence
+
+from imap_tools import AND, OR, H, U
 import time
 
+import fetch_stats
+import imap_client
+from code_rules import (
+    HEADER_SOURCE_PREFIX,
+    SOURCE_HTML,
+    SOURCE_SUBJECT,
+    SOURCE_TEXT,
+    CodeRule,
+    CompiledRules,
+    compile_rules,
+    rules_for_folder,
+)
+from code_sources import MODE_EMAIL, MODE_PLATFORM, MODE_SMS, SOURCE_MODES, Account, Source
+from fetch_stats import FetchStats
+from imap_client import FetchPipeline, ImapClient, ImapError, ImapTimeout, time_left
+from imap_pool import ImapSessionPool, get_default_pool, run_sync
+from single_flight import ResultCache, get_single_flight
+from uid_watermarks import UidWatermarks, Watermark, get_default_watermarks
+
 CODE_REGEX = re.compile(r"\d{4}")
 # Формат темы письма с кодом: "4 цифры, пробел, тире" (напр. "5787 — ..." или "2727 - ...")
 SUBJECT_CODE_FORMAT = re.compile(r"\d{4}\s+[—\-]")
@@ -10,14 +43,756 @@ PLATFORM_OTP_SUBJECT_MARKERS = ()
 # В теле SMS-писем: код в теле, тема = номер телефона. Фильтр по телу, чтобы не брать левые цифры.
 SMS_BODY_MARKER = "одноразовый код для подтверждения номера телефона на Платформе"
 WAIT_TIMEOUT = 20  # Максимальное время ожидания кода (секунд)
+# Срок запроса кода сверх ожидания wait (секунд): подключение, вход, очередь, поиск и загрузка
+# вместе; каждый шаг получает не больше оставшегося, по истечении — итог «таймаут»
+FETCH_TIMEOUT = 30
+# Коды старше этого возраста бесполезны: такие письма отсекаются ещё на сервере (SINCE) и по заголовку Date (секунд)
+CODE_MAX_AGE = 15 * 60
+# Известные адреса отправителей кодов платформы; если заданы — ищем только письма от них (FROM)
+PLATFORM_SENDERS: tuple[str, ...] = ()
 
 DEBUG_EMAIL_FETCH = False
 
-# Размер порции при обходе папки (ищем по всем непрочитанным, от новых к старым)
+# Размер порции при обходе папки (ищем по всем непрочитанным, от новых к старым): первая порция —
+# EMAIL_FETCH_CHUNK писем, каждая следующая вдвое больше, до EMAIL_FETCH_CHUNK_MAX
 EMAIL_FETCH_CHUNK = 20
+EMAIL_FETCH_CHUNK_MAX = 320
+# Сколько UID FETCH держать в полёте при глубоком обходе; окно растёт с 1 после каждой порции без кода
+EMAIL_FETCH_PIPELINE = 4
+# Первая фаза обхода: только эти заголовки (без тел и вложений); правила из config.ini могут добавить свои
+EMAIL_HEADER_FIELDS = "SUBJECT FROM TO DATE CONTENT-TYPE CONTENT-TRANSFER-ENCODING"
+# Вторая фаза: сколько байт тела (BODY.PEEK[TEXT]<0.N>) скачивать для поиска кода в тексте
+EMAIL_BODY_PEEK_BYTES = 16 * 1024
+# Тела запрашиваются группами не больше этого объёма (по EMAIL_BODY_PEEK_BYTES на письмо)
+EMAIL_BODY_BATCH_BYTES = 512 * 1024
+# Сколько байт одной текстовой части декодировать для поиска кода (защита, если EMAIL_BODY_PEEK_BYTES поднимут)
+EMAIL_PART_DECODE_BYTES = 16 * 1024
 
+# Ожидание без IDLE: интервал опроса растёт от начального до максимального (секунд)
+POLL_INTERVAL_MIN = 0.25
+POLL_INTERVAL_MAX = 2.0
+# RFC 2177: IDLE нужно перезапускать не реже, чем раз в 29 минут
+IDLE_MAX_PERIOD = 29 * 60
+# Состояние папки для проверки «изменилось ли что-то с прошлого поиска» одной командой STATUS, без SELECT и SEARCH.
+# Критерии поиска зависят от новых писем (UIDNEXT), удалений (MESSAGES) и флага \Seen (UNSEEN);
+# с CONDSTORE (RFC 7162) добавляется HIGHESTMODSEQ — он меняется при любой смене флагов
+STATUS_ITEMS = ("MESSAGES", "UIDNEXT", "UNSEEN", "UIDVALIDITY")
+# Найденный код отдаётся из памяти повторному запросу с теми же условиями столько секунд (0 — не кэшировать)
+RESULT_CACHE_TTL = 3.0
+# Коды для многих получателей сразу: адреса проверяет сервер (TO или Delivered-To), пока критерии
+# не длиннее этого (строки команд IMAP принято держать в пределах 8 КБ); иначе — только клиент
+RECIPIENTS_SEARCH_MAX_BYTES = 6000
 
-def get_auth_code_from_email(
+# Итог проверки письма из архива (match_message)
+MATCH_CODE = "code"  # код найден
+MATCH_NO_CODE = "no_code"  # письмо подходит, но кода по правилам нет
+MATCH_SKIPPED = "skipped"  # письмо отсеял бы SEARCH или фильтр по заголовкам (причина — в reason)
+MATCH_ERROR = "error"  # письмо не разобрать
+
+
+def build_search_criteria(
+    recipient: str | None = None,
+    subject_markers: tuple[str, ...] = (),
+    body: str | None = None,
+    senders: tuple[str, ...] = (),
+    max_age: float | None = None,
+) -> str:
+    """
+    Критерии IMAP SEARCH: всё, что можно проверить на сервере, проверяется там,
+    а регулярные выражения на клиенте уточняют уже небольшой результат.
+
+    :param recipient: TO — адрес получателя
+    :param subject_markers: SUBJECT — хотя бы одна из подстрок темы
+    :param body: BODY — подстрока тела (например SMS_BODY_MARKER)
+    :param senders: FROM — хотя бы один из отправителей
+    :param max_age: SINCE — не старше max_age секунд (SINCE работает с точностью до дня,
+                    поэтому берётся запас в сутки; точная отсечка — по заголовку Date)
+    """
+    ops = []
+    if subject_markers:
+        ops.append(OR(subject=list(subject_markers)))
+    if senders:
+        ops.append(OR(from_=list(senders)))
+    kwargs = {"seen": False}
+    if recipient:
+        kwargs["to"] = recipient
+    if body:
+        kwargs["body"] = body
+    if max_age:
+        kwargs["date_gte"] = (datetime.now() - timedelta(seconds=max_age, days=1)).date()
+    return str(AND(*ops, **kwargs))
+
+
+def _search_charset(criteria: str) -> str:
+    # Кириллица в SUBJECT/BODY требует CHARSET UTF-8; для ASCII — US-ASCII, как принято в imap_tools
+    return "US-ASCII" if criteria.isascii() else "UTF-8"
+
+
+# Правила по умолчанию (если в config.ini нет своих для папки): 4 цифры в теме, иначе в тексте;
+# для SMS — только в тексте, содержащем маркер
+BUILTIN_EMAIL_RULES = (CodeRule("email", CODE_REGEX.pattern),)
+
+
+def _builtin_sms_rules(body_marker: str | None) -> tuple[CodeRule, ...]:
+    return (CodeRule("sms", CODE_REGEX.pattern, (SOURCE_TEXT,), marker=body_marker or None),)
+
+
+class _Candidate:
+    """
+    Письмо-кандидат: заголовки из первой фазы, текст (text/plain) и, если его просят
+    правила, HTML — после второй, если понадобились.
+    """
+
+    __slots__ = ("uid", "header", "fields", "subject", "sender", "date", "text", "html")
+
+    def __init__(self, uid: int, header: bytes):
+        self.uid = uid
+        self.header = header
+        self.fields = email.message_from_bytes(header)
+        self.subject = _decode_header(self.fields.get("Subject"))
+        self.sender = _decode_header(self.fields.get("From"))
+        self.date = _parse_date(self.fields.get("Date"))
+        self.text: str | None = None
+        self.html: str | None = None
+
+
+def _parse_date(value: str | None) -> datetime | None:
+    if not value:
+        return None
+    try:
+        dt = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def _decode_header(value: str | None) -> str:
+    if not value:
+        return ""
+    try:
+        return str(make_header(decode_header(value)))
+    except Exception:
+        return value
+
+
+def _b64decode_lenient(payload: str) -> bytes:
+    """
+    base64 возможно обрезанного тела: всё, что можно декодировать. Выравнивание «=» снимаем
+    и ставим заново, так что последняя неполная группа (2–3 символа) тоже декодируется.
+    """
+    data = re.sub(r"[^A-Za-z0-9+/]", "", payload)
+    if len(data) % 4 == 1:
+        data = data[:-1]  # одиночный символ не несёт целого байта
+    return base64.b64decode(data + "=" * (-len(data) % 4))
+
+
+_HTML_SKIP = re.compile(r"<(script|style)\b.*?</\1\s*>|<!--.*?-->", re.IGNORECASE | re.DOTALL)
+_HTML_TAG = re.compile(r"<[^>]*>")
+
+
+def _html_to_text(markup: str) -> str:
+    """Грубый текст HTML-части для поиска кода: без тегов, скриптов и стилей, с раскрытыми сущностями."""
+    return html.unescape(_HTML_TAG.sub(" ", _HTML_SKIP.sub(" ", markup)))
+
+
+def _partial_text(header: bytes, body: bytes, with_html: bool = False) -> tuple[str, str | None]:
+    """
+    Текст text/plain-частей письма по заголовкам и (возможно, обрезанному) началу тела
+    и, если with_html, текст text/html-частей (иначе None). Вложения (в том числе
+    Content-Disposition: attachment без имени файла) не декодируются; от каждой части
+    декодируется не больше EMAIL_PART_DECODE_BYTES.
+    """
+    msg = email.message_from_bytes(header.rstrip(b"\r\n") + b"\r\n\r\n" + body)
+    texts = []
+    html_texts = []
+    wanted = ("text/plain", "text/html") if with_html else ("text/plain",)
+    for part in msg.walk():
+        if part.is_multipart() or part.get_content_type() not in wanted:
+            continue
+        if part.get_filename() or part.get_content_disposition() == "attachment":
+            continue
+        # 8bit-часть пакет email уже отдаёт строкой в её кодировке; base64 и QP декодируем сами
+        payload = part.get_payload()
+        if not isinstance(payload, str):
+            continue
+        charset = part.get_content_charset() or "utf-8"
+        encoding = (part.get("Content-Transfer-Encoding") or "").strip().lower()
+        if encoding in ("base64", "quoted-printable"):
+            payload = payload[:EMAIL_PART_DECODE_BYTES * 3]  # с запасом на кодирование (QP — до 3 символов на байт)
+            if encoding == "base64":
+                raw = _b64decode_lenient(payload)
+            else:
+                raw = quopri.decodestring(payload.encode("ascii", "replace"))
+            raw = raw[:EMAIL_PART_DECODE_BYTES]
+            try:
+                decoded = raw.decode(charset, "replace")
+            except LookupError:
+                decoded = raw.decode("utf-8", "replace")
+        else:
+            decoded = payload[:EMAIL_PART_DECODE_BYTES]
+        if part.get_content_type() == "text/html":
+            html_texts.append(_html_to_text(decoded))
+        else:
+            texts.append(decoded)
+    return "\n".join(texts), "\n".join(html_texts) if with_html else None
+
+
+class _ScanResult(NamedTuple):
+    code: str | None
+    uid: int | None  # UID письма с кодом
+    date: datetime | None  # дата письма с кодом (заголовок Date)
+    last_uid: int  # самый большой UID среди найденных SEARCH (все письма до него просмотрены или не нужны)
+
+
+class _Matcher(NamedTuple):
+    """Фильтр писем по заголовкам и правила извлечения кода (тело скачивается, только если оно нужно правилам)."""
+
+    header_filter: Callable[[_Candidate], bool]
+    rules: CompiledRules
+    extra_fields: tuple[str, ...] = ()  # заголовки, нужные самому фильтру, сверх EMAIL_HEADER_FIELDS
+
+    @property
+    def header_fields(self) -> str:
+        return " ".join(dict.fromkeys((EMAIL_HEADER_FIELDS, *self.extra_fields, *self.rules.extra_headers)))
+
+
+def _source_value(c: _Candidate, source: str) -> str | None:
+    if source == SOURCE_SUBJECT:
+        return c.subject
+    if source == SOURCE_TEXT:
+        return c.text
+    if source == SOURCE_HTML:
+        return c.html
+    return _decode_header(c.fields.get(source[len(HEADER_SOURCE_PREFIX):]))
+
+
+def _find_code(rules: CompiledRules, c: _Candidate, sources: tuple[str, ...]) -> tuple[str, str] | None:
+    """(код, источник) — первый код по правилам в источниках sources по порядку."""
+    for source in sources:
+        code = rules.search(source, _source_value(c, source), c.sender)
+        if code is not None:
+            if DEBUG_EMAIL_FETCH:
+                print(f"    -> uid={c.uid}: код найден ({source}): {code!r}")
+            return code, source
+    return None
+
+
+def _code_from_headers(rules: CompiledRules, c: _Candidate) -> str | None:
+    found = _find_code(rules, c, rules.header_sources)
+    return found[0] if found else None
+
+
+def _code_from_body(rules: CompiledRules, c: _Candidate) -> str | None:
+    found = _find_code(rules, c, rules.body_sources)
+    if DEBUG_EMAIL_FETCH and found is None:
+        print(f"    -> uid={c.uid}: письмо подходит, но код по правилам не найден")
+    return found[0] if found else None
+
+
+async def _scan(
+    client: ImapClient,
+    criteria: str,
+    matcher: _Matcher,
+    min_uid: int = 0,
+    max_age: float | None = None,
+) -> _ScanResult:
+    """
+    Обходит письма по criteria от новых к старым в две фазы:
+    1) только заголовки (EMAIL_HEADER_FIELDS) — фильтр по заголовкам и поиск кода в теме и заголовках;
+    2) если правила ищут и в теле — для прошедших фильтр писем без кода в заголовках начало
+       тела (BODY.PEEK[TEXT]<0.N>), и то лишь тех, что свежее первого письма с кодом в заголовках.
+    SEARCH выполняется один раз. Заголовки идут конвейером (_headers), письма разбираются
+    по одному; тела скачиваются группами не больше EMAIL_BODY_BATCH_BYTES и декодируются по
+    одному письму — память не растёт с размером папки и писем.
+    min_uid > 0 — только письма с UID >= min_uid; max_age — только письма не старше max_age секунд по Date.
+    """
+    if min_uid:
+        criteria = str(AND(criteria, uid=U(min_uid, "*")))
+    not_before = datetime.now(timezone.utc) - timedelta(seconds=max_age) if max_age else None
+    # «UID n:*» по RFC 3501 всегда включает последнее письмо, даже если его UID < n
+    found_uids = await client.uid_search(criteria, charset=_search_charset(criteria))
+    uids = [uid for uid in found_uids if uid >= min_uid]
+    last_uid = max(uids, default=0)
+    uids.reverse()
+    if not uids:
+        return _ScanResult(None, None, None, last_uid)
+    # Выход из блоков (в том числе с найденным кодом) дочитывает ответы на ещё летящие порции
+    async with client.fetch_pipeline() as pipeline:
+        async with contextlib.aclosing(_candidates(pipeline, uids, matcher, not_before)) as candidates:
+            async for c, code in candidates:
+                if code is not None:
+                    return _ScanResult(code, c.uid, c.date, last_uid)
+    return _ScanResult(None, None, None, last_uid)
+
+
+async def _candidates(
+    pipeline: FetchPipeline,
+    uids: list[int],
+    matcher: _Matcher,
+    not_before: datetime | None,
+) -> AsyncIterator[tuple[_Candidate, str | None]]:
+    """
+    Письма uids (от новых к старым), прошедшие фильтр, с кодом или None — строго по порядку.
+    Письма без кода в заголовках, если правила ищут и в теле, копятся и проверяются группами
+    не больше EMAIL_BODY_BATCH_BYTES (_bodies); письмо с кодом в заголовках выдаётся только
+    после всех более свежих.
+    """
+    body_batch = max(1, EMAIL_BODY_BATCH_BYTES // EMAIL_BODY_PEEK_BYTES)
+    pending: list[_Candidate] = []  # прошли фильтр, кода в заголовках нет — ждут проверки тела
+    async with contextlib.aclosing(_headers(pipeline, uids, matcher.header_fields)) as headers:
+        async for uid, header in headers:
+            with fetch_stats.phase("parse"):
+                c = _Candidate(uid, header)
+            if not_before is not None and c.date is not None and c.date < not_before:
+                continue
+            if not matcher.header_filter(c):
+                continue
+            code = _code_from_headers(matcher.rules, c)
+            if code is None and matcher.rules.needs_body:
+                pending.append(c)
+                if len(pending) < body_batch:
+                    continue
+            if pending:
+                batch, pending = pending, []
+                async with contextlib.aclosing(_bodies(pipeline, matcher, batch)) as checked:
+                    async for item in checked:
+                        yield item
+            if code is not None or not matcher.rules.needs_body:
+                yield c, code
+    if pending:
+        async with contextlib.aclosing(_bodies(pipeline, matcher, pending)) as checked:
+            async for item in checked:
+                yield item
+
+
+async def _headers(pipeline: FetchPipeline, uids: list[int], header_fields: str) -> AsyncIterator[tuple[int, bytes]]:
+    """
+    (uid, заголовки) от новых к старым. Порции (_fetch_batches) запрашиваются конвейером:
+    первая идёт одна — если код в самых свежих письмах, лишнего не качаем; окно в полёте
+    растёт до EMAIL_FETCH_PIPELINE, когда потребитель просит письма дальше очередной порции.
+    """
+    item = f"BODY.PEEK[HEADER.FIELDS ({header_fields})]"
+    batches = iter(_fetch_batches(uids))
+    inflight: deque[tuple[list[int], bytes]] = deque()
+    window = 1
+    while True:
+        while len(inflight) < window and (chunk := next(batches, None)):
+            inflight.append((chunk, await pipeline.submit(chunk, item)))
+        if not inflight:
+            return
+        chunk, tag = inflight.popleft()
+        headers = await pipeline.result(tag)
+        if DEBUG_EMAIL_FETCH:
+            print(f"[DEBUG] Порция из {len(chunk)} (в полёте ещё {len(inflight)}), заголовков получено: {len(headers)}")
+        fetch_stats.count("messages_scanned", len(headers))
+        for uid in chunk:
+            header = headers.pop(uid, None)
+            if header is not None:
+                yield uid, header
+        window = min(window + 1, EMAIL_FETCH_PIPELINE)
+
+
+async def _bodies(
+    pipeline: FetchPipeline, matcher: _Matcher, candidates: list[_Candidate]
+) -> AsyncIterator[tuple[_Candidate, str | None]]:
+    """Скачивает начало тела кандидатов одной командой и проверяет их по порядку; тексты не копятся."""
+    bodies = await pipeline.result(
+        await pipeline.submit([c.uid for c in candidates], f"BODY.PEEK[TEXT]<0.{EMAIL_BODY_PEEK_BYTES}>")
+    )
+    for c in candidates:
+        with fetch_stats.phase("parse"):
+            c.text, c.html = _partial_text(c.header, bodies.pop(c.uid, b""), matcher.rules.needs_html)
+        code = _code_from_body(matcher.rules, c)
+        c.text = c.html = None
+        yield c, code
+
+
+def _fetch_batches(uids: list[int]) -> Iterator[list[int]]:
+    """Порции UID для обхода: EMAIL_FETCH_CHUNK, затем вдвое больше каждая, до EMAIL_FETCH_CHUNK_MAX."""
+    size = EMAIL_FETCH_CHUNK
+    start = 0
+    while start < len(uids):
+        yield uids[start: start + size]
+        start += size
+        size = min(size * 2, EMAIL_FETCH_CHUNK_MAX)
+
+
+def _watermark_key(user: str, host: str, port: int, folder: str, mode: str, criteria: str, max_age: float | None) -> str:
+    """
+    Ключ отметки UID: аккаунт, папка, режим и условия поиска. Сами критерии берутся
+    без SINCE (дата меняется каждый день), но окно по возрасту входит в ключ: письмо,
+    отброшенное как слишком старое, при другом окне могло бы подойти.
+    """
+    return f"{user}@{host}:{port}/{folder} {mode} max_age={max_age} {criteria}"
+
+
+async def _still_matches(client: ImapClient, criteria: str, uid: int) -> bool:
+    """Письмо uid всё ещё подходит под criteria (например, не прочитано)."""
+    criteria = str(AND(criteria, uid=str(uid)))
+    return uid in await client.uid_search(criteria, charset=_search_charset(criteria))
+
+
+async def _scan_with_watermark(
+    client: ImapClient,
+    criteria: str,
+    matcher: _Matcher,
+    max_age: float | None,
+    watermark_key: str | None,
+    uidvalidity: int | None,
+    watermarks: UidWatermarks,
+    state: str | None = None,
+) -> _ScanResult:
+    """
+    Проход по папке с учётом отметки UID: при совпадении UIDVALIDITY смотрим только
+    письма новее отметки, а если среди них кода нет — возвращаем ранее найденный код,
+    пока его письмо подходит под условия. Иначе — полный проход.
+    state — состояние папки по STATUS перед проходом, запоминается вместе с отметкой.
+    """
+    if watermark_key is None or uidvalidity is None:
+        return await _scan(client, criteria, matcher, max_age=max_age)
+    mark = watermarks.get(watermark_key, uidvalidity)
+    result = None
+    if mark is not None:
+        fetch_stats.hit("watermark")
+        result = await _scan(client, criteria, matcher, min_uid=mark.last_uid + 1, max_age=max_age)
+        if DEBUG_EMAIL_FETCH:
+            print(f"[DEBUG] Отметка UID {mark.last_uid}: новых писем с кодом {'есть' if result.code else 'нет'}")
+        if result.code is None and mark.hit_uid is not None:
+            fresh = not max_age or mark.hit_date is None or mark.hit_date >= time.time() - max_age
+            if fresh and await _still_matches(client, criteria, mark.hit_uid):
+                hit_date = datetime.fromtimestamp(mark.hit_date, timezone.utc) if mark.hit_date else None
+                result = _ScanResult(mark.code, mark.hit_uid, hit_date, max(result.last_uid, mark.last_uid))
+            elif fresh:
+                # Письмо с прежним кодом прочитано или удалено — более старые коды могли остаться ниже отметки
+                result = None
+        else:
+            result = result._replace(last_uid=max(result.last_uid, mark.last_uid))
+    if result is None:
+        result = await _scan(client, criteria, matcher, max_age=max_age)
+    _remember(watermarks, watermark_key, uidvalidity, result, state)
+    return result
+
+
+def _remember(
+    watermarks: UidWatermarks,
+    key: str | None,
+    uidvalidity: int | None,
+    result: _ScanResult,
+    state: str | None = None,
+) -> None:
+    if key is None or uidvalidity is None:
+        return
+    watermarks.put(key, Watermark(
+        uidvalidity=uidvalidity,
+        last_uid=result.last_uid,
+        hit_uid=result.uid,
+        code=result.code,
+        hit_date=result.date.timestamp() if result.date else None,
+        state=state,
+    ))
+
+
+async def _folder_state(client: ImapClient, folder: str) -> tuple[int | None, str | None]:
+    """
+    UIDVALIDITY и состояние папки по одному STATUS — строка вида «MESSAGES 10 UIDNEXT 11 UNSEEN 2».
+    (None, None), если сервер на STATUS ответил ошибкой (тогда обычный SELECT покажет, в чём дело).
+    """
+    items = STATUS_ITEMS + (("HIGHESTMODSEQ",) if "CONDSTORE" in client.capabilities else ())
+    try:
+        values = await client.status(folder, items)
+    except ImapError:
+        return None, None
+    uidvalidity = values.pop("UIDVALIDITY", None)
+    if uidvalidity is None or "UIDNEXT" not in values:
+        return None, None
+    return uidvalidity, " ".join(f"{name} {values[name]}" for name in sorted(values))
+
+
+def _unchanged(mark: Watermark | None, state: str | None, max_age: float | None) -> _ScanResult | None:
+    """
+    Результат прошлого поиска, если папка с тех пор не изменилась (то же состояние по STATUS),
+    иначе None. Прежний код отдаётся, только пока его письмо не старше max_age.
+    """
+    if mark is None or state is None or mark.state != state:
+        return None
+    fetch_stats.hit("status")
+    fresh = not max_age or mark.hit_date is None or mark.hit_date >= time.time() - max_age
+    if mark.hit_uid is None or not fresh:
+        return _ScanResult(None, None, None, mark.last_uid)
+    hit_date = datetime.fromtimestamp(mark.hit_date, timezone.utc) if mark.hit_date else None
+    return _ScanResult(mark.code, mark.hit_uid, hit_date, mark.last_uid)
+
+
+class _Lookup(NamedTuple):
+    """Что и где искать: папка, критерии SEARCH, правила поиска кода и ключ отметки UID."""
+
+    folder: str
+    criteria: str
+    matcher: _Matcher
+    watermark_key: str
+    max_age: float | None
+    terms: Mapping[str, object]  # условия SEARCH без возраста (аргументы build_search_criteria)
+
+
+class _Target(NamedTuple):
+    """Поиск в одной папке одного ящика; label — что вернуть вызывающему вместе с кодом (папка, источник)."""
+
+    label: str
+    account: Account
+    lookup: _Lookup
+
+
+async def _scan_and_wait(
+    client: ImapClient,
+    lookup: _Lookup,
+    deadline: float | None,
+    uidvalidity: int | None,
+    watermarks: UidWatermarks,
+    stop: asyncio.Event | None = None,
+    state: str | None = None,
+) -> _ScanResult:
+    """
+    Один проход по папке; если кода нет и задан deadline — ждёт новые письма
+    через IMAP IDLE (или опросом, если сервер IDLE не поддерживает) и проверяет
+    только их, пока не найдётся код, не наступит deadline или не будет выставлен stop.
+    """
+    criteria, matcher, max_age = lookup.criteria, lookup.matcher, lookup.max_age
+    result = await _scan_with_watermark(
+        client, criteria, matcher, max_age, lookup.watermark_key, uidvalidity, watermarks, state
+    )
+    if result.code is not None or deadline is None:
+        return result
+    last_uid = result.last_uid
+    async with contextlib.aclosing(_new_mail(client, deadline, stop)) as arrivals:
+        async for _ in arrivals:
+            result = await _scan(client, criteria, matcher, min_uid=last_uid + 1, max_age=max_age)
+            last_uid = max(last_uid, result.last_uid)
+            result = result._replace(last_uid=last_uid)
+            if result.code is not None:
+                _remember(watermarks, lookup.watermark_key, uidvalidity, result)
+                return result
+    result = _ScanResult(None, None, None, last_uid)
+    _remember(watermarks, lookup.watermark_key, uidvalidity, result)
+    return result
+
+
+async def _new_mail(client: ImapClient, deadline: float, stop: asyncio.Event | None) -> AsyncIterator[None]:
+    """
+    Ожидание новых писем в выбранной папке: выдаёт по разу, когда пора проверить папку снова —
+    по IMAP IDLE или, если сервер его не поддерживает, опросом с растущим интервалом.
+    Заканчивается по deadline или выставлению stop.
+    """
+    use_idle = "IDLE" in client.capabilities
+    interval = POLL_INTERVAL_MIN
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or (stop is not None and stop.is_set()):
+            return
+        if use_idle:
+            changed = await client.idle(min(remaining, IDLE_MAX_PERIOD), stop)
+            if DEBUG_EMAIL_FETCH:
+                print(f"[DEBUG] IDLE: {'есть изменения' if changed else 'без изменений'}")
+            if not changed:
+                continue
+        else:
+            with fetch_stats.phase("wait"):
+                await _sleep(min(interval, remaining), stop)
+            interval = min(interval * 2, POLL_INTERVAL_MAX)
+            if stop is not None and stop.is_set():
+                continue
+        yield
+
+
+async def _sleep(delay: float, stop: asyncio.Event | None) -> None:
+    """Пауза между опросами; прерывается выставлением stop."""
+    if stop is None:
+        await asyncio.sleep(delay)
+        return
+    try:
+        await asyncio.wait_for(stop.wait(), delay)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def _run_lookup(
+    lookup: _Lookup,
+    imap_user: str,
+    imap_password: str,
+    imap_host: str,
+    imap_port: int,
+    pool: ImapSessionPool | None,
+    deadline: float | None,
+    watermarks: UidWatermarks | None,
+    stop: asyncio.Event | None = None,
+    cache_ttl: float = RESULT_CACHE_TTL,
+) -> _ScanResult:
+    """
+    Выполняет поиск на сессии из пула. Ошибки IMAP пробрасываются вызывающему.
+    Если сессия стоит не в нужной папке, сначала одним STATUS проверяется, изменилась ли
+    папка с прошлого поиска: если нет — ответ прежний, без SELECT и SEARCH.
+    Одновременные поиски с одинаковыми условиями склеиваются в один (single_flight),
+    найденный код cache_ttl секунд отдаётся из памяти. Поиск со своим stop не склеивается:
+    его остановка касается только этого вызывающего.
+    """
+    watermarks = watermarks or get_default_watermarks()
+
+    async def scan(client: ImapClient) -> _ScanResult:
+        state = None
+        # По выбранной папке STATUS не шлём (RFC 3501, 6.3.10), да и SELECT там не нужен
+        if client.folder != lookup.folder:
+            uidvalidity, state = await _folder_state(client, lookup.folder)
+            if uidvalidity is not None:
+                known = _unchanged(watermarks.get(lookup.watermark_key, uidvalidity), state, lookup.max_age)
+                if known is not None and (known.code is not None or deadline is None):
+                    return known
+        uidvalidity = await client.select(lookup.folder)
+        return await _scan_and_wait(client, lookup, deadline, uidvalidity, watermarks, stop, state)
+
+    async def run() -> _ScanResult:
+        return await (pool or get_default_pool()).run(
+            imap_host, imap_port, imap_user, imap_password, scan, prefer_folder=lookup.folder
+        )
+
+    if stop is not None:
+        return await run()
+    # Ключ отметки UID уже включает ящик, папку, режим, условия поиска и правила; пароль — только отпечатком:
+    # запрос с неверным паролем не должен получить чужой код из кэша или из идущего поиска
+    key = f"{lookup.watermark_key} #{_credential_tag(imap_password)}"
+    cached = _results.get(key) if cache_ttl > 0 else None
+    if cached is not None:
+        fetch_stats.hit("result")
+        return cached
+    result = await _coalesced(key, deadline, run)
+    if result.code is not None:
+        _results.put(key, result, cache_ttl)
+    return result
+
+
+_results: ResultCache[_ScanResult] = ResultCache()
+_CREDENTIAL_SALT = os.urandom(16)
+
+
+def _credential_tag(password: str) -> str:
+    """Отпечаток пароля для ключей в памяти (кэш результатов, склейка): с солью процесса, не обратим."""
+    return hashlib.blake2b(password.encode("utf-8"), key=_CREDENTIAL_SALT, digest_size=16).hexdigest()
+
+
+def _call_deadline(wait: float | None, timeout: float | None) -> contextlib.AbstractContextManager[None]:
+    """Срок всего вызова (imap_client.deadline): ожидание wait плюс timeout на работу с сервером."""
+    return imap_client.deadline(None if timeout is None else (wait or 0) + timeout)
+
+
+async def _coalesced(key: str, deadline: float | None, run: Callable[[], Awaitable[_ScanResult]]) -> _ScanResult:
+    """
+    Присоединяется к идущему поиску с тем же ключом или запускает свой.
+    Идущий поиск без ожидания подходит всем: если кода нет, а у нас есть время ждать —
+    дальше ищем сами. Поиск с ожиданием не подходит тому, кому ответ нужен сразу;
+    если он ждёт дольше нашего срока — ждём его только до своего срока.
+    """
+    flights = get_single_flight()
+    while True:
+        flight = flights.get(key)
+        if flight is None or (deadline is None and flight.deadline is not None):
+            flight = flights.start(key, run(), deadline)
+        else:
+            fetch_stats.hit("inflight")
+        timeout = None
+        if deadline is not None and (flight.deadline is None or flight.deadline > deadline):
+            timeout = max(0.0, deadline - time.monotonic())
+        # Чужой поиск идёт под своим сроком запроса — ждём его не дольше своего
+        left = time_left()
+        expires = left is not None and (timeout is None or left < timeout)
+        if expires:
+            timeout = left
+        try:
+            result = await flights.join(flight, timeout)
+        except asyncio.TimeoutError:
+            if expires:
+                raise ImapTimeout("истёк срок запроса") from None
+            return _ScanResult(None, None, None, 0)
+        except asyncio.CancelledError:
+            # Отменили не нас, а чужой поиск (его перестали ждать, пока мы присоединялись) — ищем заново
+            if asyncio.current_task().cancelling():
+                raise
+            continue
+        if result.code is not None or deadline is None or time.monotonic() >= deadline:
+            return result
+
+
+def _email_lookup(
+    recipient_email: str | None,
+    folder: str,
+    imap_user: str,
+    imap_host: str,
+    imap_port: int,
+    subject_contains: str | tuple[str, ...] | None,
+    senders: tuple[str, ...],
+    max_age: float | None,
+    rules: Sequence[CodeRule] = (),
+) -> _Lookup:
+    folder_rules = rules_for_folder(tuple(rules), folder)
+    compiled = compile_rules(folder_rules or BUILTIN_EMAIL_RULES)
+    filter_by_to = subject_contains is None
+    if isinstance(subject_contains, str):
+        subject_markers = (subject_contains,) if subject_contains else ()
+    else:
+        subject_markers = tuple(subject_contains or ())
+    criteria_args = dict(
+        recipient=recipient_email if filter_by_to else None,
+        subject_markers=subject_markers,
+        # Если каждое правило папки ограничено отправителями — их тоже проверяет сервер
+        senders=senders or compiled.senders(),
+    )
+    criteria = build_search_criteria(**criteria_args, max_age=max_age)
+    # Режим платформы и обычный режим по-разному фильтруют тему, свои правила — по-своему ищут код:
+    # отметки у них раздельные
+    mode = "platform" if subject_contains is not None else "email"
+    if folder_rules:
+        mode = f"{mode}:{compiled.fingerprint}"
+    watermark_key = _watermark_key(
+        imap_user, imap_host, imap_port, folder, mode, build_search_criteria(**criteria_args), max_age
+    )
+    if DEBUG_EMAIL_FETCH:
+        print(f"  criteria={criteria}, rules={[r.name for r in compiled.rules]}")
+    # Формат темы платформы проверяется только для встроенного правила: свои правила сами описывают письмо с кодом
+    check_subject_format = subject_contains is not None and not folder_rules
+
+    def header_filter(c: _Candidate) -> bool:
+        if DEBUG_EMAIL_FETCH:
+            print(f"  Письмо uid={c.uid}: subject={c.subject!r}")
+        # В режиме платформы (subject_contains не None) — фильтр по формату "4 цифры, пробел, тире"
+        if check_subject_format and not SUBJECT_CODE_FORMAT.search(c.subject):
+            if DEBUG_EMAIL_FETCH:
+                print(f"    -> пропуск: тема не в формате «4 цифры, пробел, тире»")
+            return False
+        return True
+
+    return _Lookup(folder, criteria, _Matcher(header_filter, compiled), watermark_key, max_age, criteria_args)
+
+
+def _sms_lookup(
+    folder: str,
+    imap_user: str,
+    imap_host: str,
+    imap_port: int,
+    body_contains: str | None,
+    max_age: float | None,
+    rules: Sequence[CodeRule] = (),
+) -> _Lookup:
+    body_marker = body_contains or SMS_BODY_MARKER
+    folder_rules = rules_for_folder(tuple(rules), folder)
+    # Тема SMS-письма — номер телефона: встроенное правило ищет код только в теле с маркером
+    compiled = compile_rules(folder_rules or _builtin_sms_rules(body_marker))
+    criteria_args = dict(body=body_marker, senders=compiled.senders())
+    criteria = build_search_criteria(**criteria_args, max_age=max_age)
+    mode = f"sms:{compiled.fingerprint}" if folder_rules else "sms"
+    watermark_key = _watermark_key(
+        imap_user, imap_host, imap_port, folder, mode, build_search_criteria(**criteria_args), max_age
+    )
+    return _Lookup(folder, criteria, _Matcher(lambda c: True, compiled), watermark_key, max_age, criteria_args)
+
+
+async def get_auth_code_from_email_async(
     recipient_email: str,
     folder: str,
     imap_user: str,
@@ -25,81 +800,87 @@ def get_auth_code_from_email(
     imap_host: str,
     imap_port: int = 993,
     subject_contains: str | tuple[str, ...] | None = None,
+    pool: ImapSessionPool | None = None,
+    wait: float | None = None,
+    senders: tuple[str, ...] = PLATFORM_SENDERS,
+    max_age: float | None = CODE_MAX_AGE,
+    watermarks: UidWatermarks | None = None,
+    rules: Sequence[CodeRule] = (),
+    cache_ttl: float = RESULT_CACHE_TTL,
+    on_stats: Callable[[FetchStats], None] | None = None,
+    timeout: float | None = FETCH_TIMEOUT,
 ) -> str | None:
     """
     Ищет последнее (самое свежее) непрочитанное письмо в папке folder.
     Обходит все непрочитанные от новых к старым, пока не найдёт письмо с кодом или не проверит всю папку.
     Если задан subject_contains (любое не-None) — учитываются только письма, тема которых в формате «4 цифры, пробел, тире» (напр. «5787 — ...»).
+    Если задан wait и код не найден — ждёт новое письмо с кодом до wait секунд (IMAP IDLE или опрос).
+    Получатель, подстроки темы, отправители и возраст письма проверяются сервером (IMAP SEARCH).
 
-    :param subject_contains: если не None — режим платформы: фильтр по формату темы, без фильтра по To
+    :param subject_contains: если не None — режим платформы: фильтр по формату темы, без фильтра по To;
+                             непустые строка/кортеж дополнительно ищутся в теме на сервере (SUBJECT)
+    :param pool: пул IMAP-сессий текущего цикла событий; по умолчанию — общий (get_default_pool)
+    :param wait: сколько секунд ждать новое письмо, если в папке кода нет (например WAIT_TIMEOUT); None — не ждать
+    :param senders: только письма от этих отправителей (FROM); пусто — от любых
+    :param max_age: только письма не старше max_age секунд; None — без ограничения
+    :param watermarks: кэш отметок UID; по умолчанию — общий (uid_watermarks.json)
+    :param rules: правила извлечения кода (code_rules); для папки берутся подходящие ей,
+                  если таких нет — встроенные
+    :param cache_ttl: сколько секунд найденный код отдаётся из памяти повторным запросам (0 — всегда с сервера)
+    :param on_stats: вызывается с замерами запроса (fetch_stats.FetchStats) по его окончании;
+                     FetchStats.status отличает «не найден» от таймаута, отказа во входе и недоступного сервера
+    :param timeout: срок запроса сверх wait (секунд) на подключение, вход, поиск и загрузку; None — без срока
     :return: строка с 4-значным кодом, либо None если не найден во всей папке
     """
     if DEBUG_EMAIL_FETCH:
         print("[DEBUG get_auth_code_from_email] Параметры:")
         print(f"  recipient_email={recipient_email!r}, folder={folder!r}")
         print(f"  imap_host={imap_host}, imap_port={imap_port}")
-        print(f"  subject_contains={subject_contains!r}")
-    try:
-        with MailBox(imap_host, port=imap_port).login(imap_user, imap_password) as mailbox:
-            mailbox.folder.set(folder)
-            filter_by_to = subject_contains is None
-            # В режиме платформы (subject_contains не None) — фильтр по формату "4 цифры, пробел, тире"
-            _subject_ok = lambda s: SUBJECT_CODE_FORMAT.search(s) if subject_contains is not None else True
-            criteria = AND(seen=False) if not filter_by_to else AND(to=recipient_email, seen=False)
-            start = 0
-            msg_idx = 0
-            while True:
-                messages = list(
-                    mailbox.fetch(
-                        criteria,
-                        reverse=True,
-                        limit=slice(start, start + EMAIL_FETCH_CHUNK),
-                        mark_seen=False,
-                    )
-                )
-                if not messages:
-                    break
-                if DEBUG_EMAIL_FETCH:
-                    print(f"[DEBUG] Папка {folder!r}, порция {start}..{start + len(messages)}, всего писем в порции: {len(messages)}")
-                for msg in messages:
-                    msg_idx += 1
-                    subj = msg.subject or ""
-                    if DEBUG_EMAIL_FETCH:
-                        print(f"  Письмо {msg_idx}: subject={subj!r}, date={msg.date}")
-                    if subject_contains is not None and not _subject_ok(subj):
-                        if DEBUG_EMAIL_FETCH:
-                            print(f"    -> пропуск: тема не в формате «4 цифры, пробел, тире»")
-                        continue
-                    match = CODE_REGEX.search(msg.subject or "")
-                    if not match:
-                        match = CODE_REGEX.search(msg.text or "")
-                    if match:
-                        if DEBUG_EMAIL_FETCH:
-                            print(f"    -> код найден: {match.group(0)!r}")
-                        return match.group(0)
-                    if DEBUG_EMAIL_FETCH:
-                        print(f"    -> тема подходит, но 4-значный код в теме/теле не найден")
-                start += EMAIL_FETCH_CHUNK
-    except Exception as e:
-        if DEBUG_EMAIL_FETCH:
-            print(f"[DEBUG] Ошибка: {type(e).__name__}: {e}")
+        print(f"  subject_contains={subject_contains!r}, wait={wait!r}")
+        print(f"  senders={senders!r}, max_age={max_age!r}")
+    deadline = time.monotonic() + wait if wait else None
+    lookup = _email_lookup(
+        recipient_email, folder, imap_user, imap_host, imap_port, subject_contains, senders, max_age, rules
+    )
+    with fetch_stats.collect("email", imap_user, imap_host, folder, on_stats) as stats, _call_deadline(wait, timeout):
+        try:
+            result = await _run_lookup(
+                lookup, imap_user, imap_password, imap_host, imap_port, pool, deadline, watermarks,
+                cache_ttl=cache_ttl,
+            )
+            if result.code is not None:
+                stats.code_found = True
+                return result.code
+        except Exception as e:
+            stats.fail(e)
+            if DEBUG_EMAIL_FETCH:
+                print(f"[DEBUG] Ошибка: {type(e).__name__}: {e}")
     if DEBUG_EMAIL_FETCH:
         print("[DEBUG] Вся папка проверена, код не найден")
     return None
 
 
-def get_auth_code_from_sms(
+async def get_auth_code_from_sms_async(
     imap_user: str,
     imap_password: str,
     imap_host: str,
     imap_port: int = 993,
     folder: str = "sms",
     body_contains: str | None = None,
+    pool: ImapSessionPool | None = None,
+    wait: float | None = None,
+    max_age: float | None = CODE_MAX_AGE,
+    watermarks: UidWatermarks | None = None,
+    rules: Sequence[CodeRule] = (),
+    cache_ttl: float = RESULT_CACHE_TTL,
+    on_stats: Callable[[FetchStats], None] | None = None,
+    timeout: float | None = FETCH_TIMEOUT,
 ) -> str | None:
     """
     Ищет последнее (самое свежее) непрочитанное письмо в папке folder (по умолчанию «sms»).
     Тема письма = номер телефона, код берётся только из тела письма.
     Если задан body_contains — учитываются только письма, в теле которых есть эта подстрока.
+    Подстрока тела и возраст письма проверяются сервером (IMAP SEARCH BODY/SINCE).
 
     :param imap_user: логин IMAP (корпоративная почта)
     :param imap_password: пароль IMAP
@@ -107,33 +888,773 @@ def get_auth_code_from_sms(
     :param imap_port: порт IMAP (по умолчанию 993)
     :param folder: папка для поиска (по умолчанию "sms")
     :param body_contains: если задано — только письма с этой подстрокой в теле (например SMS_BODY_MARKER)
+    :param pool: пул IMAP-сессий текущего цикла событий; по умолчанию — общий (get_default_pool)
+    :param wait: сколько секунд ждать новое SMS-письмо, если кода нет (например WAIT_TIMEOUT); None — не ждать
+    :param max_age: только письма не старше max_age секунд; None — без ограничения
+    :param watermarks: кэш отметок UID; по умолчанию — общий (uid_watermarks.json)
+    :param rules: правила извлечения кода (code_rules); для папки берутся подходящие ей,
+                  если таких нет — встроенные
+    :param cache_ttl: сколько секунд найденный код отдаётся из памяти повторным запросам (0 — всегда с сервера)
+    :param on_stats: вызывается с замерами запроса (fetch_stats.FetchStats) по его окончании;
+                     FetchStats.status отличает «не найден» от таймаута, отказа во входе и недоступного сервера
+    :param timeout: срок запроса сверх wait (секунд) на подключение, вход, поиск и загрузку; None — без срока
     :return: строка с 4-значным кодом, либо None если не найден
     """
-    body_marker = body_contains or SMS_BODY_MARKER
-    try:
-        with MailBox(imap_host, port=imap_port).login(imap_user, imap_password) as mailbox:
-            mailbox.folder.set(folder)
-            criteria = AND(seen=False)
-            start = 0
-            while True:
-                messages = list(
-                    mailbox.fetch(
-                        criteria,
-                        reverse=True,
-                        limit=slice(start, start + EMAIL_FETCH_CHUNK),
-                        mark_seen=False,
-                    )
-                )
-                if not messages:
-                    break
-                for msg in messages:
-                    body = msg.text or ""
-                    if body_marker and body_marker not in body:
+    deadline = time.monotonic() + wait if wait else None
+    lookup = _sms_lookup(folder, imap_user, imap_host, imap_port, body_contains, max_age, rules)
+    with fetch_stats.collect("sms", imap_user, imap_host, folder, on_stats) as stats, _call_deadline(wait, timeout):
+        try:
+            result = await _run_lookup(
+                lookup, imap_user, imap_password, imap_host, imap_port, pool, deadline, watermarks,
+                cache_ttl=cache_ttl,
+            )
+            stats.code_found = result.code is not None
+            return result.code
+        except Exception as e:
+            stats.fail(e)
+    return None
+
+
+async def get_auth_code_from_folders_async(
+    folders: Iterable[str],
+    imap_user: str,
+    imap_password: str,
+    imap_host: str,
+    imap_port: int = 993,
+    recipient_email: str | None = None,
+    subject_contains: str | tuple[str, ...] | None = PLATFORM_OTP_SUBJECT_MARKERS,
+    sms_folders: Collection[str] = ("sms",),
+    pool: ImapSessionPool | None = None,
+    wait: float | None = None,
+    senders: tuple[str, ...] = PLATFORM_SENDERS,
+    max_age: float | None = CODE_MAX_AGE,
+    watermarks: UidWatermarks | None = None,
+    rules: Sequence[CodeRule] = (),
+    cache_ttl: float = RESULT_CACHE_TTL,
+    on_stats: Callable[[FetchStats], None] | None = None,
+    timeout: float | None = FETCH_TIMEOUT,
+) -> tuple[str, str] | None:
+    """
+    Ищет код сразу в нескольких папках одного ящика — параллельно, на сессиях из пула.
+    Папки из sms_folders проверяются как get_auth_code_from_sms, остальные — как
+    get_auth_code_from_email (с recipient_email и subject_contains).
+    Из найденных кодов возвращается самый свежий (по дате письма). Если кода нет нигде
+    и задан wait — ждёт первое новое письмо с кодом в любой из папок.
+    Замеры (on_stats) общие на все папки: фазы суммируются по папкам.
+
+    :return: (код, папка) или None
+    """
+    folders = list(dict.fromkeys(folders))
+    if not folders:
+        return None
+    account = Account("", imap_user, imap_password, imap_host, imap_port)
+    targets = [
+        _Target(folder, account, _sms_lookup(folder, imap_user, imap_host, imap_port, None, max_age, rules))
+        if folder in sms_folders
+        else _Target(folder, account, _email_lookup(
+            recipient_email, folder, imap_user, imap_host, imap_port, subject_contains, senders, max_age, rules
+        ))
+        for folder in folders
+    ]
+    with (
+        fetch_stats.collect("folders", imap_user, imap_host, ",".join(folders), on_stats) as stats,
+        _call_deadline(wait, timeout),
+    ):
+        found = await _lookup_many(targets, pool, wait, watermarks, cache_ttl)
+        stats.code_found = found is not None
+        return found
+
+
+def _source_lookup(
+    source: Source, account: Account, senders: tuple[str, ...], max_age: float | None, rules: Sequence[CodeRule]
+) -> _Lookup:
+    if source.mode == MODE_SMS:
+        return _sms_lookup(source.folder, account.email, account.host, account.port, None, max_age, rules)
+    return _email_lookup(
+        source.recipient or account.email,
+        source.folder,
+        account.email,
+        account.host,
+        account.port,
+        None if source.mode == MODE_EMAIL else PLATFORM_OTP_SUBJECT_MARKERS,
+        senders,
+        max_age,
+        rules,
+    )
+
+
+def _accounts_by_name(accounts: Mapping[str, Account] | Iterable[Account]) -> dict[str, Account]:
+    return dict(accounts) if isinstance(accounts, Mapping) else {a.name: a for a in accounts}
+
+
+class CodeResult(NamedTuple):
+    """Итог запроса кода из источников: найден, не найден или почему не удалось искать."""
+
+    status: str  # fetch_stats.STATUS_*: found, not_found, timeout, auth_failed, unavailable, error
+    code: str | None = None
+    label: str | None = None  # имя источника, в котором найден код
+    error: str | None = None  # текст ошибки (для timeout, auth_failed, unavailable, error)
+
+    @property
+    def found(self) -> bool:
+        return self.code is not None
+
+
+async def fetch_code_from_source_async(
+    source: Source,
+    account: Account,
+    pool: ImapSessionPool | None = None,
+    wait: float | None = None,
+    senders: tuple[str, ...] = PLATFORM_SENDERS,
+    max_age: float | None = CODE_MAX_AGE,
+    watermarks: UidWatermarks | None = None,
+    rules: Sequence[CodeRule] = (),
+    cache_ttl: float = RESULT_CACHE_TTL,
+    on_stats: Callable[[FetchStats], None] | None = None,
+    timeout: float | None = FETCH_TIMEOUT,
+) -> CodeResult:
+    """
+    Код из одного источника (code_sources.Source) на ящике account: в режиме sms — как
+    get_auth_code_from_sms, иначе — как get_auth_code_from_email (platform — с проверкой
+    формата темы, email — письма на адрес source.recipient). Ограничение account.max_busy
+    применяется к ящику в пуле. Параметры — как у get_auth_code_from_email_async.
+    Ошибки не пробрасываются: их вид — в CodeResult.status.
+    """
+    pool = pool or get_default_pool()
+    pool.set_max_busy(account.host, account.port, account.email, account.max_busy)
+    lookup = _source_lookup(source, account, senders, max_age, rules)
+    deadline = time.monotonic() + wait if wait else None
+    code = None
+    with (
+        fetch_stats.collect(source.mode, account.email, account.host, source.folder, on_stats) as stats,
+        _call_deadline(wait, timeout),
+    ):
+        try:
+            result = await _run_lookup(
+                lookup, account.email, account.password, account.host, account.port, pool, deadline, watermarks,
+                cache_ttl=cache_ttl,
+            )
+            code = result.code
+            stats.code_found = code is not None
+        except Exception as e:
+            stats.fail(e)
+    return CodeResult(stats.status, code, source.name if code is not None else None, stats.error)
+
+
+async def get_auth_code_from_source_async(
+    source: Source,
+    account: Account,
+    pool: ImapSessionPool | None = None,
+    wait: float | None = None,
+    senders: tuple[str, ...] = PLATFORM_SENDERS,
+    max_age: float | None = CODE_MAX_AGE,
+    watermarks: UidWatermarks | None = None,
+    rules: Sequence[CodeRule] = (),
+    cache_ttl: float = RESULT_CACHE_TTL,
+    on_stats: Callable[[FetchStats], None] | None = None,
+    timeout: float | None = FETCH_TIMEOUT,
+) -> str | None:
+    """Код из fetch_code_from_source_async; None — не найден или ошибка."""
+    result = await fetch_code_from_source_async(
+        source=source,
+        account=account,
+        pool=pool,
+        wait=wait,
+        senders=senders,
+        max_age=max_age,
+        watermarks=watermarks,
+        rules=rules,
+        cache_ttl=cache_ttl,
+        on_stats=on_stats,
+        timeout=timeout,
+    )
+    return result.code
+
+
+async def fetch_code_from_sources_async(
+    sources: Iterable[Source],
+    accounts: Mapping[str, Account] | Iterable[Account],
+    pool: ImapSessionPool | None = None,
+    wait: float | None = None,
+    senders: tuple[str, ...] = PLATFORM_SENDERS,
+    max_age: float | None = CODE_MAX_AGE,
+    watermarks: UidWatermarks | None = None,
+    rules: Sequence[CodeRule] = (),
+    cache_ttl: float = RESULT_CACHE_TTL,
+    on_stats: Callable[[FetchStats], None] | None = None,
+    timeout: float | None = FETCH_TIMEOUT,
+) -> CodeResult:
+    """
+    Ищет код сразу в нескольких источниках, в том числе на разных ящиках и серверах —
+    параллельно, на сессиях из пула; сколько сессий одного ящика работают одновременно,
+    ограничивает его max_busy. Источники на ящиках без логина или пароля пропускаются.
+    Выбор кода и ожидание — как у get_auth_code_from_folders_async.
+    Если код не найден, а какой-то источник дал ошибку, status — вид последней ошибки.
+    """
+    pool = pool or get_default_pool()
+    by_name = _accounts_by_name(accounts)
+    targets = []
+    for source in dict.fromkeys(sources):
+        account = by_name.get(source.account)
+        if account is None or not account.configured:
+            continue
+        pool.set_max_busy(account.host, account.port, account.email, account.max_busy)
+        targets.append(_Target(source.name, account, _source_lookup(source, account, senders, max_age, rules)))
+    if not targets:
+        return CodeResult(fetch_stats.STATUS_NOT_FOUND)
+    users = ",".join(dict.fromkeys(t.account.email for t in targets))
+    hosts = ",".join(dict.fromkeys(t.account.host for t in targets))
+    with (
+        fetch_stats.collect("sources", users, hosts, ",".join(t.label for t in targets), on_stats) as stats,
+        _call_deadline(wait, timeout),
+    ):
+        found = await _lookup_many(targets, pool, wait, watermarks, cache_ttl)
+        stats.code_found = found is not None
+    code, label = found or (None, None)
+    return CodeResult(stats.status, code, label, None if found else stats.error)
+
+
+async def get_auth_code_from_sources_async(
+    sources: Iterable[Source],
+    accounts: Mapping[str, Account] | Iterable[Account],
+    pool: ImapSessionPool | None = None,
+    wait: float | None = None,
+    senders: tuple[str, ...] = PLATFORM_SENDERS,
+    max_age: float | None = CODE_MAX_AGE,
+    watermarks: UidWatermarks | None = None,
+    rules: Sequence[CodeRule] = (),
+    cache_ttl: float = RESULT_CACHE_TTL,
+    on_stats: Callable[[FetchStats], None] | None = None,
+    timeout: float | None = FETCH_TIMEOUT,
+) -> tuple[str, str] | None:
+    """(код, имя источника) из fetch_code_from_sources_async или None."""
+    result = await fetch_code_from_sources_async(
+        sources=sources,
+        accounts=accounts,
+        pool=pool,
+        wait=wait,
+        senders=senders,
+        max_age=max_age,
+        watermarks=watermarks,
+        rules=rules,
+        cache_ttl=cache_ttl,
+        on_stats=on_stats,
+        timeout=timeout,
+    )
+    return (result.code, result.label) if result.found else None
+
+
+def _addressees(c: _Candidate) -> set[str]:
+    """Адреса получателей письма из To и Delivered-To, в нижнем регистре."""
+    values = [*c.fields.get_all("To", []), *c.fields.get_all("Delivered-To", [])]
+    return {address.lower() for _, address in getaddresses([str(v) for v in values]) if address}
+
+
+def _recipients_criteria(criteria: str, addresses: list[str]) -> str:
+    """criteria плюс «письмо одному из addresses» (TO или Delivered-To), если строка команды не выйдет слишком длинной."""
+    by_address = OR(to=addresses, header=[H("Delivered-To", a) for a in addresses])
+    combined = str(AND(criteria, by_address))
+    return combined if len(combined.encode("utf-8")) <= RECIPIENTS_SEARCH_MAX_BYTES else criteria
+
+
+async def get_auth_codes_for_recipients_async(
+    recipients: Iterable[str],
+    folder: str,
+    imap_user: str,
+    imap_password: str,
+    imap_host: str,
+    imap_port: int = 993,
+    pool: ImapSessionPool | None = None,
+    wait: float | None = None,
+    senders: tuple[str, ...] = PLATFORM_SENDERS,
+    max_age: float | None = CODE_MAX_AGE,
+    rules: Sequence[CodeRule] = (),
+    on_stats: Callable[[FetchStats], None] | None = None,
+    timeout: float | None = FETCH_TIMEOUT,
+) -> dict[str, str | None]:
+    """
+    Коды сразу для многих получателей — как get_auth_code_from_email_async (без subject_contains)
+    для каждого, но одной сессией и одним проходом по папке: один SEARCH по всем адресам,
+    письма от новых к старым раскладываются по получателям из заголовков To и Delivered-To,
+    каждому достаётся код из самого свежего его письма. Проход заканчивается, как только
+    коды есть у всех. С wait — ждёт новые письма для оставшихся до wait секунд.
+    Отметки UID и кэш результатов не используются: набор получателей у каждого вызова свой.
+
+    :return: {получатель: код или None} — в порядке recipients
+    """
+    recipients = list(dict.fromkeys(recipients))
+    addresses = list(dict.fromkeys(r.strip().lower() for r in recipients if r.strip()))
+    wanted = set(addresses)
+    found: dict[str, str] = {}
+    if not addresses:
+        return dict.fromkeys(recipients)
+    deadline = time.monotonic() + wait if wait else None
+    base = _email_lookup(None, folder, imap_user, imap_host, imap_port, None, senders, max_age, rules)
+    criteria = _recipients_criteria(base.criteria, addresses)
+
+    def header_filter(c: _Candidate) -> bool:
+        # Тело скачивается только для писем тем, у кого кода ещё нет
+        return not (_addressees(c) & wanted).issubset(found)
+
+    matcher = _Matcher(header_filter, base.matcher.rules, ("DELIVERED-TO",))
+
+    async def route(client: ImapClient, min_uid: int) -> int:
+        """Один проход: коды новым получателям; возвращает самый большой UID из SEARCH."""
+        if min_uid:
+            search = str(AND(criteria, uid=U(min_uid, "*")))
+        else:
+            search = criteria
+        uids = [uid for uid in await client.uid_search(search, charset=_search_charset(search)) if uid >= min_uid]
+        last_uid = max(uids, default=0)
+        if not uids:
+            return last_uid
+        uids.reverse()
+        not_before = datetime.now(timezone.utc) - timedelta(seconds=max_age) if max_age else None
+        async with client.fetch_pipeline() as pipeline:
+            async with contextlib.aclosing(_candidates(pipeline, uids, matcher, not_before)) as candidates:
+                async for c, code in candidates:
+                    if code is None:
                         continue
-                    match = CODE_REGEX.search(body)
-                    if match:
-                        return match.group(0)
-                start += EMAIL_FETCH_CHUNK
-    except Exception:
-        pass
+                    for address in _addressees(c) & wanted:
+                        found.setdefault(address, code)
+                    if len(found) == len(addresses):
+                        break
+        return last_uid
+
+    async def scan(client: ImapClient) -> None:
+        await client.select(folder)
+        last_uid = await route(client, 0)
+        if deadline is None or len(found) == len(addresses):
+            return
+        async with contextlib.aclosing(_new_mail(client, deadline, None)) as arrivals:
+            async for _ in arrivals:
+                last_uid = max(last_uid, await route(client, last_uid + 1))
+                if len(found) == len(addresses):
+                    return
+
+    with (
+        fetch_stats.collect("recipients", imap_user, imap_host, folder, on_stats) as stats,
+        _call_deadline(wait, timeout),
+    ):
+        try:
+            await (pool or get_default_pool()).run(
+                imap_host, imap_port, imap_user, imap_password, scan, prefer_folder=folder
+            )
+        except Exception as e:
+            stats.fail(e)
+        stats.code_found = bool(found)
+    return {r: found.get(r.strip().lower()) for r in recipients}
+
+
+async def _lookup_many(
+    targets: list[_Target],
+    pool: ImapSessionPool | None,
+    wait: float | None,
+    watermarks: UidWatermarks | None,
+    cache_ttl: float,
+) -> tuple[str, str] | None:
+    """
+    Тело get_auth_code_from_folders_async и get_auth_code_from_sources_async:
+    сначала один проход по всем папкам, затем ожидание. Возвращает (код, label).
+    """
+
+    async def run(target: _Target, deadline: float | None, stop: asyncio.Event | None) -> _ScanResult | None:
+        account = target.account
+        try:
+            return await _run_lookup(
+                target.lookup, account.email, account.password, account.host, account.port, pool, deadline,
+                watermarks, stop, cache_ttl,
+            )
+        except Exception as e:
+            stats = fetch_stats.current()
+            if stats is not None:
+                stats.fail(e)
+            if DEBUG_EMAIL_FETCH:
+                print(f"[DEBUG] Папка {target.lookup.folder!r}: {type(e).__name__}: {e}")
+            return None
+
+    # 1) Один проход по всем папкам одновременно: выбираем самый свежий код
+    results = await asyncio.gather(*(run(t, None, None) for t in targets))
+    hits = [(r, t.label) for r, t in zip(results, targets) if r is not None and r.code is not None]
+    if hits:
+        min_date = datetime.min.replace(tzinfo=timezone.utc)
+        result, label = max(hits, key=lambda hit: hit[0].date or min_date)
+        return result.code, label
+    if not wait:
+        return None
+    # 2) Кода нет нигде — ждём во всех папках, первый найденный код останавливает остальных:
+    # они выходят из IDLE штатно (DONE), и сессии возвращаются в пул
+    deadline = time.monotonic() + wait
+    stop = asyncio.Event()
+    tasks = {asyncio.ensure_future(run(t, deadline, stop)): t.label for t in targets}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                result = task.result()
+                if result is not None and result.code is not None:
+                    return result.code, tasks[task]
+    finally:
+        stop.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
     return None
+
+
+class MessageMatch(NamedTuple):
+    """Результат проверки одного письма из архива."""
+
+    status: str  # MATCH_CODE, MATCH_NO_CODE, MATCH_SKIPPED или MATCH_ERROR
+    code: str | None = None
+    source: str | None = None  # где найден код: subject, header:…, text или html
+    # Почему отсеяно: to, subject, from, body (условия SEARCH), subject_format (формат темы платформы);
+    # для MATCH_ERROR — тип исключения
+    reason: str | None = None
+    subject: str = ""
+    date: datetime | None = None
+
+
+def archive_lookup(
+    mode: str,
+    folder: str,
+    recipient: str | None = None,
+    senders: tuple[str, ...] = PLATFORM_SENDERS,
+    body_contains: str | None = None,
+    rules: Sequence[CodeRule] = (),
+) -> _Lookup:
+    """
+    Условия поиска для match_message — те же, что у get_auth_code_from_email_async
+    (MODE_PLATFORM, MODE_EMAIL) и get_auth_code_from_sms_async (MODE_SMS), без возраста письма
+    и отметки «непрочитано»: у писем из архива их нет или они не важны.
+
+    :param mode: режим источника (code_sources.SOURCE_MODES)
+    :param folder: папка — по ней выбираются правила из rules
+    :param recipient: для MODE_EMAIL — адрес получателя (TO); None — письма на любой адрес
+    :param body_contains: для MODE_SMS — подстрока тела вместо SMS_BODY_MARKER
+    """
+    if mode not in SOURCE_MODES:
+        raise ValueError(f"неизвестный режим {mode!r} (допустимо: {', '.join(SOURCE_MODES)})")
+    if mode == MODE_SMS:
+        return _sms_lookup(folder, "", "", 0, body_contains, None, rules)
+    subject_contains = PLATFORM_OTP_SUBJECT_MARKERS if mode == MODE_PLATFORM else None
+    return _email_lookup(recipient, folder, "", "", 0, subject_contains, senders, None, rules)
+
+
+_HEADER_END = re.compile(rb"\r?\n\r?\n")
+
+
+def match_message(lookup: _Lookup, raw: bytes) -> MessageMatch:
+    """
+    Проверяет письмо raw (RFC 5322) так же, как его проверил бы поиск по IMAP: условия SEARCH
+    (получатель, тема, отправитель, подстрока тела — без учёта регистра, как на сервере),
+    фильтр по заголовкам, код в теме и заголовках, затем в первых EMAIL_BODY_PEEK_BYTES тела.
+    """
+    end = _HEADER_END.search(raw)
+    header, body = (raw[:end.end()], raw[end.end():]) if end else (raw, b"")
+    try:
+        c = _Candidate(0, header)
+        terms = lookup.terms
+        rules = lookup.matcher.rules
+        skipped = _search_mismatch(c, terms)
+        if skipped is None and not lookup.matcher.header_filter(c):
+            skipped = "subject_format"
+        marker = str(terms.get("body") or "").lower()
+        if skipped is None and marker:
+            c.text, c.html = _partial_text(header, body[:EMAIL_BODY_PEEK_BYTES], True)
+            if marker not in c.text.lower() and marker not in c.html.lower():
+                skipped = "body"
+        if skipped is not None:
+            return MessageMatch(MATCH_SKIPPED, reason=skipped, subject=c.subject, date=c.date)
+        found = _find_code(rules, c, rules.header_sources)
+        if found is None and rules.needs_body:
+            # Тело — только если кода нет в заголовках, как при обходе папки
+            if c.text is None:
+                c.text, c.html = _partial_text(header, body[:EMAIL_BODY_PEEK_BYTES], rules.needs_html)
+            found = _find_code(rules, c, rules.body_sources)
+    except Exception as e:
+        return MessageMatch(MATCH_ERROR, reason=type(e).__name__)
+    if found is None:
+        return MessageMatch(MATCH_NO_CODE, subject=c.subject, date=c.date)
+    code, source = found
+    return MessageMatch(MATCH_CODE, code, source, subject=c.subject, date=c.date)
+
+
+def _search_mismatch(c: _Candidate, terms: Mapping[str, object]) -> str | None:
+    """Какое условие SEARCH из заголовков письмо не проходит (to, subject, from) или None."""
+    recipient = terms.get("recipient")
+    if recipient and str(recipient).lower() not in _decode_header(c.fields.get("To")).lower():
+        return "to"
+    markers = terms.get("subject_markers") or ()
+    if markers and not any(m.lower() in c.subject.lower() for m in markers):
+        return "subject"
+    senders = terms.get("senders") or ()
+    if senders and not any(s.lower() in c.sender.lower() for s in senders):
+        return "from"
+    return None
+
+
+def get_auth_code_from_email(
+    recipient_email: str,
+    folder: str,
+    imap_user: str,
+    imap_password: str,
+    imap_host: str,
+    imap_port: int = 993,
+    subject_contains: str | tuple[str, ...] | None = None,
+    pool: ImapSessionPool | None = None,
+    wait: float | None = None,
+    senders: tuple[str, ...] = PLATFORM_SENDERS,
+    max_age: float | None = CODE_MAX_AGE,
+    watermarks: UidWatermarks | None = None,
+    rules: Sequence[CodeRule] = (),
+    cache_ttl: float = RESULT_CACHE_TTL,
+    on_stats: Callable[[FetchStats], None] | None = None,
+    timeout: float | None = FETCH_TIMEOUT,
+) -> str | None:
+    """
+    Синхронный вариант get_auth_code_from_email_async: выполняется в фоновом цикле событий,
+    pool — пул этого цикла (по умолчанию общий).
+    """
+    return run_sync(get_auth_code_from_email_async(
+        recipient_email=recipient_email,
+        folder=folder,
+        imap_user=imap_user,
+        imap_password=imap_password,
+        imap_host=imap_host,
+        imap_port=imap_port,
+        subject_contains=subject_contains,
+        pool=pool,
+        wait=wait,
+        senders=senders,
+        max_age=max_age,
+        watermarks=watermarks,
+        rules=rules,
+        cache_ttl=cache_ttl,
+        on_stats=on_stats,
+        timeout=timeout,
+    ))
+
+
+def get_auth_code_from_sms(
+    imap_user: str,
+    imap_password: str,
+    imap_host: str,
+    imap_port: int = 993,
+    folder: str = "sms",
+    body_contains: str | None = None,
+    pool: ImapSessionPool | None = None,
+    wait: float | None = None,
+    max_age: float | None = CODE_MAX_AGE,
+    watermarks: UidWatermarks | None = None,
+    rules: Sequence[CodeRule] = (),
+    cache_ttl: float = RESULT_CACHE_TTL,
+    on_stats: Callable[[FetchStats], None] | None = None,
+    timeout: float | None = FETCH_TIMEOUT,
+) -> str | None:
+    """Синхронный вариант get_auth_code_from_sms_async."""
+    return run_sync(get_auth_code_from_sms_async(
+        imap_user=imap_user,
+        imap_password=imap_password,
+        imap_host=imap_host,
+        imap_port=imap_port,
+        folder=folder,
+        body_contains=body_contains,
+        pool=pool,
+        wait=wait,
+        max_age=max_age,
+        watermarks=watermarks,
+        rules=rules,
+        cache_ttl=cache_ttl,
+        on_stats=on_stats,
+        timeout=timeout,
+    ))
+
+
+def get_auth_code_from_folders(
+    folders: Iterable[str],
+    imap_user: str,
+    imap_password: str,
+    imap_host: str,
+    imap_port: int = 993,
+    recipient_email: str | None = None,
+    subject_contains: str | tuple[str, ...] | None = PLATFORM_OTP_SUBJECT_MARKERS,
+    sms_folders: Collection[str] = ("sms",),
+    pool: ImapSessionPool | None = None,
+    wait: float | None = None,
+    senders: tuple[str, ...] = PLATFORM_SENDERS,
+    max_age: float | None = CODE_MAX_AGE,
+    watermarks: UidWatermarks | None = None,
+    rules: Sequence[CodeRule] = (),
+    cache_ttl: float = RESULT_CACHE_TTL,
+    on_stats: Callable[[FetchStats], None] | None = None,
+    timeout: float | None = FETCH_TIMEOUT,
+) -> tuple[str, str] | None:
+    """Синхронный вариант get_auth_code_from_folders_async."""
+    return run_sync(get_auth_code_from_folders_async(
+        folders=folders,
+        imap_user=imap_user,
+        imap_password=imap_password,
+        imap_host=imap_host,
+        imap_port=imap_port,
+        recipient_email=recipient_email,
+        subject_contains=subject_contains,
+        sms_folders=sms_folders,
+        pool=pool,
+        wait=wait,
+        senders=senders,
+        max_age=max_age,
+        watermarks=watermarks,
+        rules=rules,
+        cache_ttl=cache_ttl,
+        on_stats=on_stats,
+        timeout=timeout,
+    ))
+
+
+def fetch_code_from_source(
+    source: Source,
+    account: Account,
+    pool: ImapSessionPool | None = None,
+    wait: float | None = None,
+    senders: tuple[str, ...] = PLATFORM_SENDERS,
+    max_age: float | None = CODE_MAX_AGE,
+    watermarks: UidWatermarks | None = None,
+    rules: Sequence[CodeRule] = (),
+    cache_ttl: float = RESULT_CACHE_TTL,
+    on_stats: Callable[[FetchStats], None] | None = None,
+    timeout: float | None = FETCH_TIMEOUT,
+) -> CodeResult:
+    """Синхронный вариант fetch_code_from_source_async."""
+    return run_sync(fetch_code_from_source_async(
+        source=source,
+        account=account,
+        pool=pool,
+        wait=wait,
+        senders=senders,
+        max_age=max_age,
+        watermarks=watermarks,
+        rules=rules,
+        cache_ttl=cache_ttl,
+        on_stats=on_stats,
+        timeout=timeout,
+    ))
+
+
+def fetch_code_from_sources(
+    sources: Iterable[Source],
+    accounts: Mapping[str, Account] | Iterable[Account],
+    pool: ImapSessionPool | None = None,
+    wait: float | None = None,
+    senders: tuple[str, ...] = PLATFORM_SENDERS,
+    max_age: float | None = CODE_MAX_AGE,
+    watermarks: UidWatermarks | None = None,
+    rules: Sequence[CodeRule] = (),
+    cache_ttl: float = RESULT_CACHE_TTL,
+    on_stats: Callable[[FetchStats], None] | None = None,
+    timeout: float | None = FETCH_TIMEOUT,
+) -> CodeResult:
+    """Синхронный вариант fetch_code_from_sources_async."""
+    return run_sync(fetch_code_from_sources_async(
+        sources=sources,
+        accounts=accounts,
+        pool=pool,
+        wait=wait,
+        senders=senders,
+        max_age=max_age,
+        watermarks=watermarks,
+        rules=rules,
+        cache_ttl=cache_ttl,
+        on_stats=on_stats,
+        timeout=timeout,
+    ))
+
+
+def get_auth_code_from_source(
+    source: Source,
+    account: Account,
+    pool: ImapSessionPool | None = None,
+    wait: float | None = None,
+    senders: tuple[str, ...] = PLATFORM_SENDERS,
+    max_age: float | None = CODE_MAX_AGE,
+    watermarks: UidWatermarks | None = None,
+    rules: Sequence[CodeRule] = (),
+    cache_ttl: float = RESULT_CACHE_TTL,
+    on_stats: Callable[[FetchStats], None] | None = None,
+    timeout: float | None = FETCH_TIMEOUT,
+) -> str | None:
+    """Синхронный вариант get_auth_code_from_source_async."""
+    return run_sync(get_auth_code_from_source_async(
+        source=source,
+        account=account,
+        pool=pool,
+        wait=wait,
+        senders=senders,
+        max_age=max_age,
+        watermarks=watermarks,
+        rules=rules,
+        cache_ttl=cache_ttl,
+        on_stats=on_stats,
+        timeout=timeout,
+    ))
+
+
+def get_auth_code_from_sources(
+    sources: Iterable[Source],
+    accounts: Mapping[str, Account] | Iterable[Account],
+    pool: ImapSessionPool | None = None,
+    wait: float | None = None,
+    senders: tuple[str, ...] = PLATFORM_SENDERS,
+    max_age: float | None = CODE_MAX_AGE,
+    watermarks: UidWatermarks | None = None,
+    rules: Sequence[CodeRule] = (),
+    cache_ttl: float = RESULT_CACHE_TTL,
+    on_stats: Callable[[FetchStats], None] | None = None,
+    timeout: float | None = FETCH_TIMEOUT,
+) -> tuple[str, str] | None:
+    """Синхронный вариант get_auth_code_from_sources_async."""
+    return run_sync(get_auth_code_from_sources_async(
+        sources=sources,
+        accounts=accounts,
+        pool=pool,
+        wait=wait,
+        senders=senders,
+        max_age=max_age,
+        watermarks=watermarks,
+        rules=rules,
+        cache_ttl=cache_ttl,
+        on_stats=on_stats,
+        timeout=timeout,
+    ))
+
+
+def get_auth_codes_for_recipients(
+    recipients: Iterable[str],
+    folder: str,
+    imap_user: str,
+    imap_password: str,
+    imap_host: str,
+    imap_port: int = 993,
+    pool: ImapSessionPool | None = None,
+    wait: float | None = None,
+    senders: tuple[str, ...] = PLATFORM_SENDERS,
+    max_age: float | None = CODE_MAX_AGE,
+    rules: Sequence[CodeRule] = (),
+    on_stats: Callable[[FetchStats], None] | None = None,
+    timeout: float | None = FETCH_TIMEOUT,
+) -> dict[str, str | None]:
+    """Синхронный вариант get_auth_codes_for_recipients_async."""
+    return run_sync(get_auth_codes_for_recipients_async(
+        recipients=recipients,
+        folder=folder,
+        imap_user=imap_user,
+        imap_password=imap_password,
+        imap_host=imap_host,
+        imap_port=imap_port,
+        pool=pool,
+        wait=wait,
+        senders=senders,
+        max_age=max_age,
+        rules=rules,
+        on_stats=on_stats,
+        timeout=timeout,
+    ))
@@ -1,8 +1,13 @@
 # -*- mode: python ; coding: utf-8 -*-
-# Сборка: pyinstaller energochain_fetcher.spec
+# Сборка: pyinstaller energochain_fetcher.spec              — один файл dist/EnergoChainCodeFetcher(.exe)
+#         pyinstaller energochain_fetcher.spec -- --onedir  — папка dist/EnergoChainCodeFetcher/
+# Один файл при каждом запуске распаковывает себя во временную папку; папка запускается
+# без распаковки — окно появляется заметно быстрее (см. bench_startup.py).
 
 import sys
 
+ONEDIR = "--onedir" in sys.argv
+
 block_cipher = None
 
 a = Analysis(
@@ -10,7 +15,11 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[],
-    hiddenimports=["imap_tools", "config_loader", "email_code_fetcher", "settings_store", "app_dir"],
+    # Движок поиска app импортирует не сразу, а после показа окна
+    hiddenimports=[
+        "imap_tools", "config_loader", "email_code_fetcher", "fetch_executor", "imap_pool", "imap_client",
+        "settings_store", "app_dir",
+    ],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -23,20 +32,13 @@ a = Analysis(
 
 pyz = PYZ(a.pure, a.zipped_data, cipher=block_cipher)
 
-exe = EXE(
-    pyz,
-    a.scripts,
-    a.binaries,
-    a.zipfiles,
-    a.datas,
-    [],
+exe_options = dict(
     name="EnergoChainCodeFetcher",
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
     upx=True,
     upx_exclude=[],
-    runtime_tmpdir=None,
     console=False,  # GUI без консольного окна; запуск: EnergoChainCodeFetcher.exe из cmd/PowerShell
     disable_windowed_traceback=False,
     argv_emulation=False,
@@ -44,3 +46,29 @@ exe = EXE(
     codesign_identity=None,
     entitlements_file=None,
 )
+
+if ONEDIR:
+    # UPX экономит место, но каждый запуск распаковывает сжатые библиотеки в память — для папки не нужен
+    exe_options["upx"] = False
+    exe = EXE(pyz, a.scripts, [], exclude_binaries=True, **exe_options)
+    coll = COLLECT(
+        exe,
+        a.binaries,
+        a.zipfiles,
+        a.datas,
+        strip=False,
+        upx=False,
+        upx_exclude=[],
+        name="EnergoChainCodeFetcher",
+    )
+else:
+    exe = EXE(
+        pyz,
+        a.scripts,
+        a.binaries,
+        a.zipfiles,
+        a.datas,
+        [],
+        runtime_tmpdir=None,
+        **exe_options,
+    )
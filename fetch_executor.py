@@ -0,0 +1,77 @@
+"""
+Исполнитель запросов кодов для GUI: корутины выполняются в фоновом цикле событий
+(imap_pool.get_background_loop), не больше max_parallel одновременно.
+
+У каждого режима (кнопки) — не больше одного запроса: новый запрос отменяет прежний
+того же режима, вместе с его IMAP-сессией посреди обхода (отменённая сессия
+закрывается пулом, в пул не возвращается), если этот поиск не ждёт кто-то ещё.
+Результат отменённого или устаревшего запроса до вызывающего не доходит.
+"""
+import asyncio
+import concurrent.futures
+import threading
+from typing import Callable, Coroutine
+
+from imap_pool import get_background_loop
+
+MAX_PARALLEL_FETCHES = 4  # Сколько запросов кодов из окна выполняются одновременно; остальные ждут
+
+
+class FetchExecutor:
+    def __init__(self, max_parallel: int = MAX_PARALLEL_FETCHES, loop: asyncio.AbstractEventLoop | None = None):
+        self.max_parallel = max_parallel
+        self._loop = loop or get_background_loop()
+        self._limit: asyncio.Semaphore | None = None  # создаётся в цикле событий при первом запросе
+        self._current: dict[str, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        mode: str,
+        make_coro: Callable[[], Coroutine[object, object, object]],
+        on_done: Callable[[object], None],
+    ) -> concurrent.futures.Future:
+        """
+        Запускает make_coro() для режима mode, отменяя прежний запрос этого режима.
+        on_done(результат или исключение) вызывается в потоке цикла событий и только
+        если запрос не отменён и не вытеснен более новым того же режима.
+        """
+        # Новый запрос ставится в цикл раньше отмены прежнего: если он ищет то же самое, то
+        # присоединится к идущему поиску (single_flight), и тот не будет прерван зря
+        future = asyncio.run_coroutine_threadsafe(self._run(make_coro), self._loop)
+        with self._lock:
+            previous = self._current.get(mode)
+            self._current[mode] = future
+        if previous is not None:
+            previous.cancel()
+        future.add_done_callback(lambda f: self._finish(mode, f, on_done))
+        return future
+
+    async def _run(self, make_coro: Callable[[], Coroutine[object, object, object]]) -> object:
+        if self._limit is None:
+            self._limit = asyncio.Semaphore(self.max_parallel)
+        async with self._limit:
+            return await make_coro()
+
+    def _finish(self, mode: str, future: concurrent.futures.Future, on_done: Callable[[object], None]) -> None:
+        with self._lock:
+            latest = self._current.get(mode) is future
+            if latest:
+                del self._current[mode]
+        if not latest or future.cancelled():
+            return
+        error = future.exception()
+        on_done(error if error is not None else future.result())
+
+    def cancel(self, mode: str) -> None:
+        with self._lock:
+            future = self._current.pop(mode, None)
+        if future is not None:
+            future.cancel()
+
+    def cancel_all(self) -> None:
+        with self._lock:
+            futures = list(self._current.values())
+            self._current.clear()
+        for future in futures:
+            future.cancel()
@@ -0,0 +1,249 @@
+"""
+Замеры одного запроса кода: время по фазам (очередь в пуле, DNS, TCP, TLS, LOGIN,
+SELECT, SEARCH, FETCH, разбор, ожидание) и счётчики (писем просмотрено, байт скачано, порций, попаданий в кэш).
+
+Текущие замеры живут в contextvars: IMAP-клиент и обход папки отмечают фазы через
+phase()/count(), не зная, кто их запросил. По окончании запроса FetchStats уходит
+в обработчики add_stats_hook() и в on_stats вызова; JsonlStatsWriter пишет их в
+fetch_stats.jsonl рядом с config.ini.
+"""
+import atexit
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator
+
+from app_dir import get_base_dir
+
+STATS_FILE = "fetch_stats.jsonl"
+STATS_WRITE_DELAY = 1.0  # Строки замеров копятся столько секунд и дописываются в файл одной записью
+
+# Итог запроса (FetchStats.status)
+STATUS_FOUND = "found"
+STATUS_NOT_FOUND = "not_found"
+STATUS_TIMEOUT = "timeout"  # сервер не ответил вовремя или истёк срок запроса
+STATUS_AUTH_FAILED = "auth_failed"  # сервер отверг логин или пароль
+STATUS_UNAVAILABLE = "unavailable"  # сервер отключён автоматом после сбоев подряд (circuit_breaker)
+STATUS_ERROR = "error"  # прочие ошибки: обрыв связи, нет папки и т.п.
+
+# Порядок и подписи фаз для краткой сводки в окне
+PHASE_LABELS = {
+    "queue": "очередь",  # ожидание свободной сессии (ImapSessionPool.max_busy)
+    "dns": "DNS",
+    "tcp": "TCP",
+    "tls": "TLS",
+    "login": "вход",
+    "status": "состояние",  # STATUS: не изменилась ли папка с прошлого поиска
+    "select": "папка",
+    "search": "поиск",
+    "fetch": "загрузка",
+    "parse": "разбор",
+    "wait": "ожидание",
+}
+
+
+class FetchStats:
+    """
+    Замеры одного запроса. Для поиска сразу в нескольких папках фазы суммируются
+    по всем папкам (могут превышать total), total — реальное время запроса.
+    """
+
+    def __init__(self, kind: str, user: str, host: str, folder: str):
+        self.kind = kind  # "email", "sms", "folders", "sources" или режим источника (code_sources)
+        self.user = user
+        self.host = host
+        self.folder = folder
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.total = 0.0
+        self.phases: dict[str, float] = {}
+        self.messages_scanned = 0
+        self.bytes_downloaded = 0
+        self.bytes_uploaded = 0
+        self.bytes_saved = 0  # сэкономлено сжатием COMPRESS=DEFLATE (в обе стороны); байты выше — уже сжатые
+        self.chunks_fetched = 0
+        self.round_trips = 0
+        self.cache_hits: dict[str, int] = {}  # session — сессия из пула, select — папка уже выбрана, watermark — отметка UID
+        self.code_found = False
+        self.error: str | None = None
+        self.status: str | None = None  # STATUS_*; выставляется по окончании запроса, если не выставлен раньше
+
+    def add_phase(self, name: str, seconds: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def hit(self, kind: str) -> None:
+        self.cache_hits[kind] = self.cache_hits.get(kind, 0) + 1
+
+    def fail(self, error: BaseException) -> None:
+        """Отмечает ошибку; итог — по атрибуту fetch_status исключения (у ошибок IMAP), иначе STATUS_ERROR."""
+        self.error = f"{type(error).__name__}: {error}"
+        default = STATUS_TIMEOUT if isinstance(error, TimeoutError) else STATUS_ERROR
+        self.status = getattr(error, "fetch_status", default)
+
+    def finish(self) -> None:
+        self.total = time.perf_counter() - self._started
+        if self.code_found:
+            self.status = STATUS_FOUND
+        elif self.status is None:
+            self.status = STATUS_NOT_FOUND
+
+    def as_dict(self) -> dict:
+        return {
+            "started_at": round(self.started_at, 3),
+            "kind": self.kind,
+            "user": self.user,
+            "host": self.host,
+            "folder": self.folder,
+            "total": round(self.total, 4),
+            "phases": {k: round(v, 4) for k, v in self.phases.items()},
+            "messages_scanned": self.messages_scanned,
+            "bytes_downloaded": self.bytes_downloaded,
+            "bytes_uploaded": self.bytes_uploaded,
+            "bytes_saved": self.bytes_saved,
+            "chunks_fetched": self.chunks_fetched,
+            "round_trips": self.round_trips,
+            "cache_hits": dict(self.cache_hits),
+            "code_found": self.code_found,
+            "status": self.status,
+            "error": self.error,
+        }
+
+    def summary(self) -> str:
+        """Краткая сводка для окна: «0.84 с: вход 0.31 · поиск 0.12 · загрузка 0.35»."""
+        parts = [
+            f"{label} {self.phases[name]:.2f}"
+            for name, label in PHASE_LABELS.items()
+            if self.phases.get(name, 0.0) >= 0.005
+        ]
+        head = f"{self.total:.2f} с"
+        return f"{head}: {' · '.join(parts)}" if parts else head
+
+
+_current: contextvars.ContextVar[FetchStats | None] = contextvars.ContextVar("fetch_stats", default=None)
+
+
+def current() -> FetchStats | None:
+    return _current.get()
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Добавляет время блока к фазе name текущих замеров (если замеры идут)."""
+    stats = _current.get()
+    if stats is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.add_phase(name, time.perf_counter() - started)
+
+
+def count(name: str, value: int = 1) -> None:
+    """Увеличивает счётчик текущих замеров (messages_scanned, bytes_downloaded и т.п.)."""
+    stats = _current.get()
+    if stats is not None:
+        setattr(stats, name, getattr(stats, name) + value)
+
+
+def hit(kind: str) -> None:
+    stats = _current.get()
+    if stats is not None:
+        stats.hit(kind)
+
+
+@contextmanager
+def collect(
+    kind: str, user: str, host: str, folder: str, on_stats: Callable[[FetchStats], None] | None = None
+) -> Iterator[FetchStats]:
+    """
+    Замеры на время блока; по выходу — finish() и рассылка обработчикам.
+    Блок сам отмечает stats.code_found и, если ошибку гасит, stats.fail(e).
+    """
+    stats = FetchStats(kind, user, host, folder)
+    token = _current.set(stats)
+    try:
+        yield stats
+    except BaseException as e:
+        stats.fail(e)
+        raise
+    finally:
+        _current.reset(token)
+        stats.finish()
+        _emit(stats, on_stats)
+
+
+_hooks: list[Callable[[FetchStats], None]] = []
+_hooks_lock = threading.Lock()
+
+
+def add_stats_hook(hook: Callable[[FetchStats], None]) -> None:
+    """Обработчик вызывается после каждого запроса кода (в потоке цикла событий — должен быть быстрым)."""
+    with _hooks_lock:
+        if hook not in _hooks:
+            _hooks.append(hook)
+
+
+def remove_stats_hook(hook: Callable[[FetchStats], None]) -> None:
+    with _hooks_lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+
+def _emit(stats: FetchStats, on_stats: Callable[[FetchStats], None] | None) -> None:
+    with _hooks_lock:
+        hooks = list(_hooks)
+    if on_stats is not None:
+        hooks.append(on_stats)
+    for hook in hooks:
+        try:
+            hook(stats)
+        except Exception:
+            # Сбой в обработчике замеров не должен ломать получение кода
+            pass
+
+
+class JsonlStatsWriter:
+    """
+    Обработчик для add_stats_hook: дописывает замеры строкой JSON в fetch_stats.jsonl.
+    Обработчик зовётся на цикле событий, поэтому сам файл не трогает: строки копятся
+    и дописываются через write_delay секунд в отдельном потоке (и при выходе).
+    """
+
+    def __init__(self, path: Path | None = None, write_delay: float = STATS_WRITE_DELAY):
+        self.path = path or get_base_dir() / STATS_FILE
+        self.write_delay = write_delay
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # запись файла — по одной
+        self._pending: list[str] = []
+        self._timer: threading.Timer | None = None
+        atexit.register(self.flush)
+
+    def __call__(self, stats: FetchStats) -> None:
+        line = json.dumps(stats.as_dict(), ensure_ascii=False)
+        with self._lock:
+            self._pending.append(line)
+            if self._timer is None:
+                self._timer = threading.Timer(self.write_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self) -> None:
+        """Сразу дописывает накопленные строки в файл."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            lines, self._pending = self._pending, []
+        if not lines:
+            return
+        with self._write_lock:
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+            except OSError:
+                pass
@@ -0,0 +1,636 @@
+"""
+Асинхронный IMAP-клиент на потоках asyncio (SSL или без шифрования).
+
+Умеет ровно то, что нужно для поиска кодов: LOGIN, COMPRESS, SELECT, STATUS, UID SEARCH,
+UID FETCH, NOOP, IDLE и LOGOUT. Команды одного клиента выполняются по очереди, кроме
+конвейера UID FETCH (fetch_pipeline): там несколько команд в полёте сразу. Параллельность
+достигается множеством клиентов на одном цикле событий (см. imap_pool).
+"""
+import asyncio
+import contextlib
+import contextvars
+import re
+import socket
+import ssl
+import time
+import zlib
+from collections.abc import AsyncIterator, Iterator
+from typing import NamedTuple
+
+from imap_tools.consts import UID_PATTERN
+from imap_tools.utils import encode_folder, quote
+
+import fetch_stats
+
+IMAP_PORT_SSL = 993
+CONNECT_TIMEOUT = 30  # Подключение и приветствие сервера (секунд)
+COMMAND_TIMEOUT = 60  # Ответ на одну команду (секунд)
+# Ограничение длины одной строки ответа: ответ SEARCH по большой папке — одна длинная строка
+READ_LIMIT = 16 * 1024 * 1024
+RAW_READ_SIZE = 64 * 1024  # Сколько сжатых байт читать из сокета за раз (COMPRESS=DEFLATE)
+
+_LITERAL_RE = re.compile(rb"\{(\d+)\+?\}\r\n$")
+_TAGGED_RE = re.compile(rb"^(?P<tag>[A-Z]\d+) (?P<status>OK|NO|BAD)\b ?(?P<text>.*)$", re.IGNORECASE)
+_CODE_RE = re.compile(rb"\[(?P<name>[A-Z\-]+)(?: (?P<value>[^\]]*))?\]", re.IGNORECASE)
+_STATUS_ITEMS_RE = re.compile(rb"\(([^()]*)\)\s*$")
+_SECTION_RE = re.compile(rb"\b(?:BODY|BINARY)\[", re.IGNORECASE)
+_QUOTED_OR_NIL_RE = re.compile(rb'\](?:<\d+>)?\s+(?:NIL|"(?P<quoted>(?:[^"\\]|\\.)*)")', re.IGNORECASE)
+
+
+class ImapError(Exception):
+    """Сервер ответил на команду NO или BAD. Соединение при этом исправно."""
+
+
+class ImapAuthError(ImapError):
+    """Сервер отверг LOGIN: неверный логин или пароль, вход запрещён."""
+
+    fetch_status = fetch_stats.STATUS_AUTH_FAILED
+
+
+class ImapAbort(ConnectionError):
+    """Соединение оборвано или сервер ответил не по протоколу — клиент больше не пригоден."""
+
+
+class ImapTimeout(ImapAbort):
+    """Сервер не ответил вовремя или истёк срок запроса (deadline); соединение закрыто."""
+
+    fetch_status = fetch_stats.STATUS_TIMEOUT
+
+
+_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar("imap_deadline", default=None)
+
+
+@contextlib.contextmanager
+def deadline(seconds: float | None) -> Iterator[None]:
+    """
+    Срок для всего IMAP внутри блока (и задач, запущенных из него): подключение, LOGIN,
+    очередь в пуле и каждая команда получают не больше оставшегося времени, а по его
+    истечении — ImapTimeout. Вложенный срок не продлевает внешний; None — без срока.
+    """
+    if seconds is None:
+        yield
+        return
+    limit = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(limit if outer is None else min(outer, limit))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def time_left() -> float | None:
+    """Сколько секунд осталось до срока текущего запроса (deadline); None — срока нет."""
+    limit = _deadline.get()
+    return None if limit is None else max(0.0, limit - time.monotonic())
+
+
+def _step_timeout(limit: float) -> float:
+    # Таймаут одного шага — свой, но не дольше, чем осталось до срока запроса
+    left = time_left()
+    return limit if left is None else min(limit, left)
+
+
+def _timeout_message(limit: float) -> str:
+    return "истёк срок запроса" if time_left() == 0.0 else f"нет ответа за {limit:g} с"
+
+
+class Untagged(NamedTuple):
+    """Нетегированный ответ «* ...»: текст всех строк (с маркерами {n}) и литералы по порядку."""
+
+    text: bytes
+    literals: list[bytes]
+
+
+class _Literal(bytes):
+    """Аргумент команды, который отправляется литералом {n} (не-ASCII пароль и т.п.)."""
+
+
+class _DeflateReader:
+    """
+    Чтение после COMPRESS=DEFLATE (RFC 4978): распаковывает поток соединения в свой буфер.
+    Умеет то, что клиенту нужно от StreamReader: readline и readexactly. Чтение можно
+    отменять — уже распакованное остаётся в буфере. Сжатые байты и экономию считает
+    в замеры того запроса, который их читает.
+    """
+
+    def __init__(self, raw: asyncio.StreamReader, limit: int = READ_LIMIT):
+        self._raw = raw
+        self._limit = limit
+        self._inflate = zlib.decompressobj(-zlib.MAX_WBITS)
+        self._buf = bytearray()
+        self._eof = False
+
+    async def _fill(self) -> None:
+        data = await self._raw.read(RAW_READ_SIZE)
+        if not data:
+            self._eof = True
+            return
+        try:
+            plain = self._inflate.decompress(data)
+        except zlib.error as e:
+            raise ValueError(f"повреждён сжатый поток: {e}") from e
+        fetch_stats.count("bytes_downloaded", len(data))
+        fetch_stats.count("bytes_saved", len(plain) - len(data))
+        self._buf += plain
+
+    async def readline(self) -> bytes:
+        start = 0
+        while True:
+            end = self._buf.find(b"\n", start)
+            if end >= 0 or self._eof:
+                end = end + 1 if end >= 0 else len(self._buf)
+                line = bytes(self._buf[:end])
+                del self._buf[:end]
+                return line
+            if len(self._buf) > self._limit:
+                raise ValueError("строка ответа длиннее READ_LIMIT")
+            start = len(self._buf)
+            await self._fill()
+
+    async def readexactly(self, n: int) -> bytes:
+        while len(self._buf) < n:
+            if self._eof:
+                raise asyncio.IncompleteReadError(bytes(self._buf), n)
+            await self._fill()
+        data = bytes(self._buf[:n])
+        del self._buf[:n]
+        return data
+
+
+class FetchPipeline:
+    """
+    Конвейер UID FETCH (RFC 3501, 5.5): submit() отправляет команду сразу, не дожидаясь
+    ответов на предыдущие; result() дочитывает ответы, пока не придёт нужный. Ответы
+    FETCH раскладываются по командам по UID, поэтому UID в полёте не должны повторяться.
+    Создаётся только через ImapClient.fetch_pipeline().
+    """
+
+    def __init__(self, client: "ImapClient"):
+        self._client = client
+        self._inflight: list[bytes] = []  # теги отправленных, но ещё не завершённых команд
+        self._parts: dict[bytes, dict[int, bytes]] = {}
+        self._errors: dict[bytes, ImapError] = {}
+        self._owner: dict[int, bytes] = {}  # UID -> тег команды, которая его запросила
+
+    @property
+    def busy(self) -> bool:
+        return bool(self._inflight)
+
+    async def submit(self, uids: list[int], item: str) -> bytes:
+        """Отправляет UID FETCH; возвращает тег для result()."""
+        client = self._client
+        tag = client._next_tag()
+        if not self._inflight:
+            fetch_stats.count("round_trips")  # команда за уже летящими не добавляет ожидания
+        uid_set = ",".join(map(str, uids)).encode("ascii")
+        await client._send(b"%s UID FETCH %s (UID %s)\r\n" % (tag, uid_set, item.encode("ascii")))
+        self._inflight.append(tag)
+        self._parts[tag] = {}
+        self._owner.update((uid, tag) for uid in uids)
+        return tag
+
+    async def result(self, tag: bytes) -> dict[int, bytes]:
+        """{uid: данные} команды tag. NO/BAD на эту команду — ImapError."""
+        with fetch_stats.phase("fetch"):
+            while tag in self._inflight:
+                await self._read_one()
+        fetch_stats.count("chunks_fetched")
+        parts = self._parts.pop(tag)
+        if tag in self._errors:
+            raise self._errors.pop(tag)
+        return parts
+
+    async def drain(self) -> None:
+        """Дочитывает ответы на все отправленные команды; их данные отбрасываются."""
+        while self._inflight:
+            await self._read_one()
+        self._parts.clear()
+        self._errors.clear()
+
+    async def _read_one(self) -> None:
+        client = self._client
+        text, literals = await client._timed(client._read_response())
+        tag = text.split(b" ", 1)[0]
+        if tag in self._inflight:
+            self._inflight.remove(tag)
+            try:
+                client._check_tagged(text, tag)
+            except ImapError as e:
+                self._errors[tag] = e
+            return
+        if text.upper().startswith(b"* BYE"):
+            client.close()
+            raise ImapAbort(text.decode("utf-8", "replace"))
+        part = _fetch_part(Untagged(text, literals))
+        if part is not None and self._owner.get(part[0]) in self._parts:
+            self._parts[self._owner.pop(part[0])][part[0]] = part[1]
+
+
+class ImapClient:
+    """
+    Одно IMAP-соединение. Все методы — корутины, вызываются из одного цикла событий.
+    После ImapAbort клиент закрыт; после ImapError им можно пользоваться дальше.
+    """
+
+    def __init__(self, host: str, port: int = IMAP_PORT_SSL, tls: bool = True, ssl_context: ssl.SSLContext | None = None):
+        self.host = host
+        self.port = port
+        self.tls = tls
+        self.ssl_context = ssl_context
+        self.capabilities: frozenset[str] = frozenset()
+        self.folder: str | None = None  # выбранная папка (SELECT)
+        self.uidvalidity: int | None = None
+        self._reader: asyncio.StreamReader | _DeflateReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._deflate = None  # zlib-компрессор исходящего потока после COMPRESS=DEFLATE
+        self._tag = 0
+        self._lock = asyncio.Lock()
+
+    # --- соединение ---
+
+    async def connect(self) -> None:
+        """DNS, TCP и TLS выполняются отдельными шагами, чтобы замеры показывали каждый."""
+        try:
+            await asyncio.wait_for(self._open(), _step_timeout(CONNECT_TIMEOUT))
+            greeting, _ = await asyncio.wait_for(self._read_response(), _step_timeout(CONNECT_TIMEOUT))
+        except asyncio.TimeoutError:
+            self.close()
+            raise ImapTimeout(f"{self.host}:{self.port}: подключение — {_timeout_message(CONNECT_TIMEOUT)}") from None
+        if not greeting.upper().startswith((b"* OK", b"* PREAUTH")):
+            self.close()
+            raise ImapAbort(f"{self.host}:{self.port}: {greeting.decode('utf-8', 'replace')}")
+        if not self._update_capabilities(greeting):
+            await self.capability()
+
+    async def _open(self) -> None:
+        loop = asyncio.get_running_loop()
+        with fetch_stats.phase("dns"):
+            addresses = await loop.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM)
+        error: OSError | None = None
+        with fetch_stats.phase("tcp"):
+            for *_, address in addresses:
+                try:
+                    self._reader, self._writer = await asyncio.open_connection(
+                        address[0], address[1], limit=READ_LIMIT
+                    )
+                    break
+                except OSError as e:
+                    error = e
+            else:
+                raise error or ImapAbort(f"{self.host}: адрес не найден")
+        if self.tls:
+            context = self.ssl_context or ssl.create_default_context()
+            with fetch_stats.phase("tls"):
+                await self._writer.start_tls(context, server_hostname=self.host)
+
+    def close(self) -> None:
+        """Закрывает соединение без LOGOUT (в том числе посреди команды)."""
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.transport.abort()
+
+    @property
+    def closed(self) -> bool:
+        return self._writer is None
+
+    @property
+    def compressed(self) -> bool:
+        return self._deflate is not None
+
+    # --- команды ---
+
+    async def capability(self) -> frozenset[str]:
+        for resp in await self.command(b"CAPABILITY"):
+            if resp.text.upper().startswith(b"* CAPABILITY "):
+                self.capabilities = frozenset(resp.text[13:].decode("ascii", "replace").upper().split())
+        return self.capabilities
+
+    async def login(self, user: str, password: str) -> None:
+        """LOGIN; отказ сервера — ImapAuthError."""
+        with fetch_stats.phase("login"):
+            try:
+                tagged = await self._command_text(b"LOGIN", _astring(user), _astring(password))
+            except ImapError as e:
+                raise ImapAuthError(f"{self.host}: вход не выполнен: {e}") from None
+        # Многие серверы сообщают новый список возможностей прямо в ответе на LOGIN
+        if not self._update_capabilities(tagged):
+            await self.capability()
+
+    async def compress(self) -> bool:
+        """
+        Включает сжатие DEFLATE (RFC 4978), если сервер объявил COMPRESS=DEFLATE.
+        False — сервер не умеет или отказал: соединение работает дальше без сжатия.
+        """
+        if self._deflate is not None:
+            return True
+        if "COMPRESS=DEFLATE" not in self.capabilities:
+            return False
+        try:
+            await self.command(b"COMPRESS", b"DEFLATE")
+        except ImapError:
+            return False
+        # Всё после ответа OK сервер уже сжимает, в том числе то, что StreamReader успел прочитать
+        self._reader = _DeflateReader(self._reader)
+        self._deflate = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return True
+
+    async def select(self, folder: str) -> int | None:
+        """
+        SELECT папки; если клиент уже стоит в ней, повторно не переключается.
+        Возвращает UIDVALIDITY папки (None, если сервер его не сообщил).
+        """
+        if self.folder == folder:
+            fetch_stats.hit("select")
+            return self.uidvalidity
+        self.folder = self.uidvalidity = None
+        uidvalidity = None
+        with fetch_stats.phase("select"):
+            responses = await self.command(b"SELECT", encode_folder(folder))
+        for resp in responses:
+            for code in _CODE_RE.finditer(resp.text):
+                if code.group("name").upper() == b"UIDVALIDITY" and (code.group("value") or b"").isdigit():
+                    uidvalidity = int(code.group("value"))
+        self.folder, self.uidvalidity = folder, uidvalidity
+        return uidvalidity
+
+    async def status(self, folder: str, items: tuple[str, ...]) -> dict[str, int]:
+        """
+        STATUS папки (например, UIDNEXT UNSEEN UIDVALIDITY) без её выбора: {элемент: значение}.
+        Элементы, которые сервер не сообщил, в ответ не попадают.
+        """
+        values: dict[str, int] = {}
+        with fetch_stats.phase("status"):
+            responses = await self.command(b"STATUS", encode_folder(folder), f"({' '.join(items)})".encode("ascii"))
+        for resp in responses:
+            if not resp.text.upper().startswith(b"* STATUS "):
+                continue
+            found = _STATUS_ITEMS_RE.search(resp.text)
+            pairs = found.group(1).decode("ascii", "replace").split() if found else []
+            for name, value in zip(pairs[::2], pairs[1::2]):
+                if value.isdigit():
+                    values[name.upper()] = int(value)
+        return values
+
+    async def uid_search(self, criteria: str, charset: str | None = "US-ASCII") -> list[int]:
+        args = [b"UID", b"SEARCH"]
+        if charset:
+            args += [b"CHARSET", charset.encode("ascii")]
+        args.append(criteria.encode(charset or "us-ascii"))
+        uids: list[int] = []
+        with fetch_stats.phase("search"):
+            responses = await self.command(*args)
+        for resp in responses:
+            if resp.text.upper().startswith(b"* SEARCH"):
+                uids.extend(int(x) for x in resp.text[8:].split() if x.isdigit())
+        return uids
+
+    async def uid_fetch(self, uids: list[int], item: str) -> dict[int, bytes]:
+        """Один UID FETCH на весь список uids; возвращает {uid: данные item}."""
+        uid_set = ",".join(map(str, uids)).encode("ascii")
+        with fetch_stats.phase("fetch"):
+            responses = await self.command(b"UID", b"FETCH", uid_set, f"(UID {item})".encode("ascii"))
+        fetch_stats.count("chunks_fetched")
+        return dict(part for part in map(_fetch_part, responses) if part is not None)
+
+    @contextlib.asynccontextmanager
+    async def fetch_pipeline(self) -> AsyncIterator[FetchPipeline]:
+        """
+        Конвейер UID FETCH на время блока; другие команды клиента ждут его окончания.
+        При выходе ответы на ещё летящие команды дочитываются (соединение остаётся
+        пригодным); при отмене посреди конвейера соединение закрывается.
+        """
+        async with self._lock:
+            if self._writer is None:
+                raise ImapAbort("соединение закрыто")
+            pipeline = FetchPipeline(self)
+            try:
+                yield pipeline
+            except asyncio.CancelledError:
+                if pipeline.busy:
+                    self.close()
+                raise
+            finally:
+                if pipeline.busy and not self.closed:
+                    await pipeline.drain()
+
+    async def noop(self) -> None:
+        await self.command(b"NOOP")
+
+    async def logout(self) -> None:
+        try:
+            await self.command(b"LOGOUT")
+        except (ImapError, ImapAbort):
+            pass
+        finally:
+            self.close()
+
+    async def idle(self, timeout: float, stop: asyncio.Event | None = None) -> bool:
+        """
+        IDLE (RFC 2177) до timeout секунд (не дольше срока запроса) или до выставления stop.
+        Возвращает True, если сервер сообщил об изменениях в папке (EXISTS/RECENT/FETCH).
+        """
+        with fetch_stats.phase("wait"):
+            return await self._idle(_step_timeout(timeout), stop)
+
+    async def _idle(self, timeout: float, stop: asyncio.Event | None) -> bool:
+        async with self._lock:
+            fetch_stats.count("round_trips")
+            tag = self._next_tag()
+            await self._send(tag + b" IDLE\r\n")
+            while True:
+                line, _ = await self._timed(self._read_response())
+                if line.startswith(b"+"):
+                    break
+                if line.startswith(tag):
+                    raise ImapError(line.decode("utf-8", "replace"))
+            changed = await self._wait_untagged(timeout, stop)
+            await self._send(b"DONE\r\n")
+            while True:
+                line, _ = await self._timed(self._read_response())
+                if line.startswith(tag + b" "):
+                    self._check_tagged(line, tag)
+                    return changed
+                changed = changed or _is_change(line)
+
+    async def command(self, *args: bytes) -> list[Untagged]:
+        """Выполняет команду; возвращает нетегированные ответы. NO/BAD — ImapError."""
+        untagged, _ = await self._run(args)
+        return untagged
+
+    async def _command_text(self, *args: bytes) -> bytes:
+        _, tagged = await self._run(args)
+        return tagged
+
+    # --- внутреннее ---
+
+    async def _run(self, args: tuple[bytes, ...]) -> tuple[list[Untagged], bytes]:
+        async with self._lock:
+            if self._writer is None:
+                raise ImapAbort("соединение закрыто")
+            fetch_stats.count("round_trips")
+            tag = self._next_tag()
+            return await self._timed(self._exchange(tag, args))
+
+    async def _exchange(self, tag: bytes, args: tuple[bytes, ...]) -> tuple[list[Untagged], bytes]:
+        line = tag
+        for arg in args:
+            if isinstance(arg, _Literal):
+                if "LITERAL+" in self.capabilities:
+                    line += b" {%d+}\r\n" % len(arg) + arg
+                    continue
+                await self._send(line + b" {%d}\r\n" % len(arg))
+                reply, _ = await self._read_response()
+                if not reply.startswith(b"+"):
+                    self._check_tagged(reply, tag)
+                    raise ImapAbort(f"ожидалось продолжение литерала: {reply!r}")
+                line = arg
+            else:
+                line += b" " + arg
+        await self._send(line + b"\r\n")
+        untagged: list[Untagged] = []
+        while True:
+            text, literals = await self._read_response()
+            if text.startswith(tag + b" "):
+                self._check_tagged(text, tag)
+                return untagged, text
+            if text.upper().startswith(b"* BYE"):
+                self.close()
+                raise ImapAbort(text.decode("utf-8", "replace"))
+            untagged.append(Untagged(text, literals))
+
+    async def _timed(self, coro):
+        try:
+            return await asyncio.wait_for(coro, _step_timeout(COMMAND_TIMEOUT))
+        except asyncio.TimeoutError:
+            self.close()
+            raise ImapTimeout(f"{self.host}:{self.port}: {_timeout_message(COMMAND_TIMEOUT)}") from None
+
+    async def _wait_untagged(self, timeout: float, stop: asyncio.Event | None) -> bool:
+        """Ждёт строку от сервера в режиме IDLE. readline можно отменять: буфер не теряется."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        stop_task = asyncio.ensure_future(stop.wait()) if stop is not None else None
+        read_task = None
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0 or (stop is not None and stop.is_set()):
+                    return False
+                read_task = asyncio.ensure_future(self._readline())
+                waiters = {read_task} | ({stop_task} if stop_task else set())
+                done, _ = await asyncio.wait(waiters, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                if read_task not in done:
+                    read_task.cancel()
+                    await asyncio.gather(read_task, return_exceptions=True)
+                    if read_task.cancelled():
+                        return False
+                line = read_task.result().rstrip(b"\r\n")
+                if line.upper().startswith(b"* BYE"):
+                    self.close()
+                    raise ImapAbort(line.decode("utf-8", "replace"))
+                if _is_change(line):
+                    return True
+        finally:
+            # Отмена снаружи (например, запрос стал не нужен) не должна оставлять висящих задач
+            for task in (read_task, stop_task):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    async def _send(self, data: bytes) -> None:
+        if self._writer is None:
+            raise ImapAbort("соединение закрыто")
+        if self._deflate is not None:
+            # SYNC_FLUSH: сервер должен получить команду целиком, не дожидаясь следующих данных
+            wire = self._deflate.compress(data) + self._deflate.flush(zlib.Z_SYNC_FLUSH)
+            fetch_stats.count("bytes_saved", len(data) - len(wire))
+            data = wire
+        fetch_stats.count("bytes_uploaded", len(data))
+        try:
+            self._writer.write(data)
+            await self._writer.drain()
+        except OSError as e:
+            self.close()
+            raise ImapAbort(str(e)) from e
+
+    async def _readline(self) -> bytes:
+        if self._reader is None:
+            raise ImapAbort("соединение закрыто")
+        try:
+            line = await self._reader.readline()
+        except (OSError, ValueError) as e:
+            self.close()
+            raise ImapAbort(str(e)) from e
+        if not line:
+            self.close()
+            raise ImapAbort("сервер закрыл соединение")
+        if self._deflate is None:
+            fetch_stats.count("bytes_downloaded", len(line))  # со сжатием считает _DeflateReader
+        return line
+
+    async def _read_response(self) -> tuple[bytes, list[bytes]]:
+        """Одна логическая строка ответа: строки, склеенные через литералы {n}, и сами литералы."""
+        text = b""
+        literals: list[bytes] = []
+        while True:
+            line = await self._readline()
+            found = _LITERAL_RE.search(line)
+            if not found:
+                return text + line.rstrip(b"\r\n"), literals
+            text += line[:-2]
+            try:
+                literals.append(await self._reader.readexactly(int(found.group(1))))
+                if self._deflate is None:
+                    fetch_stats.count("bytes_downloaded", len(literals[-1]))
+            except (OSError, asyncio.IncompleteReadError) as e:
+                self.close()
+                raise ImapAbort("обрыв соединения посреди литерала") from e
+
+    def _next_tag(self) -> bytes:
+        self._tag += 1
+        return b"A%d" % self._tag
+
+    def _check_tagged(self, line: bytes, tag: bytes) -> None:
+        found = _TAGGED_RE.match(line)
+        if not found or found.group("tag") != tag:
+            self.close()
+            raise ImapAbort(f"неожиданный ответ: {line[:200]!r}")
+        if found.group("status").upper() != b"OK":
+            raise ImapError(found.group("text").decode("utf-8", "replace"))
+
+    def _update_capabilities(self, line: bytes) -> bool:
+        for code in _CODE_RE.finditer(line):
+            if code.group("name").upper() == b"CAPABILITY":
+                self.capabilities = frozenset((code.group("value") or b"").decode("ascii", "replace").upper().split())
+                return True
+        return False
+
+
+def _fetch_part(resp: Untagged) -> tuple[int, bytes] | None:
+    """
+    (uid, данные) из ответа «* n FETCH (UID … BODY[…] …)»; None — это не ответ FETCH с частью
+    письма. Непрошеное «* n FETCH (UID 42 FLAGS (\\Seen))» (письмо прочитал другой клиент)
+    тоже None: иначе оно заняло бы место данных письма 42, а настоящие потерялись бы.
+    """
+    if b" FETCH " not in resp.text[:40].upper() or not _SECTION_RE.search(resp.text):
+        return None
+    found = UID_PATTERN.search(resp.text.decode("ascii", "replace"))
+    if not found:
+        return None
+    if resp.literals:
+        return int(found.group("uid")), resp.literals[0]
+    # Пустая часть приходит как NIL или строка в кавычках, а не литералом
+    value = _QUOTED_OR_NIL_RE.search(resp.text)
+    quoted = value.group("quoted") if value else None
+    return int(found.group("uid")), re.sub(rb"\\(.)", rb"\1", quoted) if quoted else b""
+
+
+def _astring(value: str) -> bytes:
+    if value.isascii() and "\r" not in value and "\n" not in value:
+        return quote(value.encode("ascii"))
+    return _Literal(value.encode("utf-8"))
+
+
+def _is_change(line: bytes) -> bool:
+    parts = line.upper().split()
+    return len(parts) >= 3 and parts[0] == b"*" and parts[2] in (b"EXISTS", b"RECENT", b"FETCH")
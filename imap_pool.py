@@ -0,0 +1,408 @@
+"""
+Пул авторизованных IMAP-сессий, общий для всех запросов кодов.
+
+Соединения хранятся по ключу (host, port, user): TLS, LOGIN и SELECT выполняются
+один раз, дальше сессия переиспользуется. Фоновая задача шлёт NOOP простаивающим
+сессиям, чтобы сервер их не закрыл; оборванная сессия выбрасывается и при
+следующем запросе открывается заново.
+
+prewarm() открывает и авторизует сессии заранее (при старте приложения, после смены
+настроек), чтобы первый запрос не ждал подключения.
+
+Сбои связи с сервером учитывает автомат отключения (circuit_breaker): после нескольких
+подряд запросы к серверу на время сразу получают CircuitOpenError. Очередь за свободной
+сессией ограничена сроком запроса (imap_client.deadline).
+
+Пул асинхронный и привязан к своему циклу событий. Синхронный код (GUI) работает
+через фоновый цикл: run_sync() выполняет корутину в нём и ждёт результат,
+run_background() — запускает, не дожидаясь.
+"""
+import asyncio
+import concurrent.futures
+import contextvars
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Coroutine, Iterable, NamedTuple, TypeVar
+
+import fetch_stats
+from circuit_breaker import CircuitBreaker, get_default_breaker
+from imap_client import ImapClient, ImapError, ImapTimeout, time_left
+
+KEEPALIVE_INTERVAL = 60  # Как часто слать NOOP простаивающим сессиям (секунд)
+MAX_IDLE_SESSIONS = 8  # Сколько свободных сессий держать на один ключ (host, port, user)
+LOGOUT_TIMEOUT = 5  # Сколько ждать ответ на LOGOUT при закрытии сессии (секунд)
+
+# Ошибки, после которых сессию нельзя переиспользовать: соединение оборвано или сервер закрыл его
+CONNECTION_ERRORS = (OSError, EOFError)
+DEADLINE_SLACK = 0.05  # Отмена по сроку запроса приходит с точностью таймера цикла событий (секунд)
+
+T = TypeVar("T")
+
+
+class PoolKey(NamedTuple):
+    host: str
+    port: int
+    user: str
+
+
+class _Session:
+    __slots__ = ("client", "password", "last_used")
+
+    def __init__(self, client: ImapClient, password: str):
+        self.client = client
+        self.password = password
+        self.last_used = time.monotonic()
+
+
+class ImapSessionPool:
+    """
+    Пул IMAP-сессий для одного цикла событий.
+    Сессия выдаётся одной корутине за раз (через session() или run()) и после
+    успешной работы возвращается в пул. max_busy — сколько сессий одного ящика
+    могут работать одновременно (остальные запросы ждут очереди); None — без ограничения.
+    Для отдельного ящика ограничение можно задать своё: set_max_busy().
+    compress — включать сжатие COMPRESS=DEFLATE, если сервер его объявил.
+    breaker — автомат отключения серверов; по умолчанию общий (get_default_breaker).
+    """
+
+    def __init__(
+        self,
+        keepalive_interval: float = KEEPALIVE_INTERVAL,
+        max_idle: int = MAX_IDLE_SESSIONS,
+        client_factory: Callable[[str, int], ImapClient] = ImapClient,
+        max_busy: int | None = None,
+        compress: bool = True,
+        breaker: CircuitBreaker | None = None,
+    ):
+        self.keepalive_interval = keepalive_interval
+        self.max_idle = max_idle
+        self.client_factory = client_factory
+        self.max_busy = max_busy
+        self.compress = compress
+        self.breaker = breaker or get_default_breaker()
+        self._idle: dict[PoolKey, list[_Session]] = {}
+        self._busy_limits: dict[PoolKey, asyncio.Semaphore] = {}
+        self._max_busy_by_key: dict[PoolKey, int] = {}  # свои ограничения ящиков (set_max_busy)
+        self._keepalive_task: asyncio.Task | None = None
+        self._warming: dict[PoolKey, asyncio.Task] = {}  # идущие prewarm() по ключам
+        self._closed = False
+
+    async def _connect(self, key: PoolKey, password: str) -> _Session:
+        # Пока запрос стоял в очереди, сервер мог быть признан недоступным
+        self.breaker.check(key.host, key.port)
+        client = self.client_factory(key.host, key.port)
+        try:
+            await client.connect()
+            await client.login(key.user, password)
+            if self.compress:
+                await client.compress()
+        except BaseException as e:
+            client.close()
+            if _link_failed(e):
+                self.breaker.record_failure(key.host, key.port)
+            raise
+        self.breaker.record_success(key.host, key.port)
+        # Сервер принял этот пароль — свободные сессии с другим (старым) паролем больше не нужны
+        await self._drop_stale(key, password)
+        return _Session(client, password)
+
+    async def _drop_stale(self, key: PoolKey, password: str) -> None:
+        """
+        Закрывает свободные сессии с другим паролем (сменился в настройках). Вызывается только
+        после входа с новым паролем: запрос с неверным паролем рабочие сессии не закрывает.
+        """
+        sessions = self._idle.get(key, [])
+        stale = [s for s in sessions if s.password != password]
+        sessions[:] = [s for s in sessions if s.password == password]
+        for s in stale:
+            await _logout_quietly(s.client)
+
+    def _matching(self, key: PoolKey, password: str) -> list[int]:
+        """Индексы свободных сессий ящика, открытых с этим паролем."""
+        return [i for i, s in enumerate(self._idle.get(key, [])) if s.password == password]
+
+    async def _take(self, key: PoolKey, password: str, prefer_folder: str | None = None) -> _Session:
+        session = None
+        warming = self._warming.get(key)
+        if warming is not None and not self._matching(key, password):
+            # Сессии этого ящика уже подключаются в фоне — дождаться их быстрее, чем открывать ещё одну
+            await asyncio.wait({warming})
+        matching = self._matching(key, password)
+        if matching:
+            sessions = self._idle[key]
+            # Сессия, уже стоящая на нужной папке, экономит SELECT
+            index = next((i for i in reversed(matching) if sessions[i].client.folder == prefer_folder), matching[-1])
+            session = sessions.pop(index)
+            fetch_stats.hit("session")
+        if session is None:
+            session = await self._connect(key, password)
+        self._ensure_keepalive()
+        return session
+
+    async def _give_back(self, key: PoolKey, session: _Session) -> None:
+        session.last_used = time.monotonic()
+        sessions = self._idle.setdefault(key, [])
+        if len(sessions) < self.max_idle and not self._closed and not session.client.closed:
+            sessions.append(session)
+            return
+        await _logout_quietly(session.client)
+
+    @asynccontextmanager
+    async def session(
+        self, host: str, port: int, user: str, password: str, prefer_folder: str | None = None
+    ) -> AsyncIterator[ImapClient]:
+        """
+        Выдаёт авторизованную сессию. После выхода из блока сессия возвращается
+        в пул, если соединение осталось в исправном состоянии, иначе закрывается.
+        prefer_folder — папка, с которой будет работать вызывающий: если свободная
+        сессия уже выбрала её, выдаётся именно она.
+        """
+        key = PoolKey(host, port, user)
+        # Недоступный сервер — ошибка сразу, без очереди и таймаутов (пробу после паузы делает _connect)
+        self.breaker.check(host, port, probe=False)
+        limit = self._busy_limits.get(key)
+        max_busy = self._max_busy_by_key.get(key, self.max_busy)
+        if limit is None and max_busy is not None:
+            limit = self._busy_limits[key] = asyncio.Semaphore(max_busy)
+        if limit is not None:
+            with fetch_stats.phase("queue"):
+                try:
+                    await asyncio.wait_for(limit.acquire(), time_left())
+                except asyncio.TimeoutError:
+                    raise ImapTimeout(f"{host}:{port}: истёк срок запроса в очереди за сессией") from None
+        try:
+            session = await self._take(key, password, prefer_folder)
+            try:
+                yield session.client
+            except ImapError:
+                # Сервер ответил NO/BAD (нет папки и т.п.) — соединение исправно
+                self.breaker.record_success(host, port)
+                await self._give_back(key, session)
+                raise
+            except BaseException as e:
+                # Обрыв связи, отмена или ошибка посреди команды — такую сессию в пул не возвращаем
+                session.client.close()
+                if _link_failed(e):
+                    self.breaker.record_failure(host, port)
+                raise
+            else:
+                self.breaker.record_success(host, port)
+                await self._give_back(key, session)
+        finally:
+            if limit is not None:
+                limit.release()
+
+    def set_max_busy(self, host: str, port: int, user: str, max_busy: int | None) -> None:
+        """
+        Сколько сессий ящика (host, port, user) работают одновременно; None — как у пула (max_busy).
+        Уже занятые сессии доработают под прежним ограничением, новые запросы встают под новое.
+        """
+        key = PoolKey(host, port, user)
+        if self._max_busy_by_key.get(key) == max_busy:
+            return
+        if max_busy is None:
+            del self._max_busy_by_key[key]
+        else:
+            self._max_busy_by_key[key] = max_busy
+        self._busy_limits.pop(key, None)
+
+    async def run(
+        self,
+        host: str,
+        port: int,
+        user: str,
+        password: str,
+        fn: Callable[[ImapClient], Awaitable[T]],
+        prefer_folder: str | None = None,
+    ) -> T:
+        """
+        Выполняет await fn(client) на сессии из пула.
+        Если сервер оборвал простаивавшее соединение, один раз повторяет на новом
+        (но не после таймаута: сервер, не ответивший вовремя, второй раз ждать не стоит).
+        """
+        connected = False
+        try:
+            async with self.session(host, port, user, password, prefer_folder) as client:
+                connected = True
+                return await fn(client)
+        except ImapTimeout:
+            raise
+        except CONNECTION_ERRORS:
+            if not connected:
+                raise  # не удалось даже подключиться — повтор ничего не даст
+
+        async with self.session(host, port, user, password, prefer_folder) as client:
+            return await fn(client)
+
+    async def prewarm(
+        self, host: str, port: int, user: str, password: str, folders: Iterable[str] = ()
+    ) -> int:
+        """
+        Заранее открывает и авторизует сессии: по одной на каждую папку из folders
+        (с уже выполненным SELECT), а без папок — одну, если свободных нет. Папки,
+        на которых уже стоит свободная сессия, пропускаются. Запросы, пришедшие во
+        время подключения, дожидаются его, а не открывают свои соединения.
+        Ошибки не пробрасываются: первый запрос подключится сам и покажет ошибку.
+        Возвращает число открытых сессий.
+        """
+        key = PoolKey(host, port, user)
+        while key in self._warming:
+            await asyncio.wait({self._warming[key]})
+        folders = list(dict.fromkeys(folders))[: self.max_idle]
+        # Чистый контекст: подключение в фоне не должно попадать в замеры вызвавшего запроса
+        task = asyncio.get_running_loop().create_task(
+            self._prewarm(key, password, folders), context=contextvars.Context()
+        )
+        self._warming[key] = task
+        task.add_done_callback(lambda t: self._warming.pop(key) if self._warming.get(key) is t else None)
+        return await asyncio.shield(task)
+
+    async def _prewarm(self, key: PoolKey, password: str, folders: list[str]) -> int:
+        sessions = [self._idle[key][i] for i in self._matching(key, password)]
+        ready = {s.client.folder for s in sessions}
+        targets: list[str | None] = [f for f in folders if f not in ready]
+        if not folders and not sessions:
+            targets = [None]
+        results = await asyncio.gather(*(self._warm_one(key, password, f) for f in targets), return_exceptions=True)
+        self._ensure_keepalive()
+        return sum(1 for r in results if r is None)
+
+    async def _warm_one(self, key: PoolKey, password: str, folder: str | None) -> None:
+        session = await self._connect(key, password)
+        try:
+            if folder is not None:
+                await session.client.select(folder)
+        except ImapError:
+            pass  # папки нет — авторизованная сессия всё равно пригодится
+        except BaseException:
+            session.client.close()
+            raise
+        await self._give_back(key, session)
+
+    async def discard(self, host: str, port: int, user: str) -> None:
+        """Закрывает все свободные сессии для ключа (например, после смены настроек)."""
+        for s in self._idle.pop(PoolKey(host, port, user), []):
+            await _logout_quietly(s.client)
+
+    async def close(self) -> None:
+        """Закрывает все свободные сессии и останавливает keepalive."""
+        self._closed = True
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+        warming = list(self._warming.values())
+        for task in warming:
+            task.cancel()
+        await asyncio.gather(*warming, return_exceptions=True)
+        all_sessions = [s for sessions in self._idle.values() for s in sessions]
+        self._idle.clear()
+        await asyncio.gather(*(_logout_quietly(s.client) for s in all_sessions))
+
+    # --- keepalive ---
+
+    def _ensure_keepalive(self) -> None:
+        if self._keepalive_task is not None or self.keepalive_interval <= 0 or self._closed:
+            return
+        # Чистый контекст: NOOP фоновой задачи не должны попадать в замеры запроса, который её запустил
+        self._keepalive_task = asyncio.get_running_loop().create_task(
+            self._keepalive_loop(), context=contextvars.Context()
+        )
+
+    async def _keepalive_loop(self) -> None:
+        while not self._closed:
+            await asyncio.sleep(self.keepalive_interval)
+            await self.keepalive()
+
+    async def keepalive(self) -> None:
+        """Шлёт NOOP сессиям, простаивающим дольше keepalive_interval; мёртвые выбрасывает."""
+        now = time.monotonic()
+        due: list[tuple[PoolKey, _Session]] = []
+        for key, sessions in self._idle.items():
+            for s in list(sessions):
+                if now - s.last_used >= self.keepalive_interval:
+                    sessions.remove(s)
+                    due.append((key, s))
+
+        async def ping(key: PoolKey, s: _Session) -> None:
+            try:
+                await s.client.noop()
+            except Exception:
+                s.client.close()
+                return
+            await self._give_back(key, s)
+
+        await asyncio.gather(*(ping(key, s) for key, s in due))
+
+
+def _link_failed(error: BaseException) -> bool:
+    """
+    Сбой связи для автомата отключения: обрыв, отказ в подключении, нет ответа вовремя.
+    Запрос, не дождавшийся ответа к своему сроку, отменяет ждущий (single_flight) — такая
+    отмена посреди подключения или команды тоже значит, что сервер не ответил вовремя.
+    """
+    if isinstance(error, CONNECTION_ERRORS):
+        return True
+    left = time_left()
+    return isinstance(error, asyncio.CancelledError) and left is not None and left <= DEADLINE_SLACK
+
+
+async def _logout_quietly(client: ImapClient) -> None:
+    try:
+        await asyncio.wait_for(client.logout(), LOGOUT_TIMEOUT)
+    except Exception:
+        client.close()
+
+
+# --- фоновый цикл событий для синхронных вызовов ---
+
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_thread: threading.Thread | None = None
+_loop_lock = threading.Lock()
+
+
+def get_background_loop() -> asyncio.AbstractEventLoop:
+    """Цикл событий в фоновом потоке-демоне; запускается при первом обращении."""
+    global _loop, _loop_thread
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                _loop_thread = threading.Thread(target=loop.run_forever, name="imap-loop", daemon=True)
+                _loop_thread.start()
+                _loop = loop
+    return _loop
+
+
+def run_sync(coro: Coroutine[object, object, T]) -> T:
+    """Выполняет корутину в фоновом цикле и ждёт результат (для синхронного кода)."""
+    loop = get_background_loop()
+    if threading.current_thread() is _loop_thread:
+        coro.close()
+        raise RuntimeError("run_sync нельзя вызывать из фонового цикла IMAP")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+def run_background(coro: Coroutine[object, object, T]) -> "concurrent.futures.Future[T]":
+    """Запускает корутину в фоновом цикле, не дожидаясь результата."""
+    return asyncio.run_coroutine_threadsafe(coro, get_background_loop())
+
+
+_default_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, ImapSessionPool]" = weakref.WeakKeyDictionary()
+_default_pool_lock = threading.Lock()
+
+
+def get_default_pool() -> ImapSessionPool:
+    """
+    Общий пул для текущего цикла событий: им пользуются GUI и любые вызовы get_auth_code_*.
+    Вне цикла событий (синхронный код) — пул фонового цикла run_sync().
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = get_background_loop()
+    with _default_pool_lock:
+        pool = _default_pools.get(loop)
+        if pool is None:
+            pool = _default_pools[loop] = ImapSessionPool()
+    return pool
@@ -0,0 +1,1105 @@
+"""
+Локальный IMAP-сервер-заглушка для замеров и регрессионных проверок получения кодов.
+
+Работает в том же процессе (asyncio в фоновом потоке), хранит письма в памяти,
+поддерживает подмножество IMAP4rev1, которое использует email_code_fetcher:
+LOGIN, COMPRESS DEFLATE, SELECT/EXAMINE, STATUS, NOOP, IDLE, SEARCH/UID SEARCH,
+FETCH/UID FETCH, STORE/UID STORE, LOGOUT. Считает байты и команды, умеет имитировать сетевую задержку.
+
+Пример:
+    with StandinServer(users={"user@example.com": "secret"}) as server:
+        seed_folder(server, "uneco", 1000)
+        seed_folder(server, "uneco", 1, kind="otp")
+        get_auth_code_from_email(..., imap_host=server.host, imap_port=server.port,
+                                 pool=ImapSessionPool(client_factory=functools.partial(ImapClient, tls=False)))
+"""
+import asyncio
+import base64
+import bisect
+import email
+import email.header
+import email.message
+import email.utils
+import functools
+import itertools
+import random
+import re
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+
+DEFAULT_CAPABILITIES = ("IMAP4rev1", "IDLE", "LITERAL+", "UIDPLUS", "UNSELECT")
+# Как в SMS_BODY_MARKER email_code_fetcher (сервер не импортирует клиентский модуль)
+SMS_MARKER = "одноразовый код для подтверждения номера телефона на Платформе"
+
+_LITERAL_RE = re.compile(rb"\{(\d+)(\+?)\}\r\n$")
+_MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+
+def _decode_header(value: str | None) -> str:
+    if not value:
+        return ""
+    parts = []
+    for chunk, charset in email.header.decode_header(value):
+        if isinstance(chunk, bytes):
+            parts.append(chunk.decode(charset or "utf-8", "replace"))
+        else:
+            parts.append(chunk)
+    return "".join(parts)
+
+
+def _imap_date(value: str) -> datetime:
+    day, month, year = value.split("-")
+    return datetime(int(year), _MONTHS.index(month.capitalize()) + 1, int(day))
+
+
+def _internaldate(dt: datetime) -> str:
+    return f"{dt.day:02d}-{_MONTHS[dt.month - 1]}-{dt.year} {dt:%H:%M:%S} {dt:%z}"
+
+
+class StoredMessage:
+    """Письмо в памяти сервера. Поля для SEARCH вычисляются лениво и кэшируются."""
+
+    def __init__(self, uid: int, raw: bytes, flags: set[str], internaldate: datetime):
+        self.uid = uid
+        self.raw = raw
+        self.flags = flags
+        self.internaldate = internaldate
+        sep = raw.find(b"\r\n\r\n")
+        self.header = raw[: sep + 4] if sep >= 0 else raw
+        self.text = raw[sep + 4:] if sep >= 0 else b""
+        self._parsed = None
+        self._headers = None
+        self._header_values: dict[str, str] = {}
+        self._body_lower = None
+
+    @property
+    def parsed(self) -> email.message.Message:
+        if self._parsed is None:
+            self._parsed = email.message_from_bytes(self.raw)
+        return self._parsed
+
+    @property
+    def headers(self) -> email.message.Message:
+        if self._headers is None:
+            self._headers = email.message_from_bytes(self.header)
+        return self._headers
+
+    def header_value(self, name: str) -> str:
+        key = name.lower()
+        value = self._header_values.get(key)
+        if value is None:
+            value = self._header_values[key] = _decode_header(self.headers.get(name)).lower()
+        return value
+
+    def prefill(self, subject: str, sender: str, to: str, body: str) -> None:
+        """Поля для SEARCH, известные генератору письма заранее: разбирать MIME не нужно."""
+        self._header_values.update(subject=subject.lower(), **{"from": sender.lower(), "to": to.lower()})
+        self._body_lower = body.lower()
+
+    def index(self) -> None:
+        """Заранее разбирает то, что нужно SEARCH (как индекс настоящего сервера)."""
+        for name in ("Subject", "From", "To"):
+            self.header_value(name)
+        self.body_lower
+
+    @property
+    def body_lower(self) -> str:
+        if self._body_lower is None:
+            texts = []
+            for part in self.parsed.walk():
+                if part.is_multipart() or part.get_content_maintype() != "text":
+                    continue
+                if part.get_filename():
+                    continue
+                payload = part.get_payload(decode=True) or b""
+                texts.append(payload.decode(part.get_content_charset() or "utf-8", "replace"))
+            self._body_lower = "\n".join(texts).lower()
+        return self._body_lower
+
+
+class Folder:
+    def __init__(self, name: str, uidvalidity: int):
+        self.name = name
+        self.uidvalidity = uidvalidity
+        self.uidnext = 1
+        self.highestmodseq = 1  # CONDSTORE: растёт при каждом новом письме и смене флагов
+        self.messages: list[StoredMessage] = []
+        self.uids: list[int] = []  # UID писем по порядку (для двоичного поиска)
+
+    def add(self, msg: StoredMessage) -> None:
+        self.messages.append(msg)
+        self.uids.append(msg.uid)
+        self.highestmodseq += 1
+
+    def by_uid_range(self, lo: int, hi: int) -> range:
+        """Индексы писем с lo <= UID <= hi."""
+        return range(bisect.bisect_left(self.uids, lo), bisect.bisect_right(self.uids, hi))
+
+    def unseen(self) -> int:
+        return sum(1 for m in self.messages if "\\Seen" not in m.flags)
+
+
+class _Stats:
+    def __init__(self):
+        self.connections = 0
+        self.commands = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.by_command: dict[str, int] = {}
+
+    def snapshot(self) -> dict:
+        return {
+            "connections": self.connections,
+            "commands": self.commands,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "by_command": dict(self.by_command),
+        }
+
+
+class _ProtocolError(Exception):
+    pass
+
+
+class _Session:
+    """Одно клиентское соединение."""
+
+    def __init__(self, server: "StandinServer", reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.buf = bytearray()
+        self.folder: Folder | None = None
+        self.readonly = False
+        self.user: str | None = None
+        self.known_exists = 0
+        self.notify = asyncio.Event()
+        self._out: asyncio.Queue = asyncio.Queue()
+        self._writer_task: asyncio.Task | None = None
+        self._inflate = None  # после COMPRESS DEFLATE: распаковка входящего
+        self._deflate = None  # и сжатие исходящего (RFC 4978)
+
+    # --- ввод/вывод ---
+
+    async def _fill(self) -> bool:
+        data = await self.reader.read(65536)
+        if not data:
+            return False
+        self.server.stats.bytes_in += len(data)
+        self.buf += self._inflate.decompress(data) if self._inflate else data
+        return True
+
+    async def _readline(self) -> bytes | None:
+        while True:
+            idx = self.buf.find(b"\r\n")
+            if idx >= 0:
+                line = bytes(self.buf[: idx + 2])
+                del self.buf[: idx + 2]
+                return line
+            if not await self._fill():
+                return None
+
+    async def _readexactly(self, n: int) -> bytes | None:
+        while len(self.buf) < n:
+            if not await self._fill():
+                return None
+        data = bytes(self.buf[:n])
+        del self.buf[:n]
+        return data
+
+    def send(self, data: bytes) -> None:
+        """Ставит ответ в очередь; доставка — через server.latency после приёма команды."""
+        if self._deflate is not None:
+            data = self._deflate.compress(data) + self._deflate.flush(zlib.Z_SYNC_FLUSH)
+        self._out.put_nowait((time.monotonic() + self.server.latency, data))
+
+    async def _write_loop(self) -> None:
+        while True:
+            deliver_at, data = await self._out.get()
+            if data is None:
+                return
+            delay = deliver_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.server.stats.bytes_out += len(data)
+            self.writer.write(data)
+            await self.writer.drain()
+
+    async def _flush(self) -> None:
+        self._out.put_nowait((0, None))
+        if self._writer_task:
+            await self._writer_task
+
+    async def read_command(self) -> list | None:
+        chunks: list = []
+        while True:
+            line = await self._readline()
+            if line is None:
+                return None
+            m = _LITERAL_RE.search(line)
+            if not m:
+                chunks.append(line[:-2])
+                break
+            chunks.append(line[: m.start()])
+            if not m.group(2):
+                self.send(b"+ Ready for literal\r\n")
+            literal = await self._readexactly(int(m.group(1)))
+            if literal is None:
+                return None
+            chunks.append(_Literal(literal))
+        return chunks
+
+    # --- основной цикл ---
+
+    async def run(self) -> None:
+        self.server.stats.connections += 1
+        self.server.sessions.add(self)
+        self._writer_task = asyncio.create_task(self._write_loop())
+        caps = " ".join(self.server.capabilities)
+        self.send(f"* OK [CAPABILITY {caps}] IMAP stand-in ready\r\n".encode())
+        try:
+            while True:
+                chunks = await self.read_command()
+                if chunks is None:
+                    break
+                try:
+                    tokens = _tokenize(chunks)
+                except _ProtocolError as e:
+                    self.send(f"* BAD {e}\r\n".encode())
+                    continue
+                if len(tokens) < 2:
+                    self.send(b"* BAD Empty command\r\n")
+                    continue
+                tag, command, args = tokens[0], tokens[1].upper(), tokens[2:]
+                self.server.stats.commands += 1
+                if command == "UID" and args:
+                    name = f"UID {args[0].upper()}"
+                else:
+                    name = command
+                self.server.stats.by_command[name] = self.server.stats.by_command.get(name, 0) + 1
+                if self.server.drop_next:
+                    self.server.drop_next -= 1
+                    break
+                try:
+                    done = await self.dispatch(tag, command, args)
+                except _ProtocolError as e:
+                    self.send(f"{tag} BAD {e}\r\n".encode())
+                    continue
+                except Exception as e:  # noqa: BLE001 — сервер-заглушка не должен падать
+                    self.send(f"{tag} NO Internal error: {type(e).__name__}: {e}\r\n".encode())
+                    continue
+                if done:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.server.sessions.discard(self)
+            try:
+                await self._flush()
+                self.writer.close()
+            except Exception:
+                pass
+
+    async def dispatch(self, tag: str, command: str, args: list) -> bool:
+        handler = getattr(self, f"cmd_{command.lower()}", None)
+        if handler is None:
+            self.send(f"{tag} BAD Unknown command {command}\r\n".encode())
+            return False
+        return bool(await handler(tag, args))
+
+    def _require_selected(self) -> Folder:
+        if self.folder is None:
+            raise _ProtocolError("No mailbox selected")
+        return self.folder
+
+    # --- команды ---
+
+    async def cmd_capability(self, tag, args):
+        self.send(f"* CAPABILITY {' '.join(self.server.capabilities)}\r\n{tag} OK CAPABILITY completed\r\n".encode())
+
+    async def cmd_noop(self, tag, args):
+        self._report_exists()
+        self.send(f"{tag} OK NOOP completed\r\n".encode())
+
+    async def cmd_login(self, tag, args):
+        if len(args) != 2:
+            raise _ProtocolError("LOGIN expects user and password")
+        user, password = args
+        users = self.server.users
+        if users and users.get(user) != password:
+            self.send(f"{tag} NO [AUTHENTICATIONFAILED] Invalid credentials\r\n".encode())
+            return
+        self.user = user
+        self.send(f"{tag} OK [CAPABILITY {' '.join(self.server.capabilities)}] LOGIN completed\r\n".encode())
+
+    async def cmd_compress(self, tag, args):
+        if "COMPRESS=DEFLATE" not in self.server.capabilities:
+            self.send(f"{tag} BAD Unknown command COMPRESS\r\n".encode())
+            return
+        if len(args) != 1 or str(args[0]).upper() != "DEFLATE":
+            raise _ProtocolError("COMPRESS expects DEFLATE")
+        if self._deflate is not None:
+            self.send(f"{tag} NO [COMPRESSIONACTIVE] DEFLATE active\r\n".encode())
+            return
+        self.send(f"{tag} OK DEFLATE active\r\n".encode())  # сам ответ ещё не сжат
+        self._deflate = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self._inflate = zlib.decompressobj(-zlib.MAX_WBITS)
+        # Всё, что клиент прислал после команды, уже сжато
+        pending = bytes(self.buf)
+        self.buf.clear()
+        if pending:
+            self.buf += self._inflate.decompress(pending)
+
+    async def cmd_logout(self, tag, args):
+        self.send(f"* BYE Logging out\r\n{tag} OK LOGOUT completed\r\n".encode())
+        return True
+
+    async def cmd_select(self, tag, args, readonly=False):
+        if not args:
+            raise _ProtocolError("SELECT expects folder")
+        folder = self.server.folders.get(_folder_name(args[0]))
+        if folder is None:
+            self.folder = None
+            self.send(f"{tag} NO Mailbox does not exist\r\n".encode())
+            return
+        self.folder = folder
+        self.readonly = readonly
+        self.known_exists = len(folder.messages)
+        self.notify.clear()
+        first_unseen = next(
+            (i + 1 for i, m in enumerate(folder.messages) if "\\Seen" not in m.flags), None
+        )
+        lines = [
+            "* FLAGS (\\Answered \\Flagged \\Deleted \\Seen \\Draft)",
+            f"* {len(folder.messages)} EXISTS",
+            "* 0 RECENT",
+            f"* OK [UIDVALIDITY {folder.uidvalidity}] UIDs valid",
+            f"* OK [UIDNEXT {folder.uidnext}] Predicted next UID",
+        ]
+        if first_unseen:
+            lines.append(f"* OK [UNSEEN {first_unseen}] First unseen")
+        mode = "READ-ONLY" if readonly else "READ-WRITE"
+        lines.append(f"{tag} OK [{mode}] {'EXAMINE' if readonly else 'SELECT'} completed")
+        self.send(("\r\n".join(lines) + "\r\n").encode())
+
+    async def cmd_examine(self, tag, args):
+        return await self.cmd_select(tag, args, readonly=True)
+
+    async def cmd_unselect(self, tag, args):
+        self.folder = None
+        self.send(f"{tag} OK UNSELECT completed\r\n".encode())
+
+    async def cmd_close(self, tag, args):
+        return await self.cmd_unselect(tag, args)
+
+    async def cmd_list(self, tag, args):
+        lines = [f'* LIST () "/" "{name}"' for name in self.server.folders]
+        lines.append(f"{tag} OK LIST completed")
+        self.send(("\r\n".join(lines) + "\r\n").encode())
+
+    async def cmd_status(self, tag, args):
+        if len(args) != 2 or not isinstance(args[1], list):
+            raise _ProtocolError("STATUS expects folder and item list")
+        name = _folder_name(args[0])
+        folder = self.server.folders.get(name)
+        if folder is None:
+            self.send(f"{tag} NO Mailbox does not exist\r\n".encode())
+            return
+        values = {
+            "MESSAGES": len(folder.messages),
+            "RECENT": 0,
+            "UIDNEXT": folder.uidnext,
+            "UIDVALIDITY": folder.uidvalidity,
+            "UNSEEN": folder.unseen(),
+        }
+        if "CONDSTORE" in self.server.capabilities:
+            values["HIGHESTMODSEQ"] = folder.highestmodseq
+        items = " ".join(f"{item.upper()} {values[item.upper()]}" for item in args[1] if item.upper() in values)
+        self.send(f'* STATUS "{name}" ({items})\r\n{tag} OK STATUS completed\r\n'.encode())
+
+    async def cmd_idle(self, tag, args):
+        folder = self._require_selected()
+        self.send(b"+ idling\r\n")
+        done_task = asyncio.create_task(self._readline())
+        try:
+            while True:
+                notify_task = asyncio.create_task(self.notify.wait())
+                finished, _ = await asyncio.wait({done_task, notify_task}, return_when=asyncio.FIRST_COMPLETED)
+                if notify_task in finished:
+                    self.notify.clear()
+                    self._report_exists()
+                else:
+                    notify_task.cancel()
+                if done_task in finished:
+                    line = done_task.result()
+                    if line is None:
+                        return True
+                    if line.strip().upper() != b"DONE":
+                        self.send(f"{tag} BAD Expected DONE\r\n".encode())
+                        return
+                    self.send(f"{tag} OK IDLE terminated\r\n".encode())
+                    return
+        finally:
+            if not done_task.done():
+                done_task.cancel()
+            del folder
+
+    def _report_exists(self) -> None:
+        if self.folder is not None and len(self.folder.messages) != self.known_exists:
+            self.known_exists = len(self.folder.messages)
+            self.send(f"* {self.known_exists} EXISTS\r\n".encode())
+
+    async def cmd_uid(self, tag, args):
+        if not args:
+            raise _ProtocolError("UID expects subcommand")
+        sub = args[0].upper()
+        if sub == "SEARCH":
+            return await self.cmd_search(tag, args[1:], by_uid=True)
+        if sub == "FETCH":
+            return await self.cmd_fetch(tag, args[1:], by_uid=True)
+        if sub == "STORE":
+            return await self.cmd_store(tag, args[1:], by_uid=True)
+        raise _ProtocolError(f"Unsupported UID {sub}")
+
+    async def cmd_search(self, tag, args, by_uid=False):
+        folder = self._require_selected()
+        if args and args[0].upper() == "CHARSET":
+            args = args[2:]
+        matcher = _parse_criteria(list(args), folder)
+        result = []
+        for index in _uid_prefilter(list(args), folder):
+            seq, msg = index + 1, folder.messages[index]
+            if matcher(seq, msg):
+                result.append(msg.uid if by_uid else seq)
+        body = " ".join(map(str, result))
+        self.send(f"* SEARCH{' ' + body if body else ''}\r\n{tag} OK SEARCH completed\r\n".encode())
+
+    def _select_messages(self, folder: Folder, seqset: str, by_uid: bool) -> list[tuple[int, StoredMessage]]:
+        if not folder.messages:
+            return []
+        if by_uid:
+            indexes = set()
+            for lo, hi in _parse_seqset(seqset, folder.uids[-1]):
+                indexes.update(folder.by_uid_range(lo, hi))
+        else:
+            indexes = set()
+            for lo, hi in _parse_seqset(seqset, len(folder.messages)):
+                indexes.update(range(max(lo, 1) - 1, min(hi, len(folder.messages))))
+        return [(i + 1, folder.messages[i]) for i in sorted(indexes)]
+
+    async def cmd_fetch(self, tag, args, by_uid=False):
+        folder = self._require_selected()
+        if len(args) < 2:
+            raise _ProtocolError("FETCH expects sequence set and items")
+        items = args[1] if isinstance(args[1], list) else [args[1]]
+        expanded = []
+        for item in items:
+            upper = item.upper() if isinstance(item, str) else item
+            if upper == "ALL":
+                expanded += ["FLAGS", "INTERNALDATE", "RFC822.SIZE"]
+            elif upper == "FAST":
+                expanded += ["FLAGS", "INTERNALDATE", "RFC822.SIZE"]
+            else:
+                expanded.append(item)
+        if by_uid and not any(isinstance(i, str) and i.upper() == "UID" for i in expanded):
+            expanded.insert(0, "UID")
+        out = bytearray()
+        for seq, msg in self._select_messages(folder, args[0], by_uid):
+            parts = []
+            for item in expanded:
+                parts.append(self._fetch_item(msg, item))
+            out += f"* {seq} FETCH (".encode() + b" ".join(parts) + b")\r\n"
+        out += f"{tag} OK FETCH completed\r\n".encode()
+        self.send(bytes(out))
+
+    def _fetch_item(self, msg: StoredMessage, item: str) -> bytes:
+        upper = item.upper()
+        if upper == "UID":
+            return f"UID {msg.uid}".encode()
+        if upper == "FLAGS":
+            return f"FLAGS ({' '.join(sorted(msg.flags))})".encode()
+        if upper == "RFC822.SIZE":
+            return f"RFC822.SIZE {len(msg.raw)}".encode()
+        if upper == "INTERNALDATE":
+            return f'INTERNALDATE "{_internaldate(msg.internaldate)}"'.encode()
+        if upper == "RFC822":
+            self._mark_seen(msg)
+            return _literal(b"RFC822", msg.raw)
+        if upper == "RFC822.HEADER":
+            return _literal(b"RFC822.HEADER", msg.header)
+        if upper in ("BODYSTRUCTURE", "BODY"):
+            return upper.encode() + b" " + _bodystructure(msg.parsed)
+        m = re.fullmatch(r"(BODY(?:\.PEEK)?)\[([^\]]*)\](?:<(\d+)\.(\d+)>)?", item, re.IGNORECASE)
+        if not m:
+            raise _ProtocolError(f"Unsupported FETCH item {item}")
+        peek = m.group(1).upper() == "BODY.PEEK"
+        section = m.group(2)
+        data = _section(msg, section)
+        name = f"BODY[{section}]"
+        if m.group(3) is not None:
+            origin, length = int(m.group(3)), int(m.group(4))
+            data = data[origin: origin + length]
+            name += f"<{origin}>"
+        if not peek:
+            self._mark_seen(msg)
+        return _literal(name.encode(), data)
+
+    def _mark_seen(self, msg: StoredMessage) -> None:
+        if not self.readonly and "\\Seen" not in msg.flags:
+            msg.flags.add("\\Seen")
+            self.folder.highestmodseq += 1
+
+    async def cmd_store(self, tag, args, by_uid=False):
+        folder = self._require_selected()
+        if len(args) < 3:
+            raise _ProtocolError("STORE expects sequence set, item and flags")
+        item = args[1].upper()
+        flags = args[2] if isinstance(args[2], list) else [args[2]]
+        out = bytearray()
+        for seq, msg in self._select_messages(folder, args[0], by_uid):
+            before = set(msg.flags)
+            if item.startswith("+"):
+                msg.flags.update(flags)
+            elif item.startswith("-"):
+                msg.flags.difference_update(flags)
+            else:
+                msg.flags = set(flags)
+            if msg.flags != before:
+                folder.highestmodseq += 1
+            if not item.endswith(".SILENT"):
+                out += f"* {seq} FETCH (UID {msg.uid} FLAGS ({' '.join(sorted(msg.flags))}))\r\n".encode()
+        out += f"{tag} OK STORE completed\r\n".encode()
+        self.send(bytes(out))
+
+
+class _Literal(bytes):
+    pass
+
+
+def _literal(name: bytes, data: bytes) -> bytes:
+    return name + b" {" + str(len(data)).encode() + b"}\r\n" + data
+
+
+def _folder_name(value: str) -> str:
+    return value if value.upper() != "INBOX" else "INBOX"
+
+
+def _tokenize(chunks: list) -> list:
+    """Разбирает команду на атомы, строки и вложенные списки."""
+    stack: list[list] = [[]]
+    for chunk in chunks:
+        if isinstance(chunk, _Literal):
+            stack[-1].append(bytes(chunk).decode("utf-8", "surrogateescape"))
+            continue
+        text = chunk.decode("utf-8", "surrogateescape")
+        i, n = 0, len(text)
+        while i < n:
+            ch = text[i]
+            if ch == " ":
+                i += 1
+            elif ch == "(":
+                stack.append([])
+                i += 1
+            elif ch == ")":
+                if len(stack) == 1:
+                    raise _ProtocolError("Unbalanced parenthesis")
+                inner = stack.pop()
+                stack[-1].append(inner)
+                i += 1
+            elif ch == '"':
+                i += 1
+                out = []
+                while i < n and text[i] != '"':
+                    if text[i] == "\\" and i + 1 < n:
+                        i += 1
+                    out.append(text[i])
+                    i += 1
+                if i >= n:
+                    raise _ProtocolError("Unterminated string")
+                i += 1
+                stack[-1].append("".join(out))
+            else:
+                start = i
+                depth = 0
+                while i < n:
+                    c = text[i]
+                    if c == "[":
+                        depth += 1
+                    elif c == "]":
+                        depth -= 1
+                    elif depth == 0 and c in " ()":
+                        break
+                    i += 1
+                stack[-1].append(text[start:i])
+    if len(stack) != 1:
+        raise _ProtocolError("Unbalanced parenthesis")
+    return stack[0]
+
+
+def _parse_seqset(value: str, maximum: int) -> list[tuple[int, int]]:
+    ranges = []
+    for part in str(value).split(","):
+        if ":" in part:
+            a, b = part.split(":", 1)
+            lo = maximum if a == "*" else int(a)
+            hi = maximum if b == "*" else int(b)
+            lo, hi = min(lo, hi), max(lo, hi)
+        else:
+            lo = hi = maximum if part == "*" else int(part)
+        ranges.append((lo, hi))
+    return ranges
+
+
+def _uid_prefilter(tokens: list, folder: Folder) -> range | list[int]:
+    """
+    Индексы писем, которые вообще стоит проверять: если среди критериев верхнего уровня
+    есть «UID n:m» (без OR/NOT рядом), смотрим только этот диапазон, как сервер с индексом по UID.
+    """
+    while len(tokens) == 1 and isinstance(tokens[0], list):
+        tokens = tokens[0]
+    words = [t.upper() for t in tokens if isinstance(t, str)]
+    if "UID" in words and "OR" not in words and "NOT" not in words and folder.uids:
+        value = tokens[[t.upper() if isinstance(t, str) else t for t in tokens].index("UID") + 1]
+        ranges = _parse_seqset(value, folder.uids[-1])
+        return sorted({i for lo, hi in ranges for i in folder.by_uid_range(lo, hi)})
+    return range(len(folder.messages))
+
+
+def _parse_criteria(tokens: list, folder: Folder):
+    """Строит предикат (seq, msg) -> bool из критериев SEARCH."""
+    matchers = []
+    while tokens:
+        matchers.append(_parse_key(tokens, folder))
+    return lambda seq, msg: all(m(seq, msg) for m in matchers)
+
+
+def _parse_key(tokens: list, folder: Folder):
+    token = tokens.pop(0)
+    if isinstance(token, list):
+        return _parse_criteria(list(token), folder)
+    key = token.upper()
+    flag_keys = {
+        "SEEN": ("\\Seen", True), "UNSEEN": ("\\Seen", False),
+        "ANSWERED": ("\\Answered", True), "UNANSWERED": ("\\Answered", False),
+        "FLAGGED": ("\\Flagged", True), "UNFLAGGED": ("\\Flagged", False),
+        "DELETED": ("\\Deleted", True), "UNDELETED": ("\\Deleted", False),
+        "DRAFT": ("\\Draft", True), "UNDRAFT": ("\\Draft", False),
+    }
+    if key == "ALL":
+        return lambda seq, msg: True
+    if key in flag_keys:
+        flag, present = flag_keys[key]
+        return lambda seq, msg: (flag in msg.flags) == present
+    if key == "NOT":
+        inner = _parse_key(tokens, folder)
+        return lambda seq, msg: not inner(seq, msg)
+    if key == "OR":
+        a = _parse_key(tokens, folder)
+        b = _parse_key(tokens, folder)
+        return lambda seq, msg: a(seq, msg) or b(seq, msg)
+    if key in ("SUBJECT", "FROM", "TO", "CC", "BCC"):
+        needle = tokens.pop(0).lower()
+        header = key.capitalize()
+        return lambda seq, msg: needle in msg.header_value(header)
+    if key == "HEADER":
+        name = tokens.pop(0)
+        needle = tokens.pop(0).lower()
+        return lambda seq, msg: needle in msg.header_value(name)
+    if key == "BODY":
+        needle = tokens.pop(0).lower()
+        return lambda seq, msg: needle in msg.body_lower
+    if key == "TEXT":
+        needle = tokens.pop(0).lower()
+        return lambda seq, msg: needle in msg.body_lower or needle in msg.header.decode("utf-8", "replace").lower()
+    if key in ("SINCE", "BEFORE", "ON"):
+        day = _imap_date(tokens.pop(0)).date()
+        if key == "SINCE":
+            return lambda seq, msg: msg.internaldate.date() >= day
+        if key == "BEFORE":
+            return lambda seq, msg: msg.internaldate.date() < day
+        return lambda seq, msg: msg.internaldate.date() == day
+    if key in ("LARGER", "SMALLER"):
+        size = int(tokens.pop(0))
+        if key == "LARGER":
+            return lambda seq, msg: len(msg.raw) > size
+        return lambda seq, msg: len(msg.raw) < size
+    if key == "UID":
+        maximum = folder.messages[-1].uid if folder.messages else 0
+        ranges = _parse_seqset(tokens.pop(0), maximum)
+        return lambda seq, msg: any(lo <= msg.uid <= hi for lo, hi in ranges)
+    if re.fullmatch(r"[\d*:,]+", key):
+        ranges = _parse_seqset(key, len(folder.messages))
+        return lambda seq, msg: any(lo <= seq <= hi for lo, hi in ranges)
+    raise _ProtocolError(f"Unsupported search key {key}")
+
+
+def _section(msg: StoredMessage, section: str) -> bytes:
+    upper = section.upper()
+    if upper == "":
+        return msg.raw
+    if upper == "HEADER":
+        return msg.header
+    if upper == "TEXT":
+        return msg.text
+    m = re.fullmatch(r"HEADER\.FIELDS(\.NOT)?\s*\(([^)]*)\)", upper)
+    if m:
+        names = {n.strip().lower() for n in m.group(2).split()}
+        negate = bool(m.group(1))
+        lines = []
+        current: list[str] = []
+        for line in msg.header.decode("utf-8", "surrogateescape").split("\r\n"):
+            if line[:1] in (" ", "\t") and current:
+                current.append(line)
+                continue
+            if current:
+                lines.append(current)
+            current = [line] if line else []
+        if current:
+            lines.append(current)
+        picked = [
+            "\r\n".join(block) for block in lines
+            if ((block[0].split(":", 1)[0].strip().lower() in names) != negate)
+        ]
+        return ("".join(f"{p}\r\n" for p in picked) + "\r\n").encode("utf-8", "surrogateescape")
+    if re.fullmatch(r"\d+(\.\d+)*", upper):
+        part = msg.parsed
+        for index in upper.split("."):
+            i = int(index)
+            if part.is_multipart():
+                payload = part.get_payload()
+                if i < 1 or i > len(payload):
+                    return b""
+                part = payload[i - 1]
+            elif i != 1:
+                return b""
+        if part is msg.parsed and not part.is_multipart():
+            return msg.text
+        raw = part.as_bytes()
+        sep = raw.find(b"\n\n")
+        body = raw[sep + 2:] if sep >= 0 else b""
+        return body.replace(b"\r\n", b"\n").replace(b"\n", b"\r\n")
+    raise _ProtocolError(f"Unsupported section {section}")
+
+
+def _quote(value: str | None) -> str:
+    if value is None:
+        return "NIL"
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _bodystructure(part: email.message.Message) -> bytes:
+    if part.is_multipart():
+        children = "".join(_bodystructure(p).decode() for p in part.get_payload())
+        return f"({children} {_quote(part.get_content_subtype().upper())})".encode()
+    params = part.get_params() or []
+    plist = " ".join(f"{_quote(k.upper())} {_quote(v)}" for k, v in params[1:])
+    params_str = f"({plist})" if plist else "NIL"
+    payload = part.get_payload()
+    if isinstance(payload, list):
+        payload = ""
+    size = len(payload.encode("utf-8", "surrogateescape")) if isinstance(payload, str) else 0
+    encoding = (part.get("Content-Transfer-Encoding") or "7BIT").upper()
+    disposition = part.get_content_disposition()
+    filename = part.get_filename()
+    ext = ""
+    if disposition:
+        dparams = f'("FILENAME" {_quote(filename)})' if filename else "NIL"
+        ext = f" NIL ({_quote(disposition.upper())} {dparams})"
+    fields = (
+        f"{_quote(part.get_content_maintype().upper())} {_quote(part.get_content_subtype().upper())} "
+        f"{params_str} NIL NIL {_quote(encoding)} {size}"
+    )
+    if part.get_content_maintype() == "text":
+        fields += f" {payload.count(chr(10)) if isinstance(payload, str) else 0}"
+        if ext:
+            fields += " NIL" + ext
+    elif ext:
+        fields += " NIL" + ext
+    return f"({fields})".encode()
+
+
+class StandinServer:
+    """
+    IMAP-заглушка в памяти.
+
+    :param users: {логин: пароль}; если пусто — принимается любой логин
+    :param latency: имитируемая задержка доставки ответа (секунд)
+    :param capabilities: объявляемые возможности (без IDLE — для проверки запасного опроса;
+                         с CONDSTORE — STATUS сообщает HIGHESTMODSEQ;
+                         с COMPRESS=DEFLATE — принимает COMPRESS DEFLATE)
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        users: dict[str, str] | None = None,
+        latency: float = 0.0,
+        capabilities: tuple[str, ...] = DEFAULT_CAPABILITIES,
+    ):
+        self.host = host
+        self.port = port
+        self.users = dict(users or {})
+        self.latency = latency
+        self.capabilities = tuple(capabilities)
+        self.folders: dict[str, Folder] = {"INBOX": Folder("INBOX", 1)}
+        self.stats = _Stats()
+        self.sessions: set[_Session] = set()
+        self.drop_next = 0
+        self._uidvalidity = itertools.count(int(time.time()) % 100000)
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._server: asyncio.base_events.Server | None = None
+        self._thread: threading.Thread | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    # --- хранилище ---
+
+    def add_folder(self, name: str) -> Folder:
+        if name not in self.folders:
+            self.folders[name] = Folder(name, next(self._uidvalidity))
+        return self.folders[name]
+
+    def reset_uidvalidity(self, name: str) -> None:
+        """Меняет UIDVALIDITY папки (как при пересоздании ящика на сервере)."""
+        self._call(self._reset_uidvalidity, name)
+
+    def _reset_uidvalidity(self, name: str) -> None:
+        folder = self.add_folder(name)
+        folder.uidvalidity = next(self._uidvalidity) + 1000
+
+    def append(
+        self,
+        folder: str,
+        raw: bytes,
+        flags: tuple[str, ...] = (),
+        internaldate: datetime | None = None,
+    ) -> int:
+        """Кладёт письмо в папку (потокобезопасно) и будит сессии в IDLE. Возвращает UID."""
+        return self._call(self._append, folder, raw, flags, internaldate)
+
+    def _append(self, folder_name, raw, flags, internaldate) -> int:
+        folder = self.add_folder(folder_name)
+        uid = folder.uidnext
+        folder.uidnext += 1
+        folder.add(StoredMessage(uid, raw, set(flags), internaldate or datetime.now(timezone.utc).astimezone()))
+        for session in self.sessions:
+            if session.folder is folder:
+                session.notify.set()
+        return uid
+
+    def append_many(self, folder: str, messages: list[tuple]) -> None:
+        """
+        Кладёт пачку писем одним переходом в поток сервера. Элемент — (raw, flags, internaldate)
+        или (raw, flags, internaldate, (subject, from, to, body)) с заранее известными полями для SEARCH.
+        """
+        self._call(self._append_many, folder, messages)
+
+    def _append_many(self, folder, messages) -> None:
+        target = self.add_folder(folder)
+        for raw, flags, internaldate, *fields in messages:
+            self._append(folder, raw, flags, internaldate)
+            if fields:
+                target.messages[-1].prefill(*fields[0])
+
+    def build_index(self, folder: str | None = None) -> None:
+        """
+        Разбирает заголовки и тела писем заранее, чтобы SEARCH по большим папкам
+        не тратил время на разбор MIME (настоящие серверы держат индекс).
+        """
+        names = [folder] if folder else list(self.folders)
+        self._call(lambda: [m.index() for name in names for m in self.folders[name].messages])
+
+    def _call(self, fn, *args):
+        if self._loop is None or not self._loop.is_running():
+            return fn(*args)
+        if threading.current_thread() is self._thread:
+            return fn(*args)
+        future: "asyncio.Future" = asyncio.run_coroutine_threadsafe(self._async_call(fn, *args), self._loop)
+        return future.result()
+
+    @staticmethod
+    async def _async_call(fn, *args):
+        return fn(*args)
+
+    def drop_connections(self) -> None:
+        """Рвёт все клиентские соединения (как при перезапуске сервера или обрыве сети)."""
+        self._call(self._drop_connections)
+
+    def _drop_connections(self) -> None:
+        for session in list(self.sessions):
+            session.writer.transport.abort()
+
+    # --- запуск ---
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            for session in list(self.sessions):
+                session.writer.transport.abort()
+            if self._tasks:
+                await asyncio.wait(self._tasks, timeout=1)
+            for task in list(self._tasks):
+                task.cancel()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer) -> None:
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            await _Session(self, reader, writer).run()
+        finally:
+            self._tasks.discard(task)
+
+    def start_in_thread(self) -> "StandinServer":
+        """Запускает сервер в фоновом потоке со своим event loop."""
+        ready = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start())
+            ready.set()
+            loop.run_forever()
+            loop.run_until_complete(self.stop())
+            pending = asyncio.all_tasks(loop)
+            for task in pending:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            loop.close()
+
+        self._thread = threading.Thread(target=run, name="imap-standin", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop_thread(self) -> None:
+        if self._loop is not None and self._thread is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def __enter__(self) -> "StandinServer":
+        return self.start_in_thread()
+
+    def __exit__(self, *exc) -> None:
+        self.stop_thread()
+
+
+# --- генераторы писем ---
+
+_message_ids = itertools.count(1)
+
+
+@functools.lru_cache(maxsize=8)
+def _attachment_b64(size: int) -> bytes:
+    data = random.Random(size).randbytes(size)
+    return base64.encodebytes(data).replace(b"\n", b"\r\n")
+
+
+def _text_part(subtype: str, text: str) -> bytes:
+    body = base64.encodebytes(text.encode("utf-8")).replace(b"\n", b"\r\n")
+    return (
+        f"Content-Type: text/{subtype}; charset=\"utf-8\"\r\n"
+        "Content-Transfer-Encoding: base64\r\n\r\n"
+    ).encode() + body
+
+
+def make_message(
+    subject: str,
+    body: str,
+    to: str = "user@example.com",
+    sender: str = "noreply@platform.example",
+    date: datetime | None = None,
+    html: str | None = None,
+    attachment_size: int = 0,
+) -> bytes:
+    """
+    Собирает письмо RFC 5322: text/plain в base64, как шлёт большинство почтовых
+    систем для кириллицы; опционально HTML-версия (multipart/alternative) и вложение.
+    Письмо собирается вручную, без email.mime: при засеве 100k писем это в разы быстрее.
+    """
+    headers = (
+        f"Subject: {email.header.Header(subject, 'utf-8').encode()}\r\n"
+        f"From: {sender}\r\n"
+        f"To: {to}\r\n"
+        f"Date: {email.utils.format_datetime(date or datetime.now(timezone.utc))}\r\n"
+        f"Message-ID: <standin.{next(_message_ids)}@localhost>\r\n"
+        "MIME-Version: 1.0\r\n"
+    ).encode()
+    text_part = _text_part("plain", body)
+    if html is None and not attachment_size:
+        return headers + text_part
+    if html is not None:
+        content = (
+            b"Content-Type: multipart/alternative; boundary=\"alt\"\r\n\r\n"
+            b"--alt\r\n" + text_part + b"--alt\r\n" + _text_part("html", html) + b"--alt--\r\n"
+        )
+    else:
+        content = text_part
+    if not attachment_size:
+        return headers + content
+    attachment = (
+        b"Content-Type: application/octet-stream; name=\"report.bin\"\r\n"
+        b"Content-Transfer-Encoding: base64\r\n"
+        b"Content-Disposition: attachment; filename=\"report.bin\"\r\n\r\n" + _attachment_b64(attachment_size)
+    )
+    return (
+        headers + b"Content-Type: multipart/mixed; boundary=\"mix\"\r\n\r\n"
+        b"--mix\r\n" + content + b"--mix\r\n" + attachment + b"--mix--\r\n"
+    )
+
+
+def seed_folder(
+    server: StandinServer,
+    folder: str,
+    count: int,
+    *,
+    kind: str = "noise",
+    to: str = "user@example.com",
+    body_size: int = 512,
+    attachment_size: int = 0,
+    seen_ratio: float = 0.0,
+    start: datetime | None = None,
+    rng: random.Random | None = None,
+) -> None:
+    """
+    Наполняет папку count письмами заданного вида:
+    noise — рассылки без кода, otp — темы «1234 — ...», sms — тело с SMS_BODY_MARKER.
+    Письма идут с интервалом 30 секунд и заканчиваются «сейчас» (если не задан start).
+    """
+    rng = rng or random.Random(0)
+    start = start or datetime.now(timezone.utc) - timedelta(seconds=30 * count)
+    filler = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * (body_size // 56 + 1))[:body_size]
+    batch: list[tuple] = []
+    sender = "noreply@platform.example"
+    for i in range(count):
+        date = start + timedelta(seconds=30 * (i + 1))
+        code = f"{rng.randrange(10000):04d}"
+        html = None
+        if kind == "otp":
+            subject, body = f"{code} — код подтверждения на Платформе", f"Ваш код: {code}\n{filler}"
+            raw = make_message(subject, body, to=to, sender=sender, date=date)
+        elif kind == "sms":
+            subject, body = "+79990001122", f"{code} — {SMS_MARKER}\n{filler}"
+            raw = make_message(subject, body, to=to, sender=sender, date=date)
+        else:
+            subject, body, html = f"Новости недели №{i}", f"Выпуск {i}. {filler}", f"<p>Выпуск {i}</p><p>{filler}</p>"
+            raw = make_message(
+                subject, body, to=to, sender="news@example.org", date=date, html=html, attachment_size=attachment_size
+            )
+        flags = ("\\Seen",) if rng.random() < seen_ratio else ()
+        text = body + "\n" + html if html else body
+        batch.append((raw, flags, date, (subject, "news@example.org" if html else sender, to, text)))
+        if len(batch) >= 1000:
+            server.append_many(folder, batch)
+            batch = []
+    if batch:
+        server.append_many(folder, batch)
@@ -0,0 +1,293 @@
+"""
+Проверка выгрузок почты без IMAP: mbox, Maildir и папки с .eml. Каждое письмо проверяется
+так же, как при поиске кода по IMAP (email_code_fetcher.match_message): условия SEARCH,
+формат темы, правила извлечения кода. Нужна для аудита и подбора CODE_REGEX,
+SUBJECT_CODE_FORMAT и SMS_BODY_MARKER на сотнях тысяч настоящих писем.
+
+Архив делится на задания — куски mbox по MBOX_SHARD_BYTES или группы по FILES_PER_TASK
+файлов — и разбирается пулом процессов: каждый процесс сам читает свой кусок, в главный
+возвращаются только результаты. Письма не копятся в памяти: главный процесс пишет
+результаты по мере готовности заданий, по порядку.
+
+    python mail_archive.py dump.mbox                                  # сводка по режиму platform
+    python mail_archive.py ~/Maildir exports/ --mode sms --out results.jsonl
+    python mail_archive.py dump.mbox --mode email --recipient test@example.com --workers 8
+    python mail_archive.py dump.mbox --code-regex "\\d{6}" --subject-format "\\d{6}\\s+[—\\-]" --json summary.json
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple, Sequence
+
+import email_code_fetcher
+from code_rules import CodeRule
+from code_sources import MODE_PLATFORM, SOURCE_MODES
+from email_code_fetcher import (
+    MATCH_CODE,
+    MATCH_ERROR,
+    MATCH_NO_CODE,
+    MATCH_SKIPPED,
+    PLATFORM_SENDERS,
+    MessageMatch,
+    archive_lookup,
+    match_message,
+)
+
+# Размер куска mbox на одно задание: письмо относится к куску, в котором начинается его строка «From »
+MBOX_SHARD_BYTES = 8 * 1024 * 1024
+# Сколько файлов (Maildir, .eml) в одном задании
+FILES_PER_TASK = 256
+EML_SUFFIX = ".eml"
+MAILDIR_SUBDIRS = ("cur", "new")
+# Папка по умолчанию: правила [rule:…] без folders к ней применяются, с folders — нет
+DEFAULT_FOLDER = "archive"
+# Сколько самых частых тем писем без кода показывать в сводке
+TOP_SUBJECTS = 10
+
+_MBOX_FROM = b"From "
+_MBOX_ESCAPED_FROM = re.compile(rb"^>(>*From )", re.MULTILINE)
+
+
+class ArchiveOptions(NamedTuple):
+    """Что искать: режим и папка источника, правила и замена встроенных выражений для подбора."""
+
+    mode: str = MODE_PLATFORM
+    folder: str = DEFAULT_FOLDER  # по ней выбираются правила [rule:…] с folders
+    recipient: str | None = None  # для режима email: только письма на этот адрес
+    senders: tuple[str, ...] = PLATFORM_SENDERS
+    sms_marker: str | None = None  # вместо SMS_BODY_MARKER
+    rules: tuple[CodeRule, ...] = ()
+    code_regex: str | None = None  # вместо CODE_REGEX во встроенных правилах
+    subject_format: str | None = None  # вместо SUBJECT_CODE_FORMAT
+
+
+class _Task(NamedTuple):
+    path: str  # mbox; для файлов — пусто
+    start: int
+    end: int
+    files: tuple[str, ...] = ()
+
+
+def plan_tasks(paths: Iterable[str | Path]) -> Iterator[_Task]:
+    """
+    Задания по путям: файл .eml, каталог Maildir (cur/ и new/), каталог с .eml (рекурсивно)
+    или любой другой файл — mbox.
+    """
+    files: list[str] = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            if any((path / d).is_dir() for d in MAILDIR_SUBDIRS):
+                found = (f for d in MAILDIR_SUBDIRS if (path / d).is_dir() for f in sorted((path / d).iterdir()))
+            else:
+                found = (f for f in sorted(path.rglob(f"*{EML_SUFFIX}")))
+            files.extend(str(f) for f in found if f.is_file())
+        elif path.suffix.lower() == EML_SUFFIX:
+            files.append(str(path))
+        elif path.is_file():
+            size = path.stat().st_size
+            for start in range(0, size, MBOX_SHARD_BYTES):
+                yield _Task(str(path), start, min(start + MBOX_SHARD_BYTES, size))
+        else:
+            raise FileNotFoundError(f"нет такого файла или каталога: {path}")
+        while len(files) >= FILES_PER_TASK:
+            yield _Task("", 0, 0, tuple(files[:FILES_PER_TASK]))
+            del files[:FILES_PER_TASK]
+    if files:
+        yield _Task("", 0, 0, tuple(files))
+
+
+def _read_mbox(path: str, start: int, end: int) -> Iterator[tuple[str, bytes]]:
+    """(«путь:смещение», письмо) для писем, чья строка «From » начинается в [start, end)."""
+    with open(path, "rb") as f:
+        if start:
+            f.seek(start - 1)
+            f.readline()  # дочитываем строку, начатую в предыдущем куске
+        offset = None
+        lines: list[bytes] = []
+        while True:
+            position = f.tell()
+            line = f.readline()
+            if not line or line.startswith(_MBOX_FROM):
+                if offset is not None:
+                    # Разделитель — пустая строка перед «From »; «>From » в теле — экранированная «From »
+                    raw = b"".join(lines).removesuffix(b"\n").removesuffix(b"\r")
+                    yield f"{path}:{offset}", _MBOX_ESCAPED_FROM.sub(rb"\1", raw)
+                if not line or position >= end:
+                    return
+                offset, lines = position, []
+            elif offset is not None:
+                lines.append(line)
+
+
+def _read_files(files: Sequence[str]) -> Iterator[tuple[str, bytes]]:
+    for name in files:
+        with open(name, "rb") as f:
+            yield name, f.read()
+
+
+_lookup = None  # условия поиска процесса-обработчика (_init_worker)
+
+
+def _init_worker(options: ArchiveOptions) -> None:
+    """Готовит процесс пула: подставляет выражения для подбора и собирает условия поиска один раз."""
+    global _lookup
+    if options.code_regex:
+        email_code_fetcher.CODE_REGEX = re.compile(options.code_regex)
+        email_code_fetcher.BUILTIN_EMAIL_RULES = (CodeRule("email", options.code_regex),)
+    if options.subject_format:
+        email_code_fetcher.SUBJECT_CODE_FORMAT = re.compile(options.subject_format)
+    _lookup = archive_lookup(
+        options.mode, options.folder, options.recipient, options.senders, options.sms_marker, options.rules
+    )
+
+
+def _run_task(task: _Task) -> list[tuple[str, MessageMatch]]:
+    messages = _read_files(task.files) if task.files else _read_mbox(task.path, task.start, task.end)
+    return [(name, match_message(_lookup, raw)) for name, raw in messages]
+
+
+def scan_archives(
+    paths: Iterable[str | Path], options: ArchiveOptions = ArchiveOptions(), workers: int | None = None
+) -> Iterator[tuple[str, MessageMatch]]:
+    """
+    (письмо, результат) для всех писем архивов paths по порядку. workers — число процессов
+    (по умолчанию — по числу ядер); 1 — в текущем процессе, без пула (code_regex и
+    subject_format тогда подставляются в email_code_fetcher этого процесса).
+    """
+    # Ошибки в выражениях — сразу, а не в каждом процессе пула
+    for pattern in (options.code_regex, options.subject_format):
+        if pattern:
+            re.compile(pattern)
+    tasks = plan_tasks(paths)
+    if workers == 1:
+        _init_worker(options)
+        for task in tasks:
+            yield from _run_task(task)
+        return
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(options,)) as pool:
+        for results in pool.map(_run_task, tasks):
+            yield from results
+
+
+class ArchiveSummary:
+    """Сводка по проверенным письмам: итоги, причины отсева, где найден код, частые темы писем без кода."""
+
+    def __init__(self):
+        self.total = 0
+        self.statuses: Counter[str] = Counter()
+        self.reasons: Counter[str] = Counter()
+        self.sources: Counter[str] = Counter()
+        self.codes: set[str] = set()
+        self.no_code_subjects: Counter[str] = Counter()
+
+    def add(self, match: MessageMatch) -> None:
+        self.total += 1
+        self.statuses[match.status] += 1
+        if match.reason:
+            self.reasons[match.reason] += 1
+        if match.status == MATCH_CODE:
+            self.sources[match.source] += 1
+            self.codes.add(match.code)
+        elif match.status == MATCH_NO_CODE:
+            self.no_code_subjects[match.subject] += 1
+
+    def as_dict(self) -> dict:
+        return {
+            "messages": self.total,
+            "statuses": dict(self.statuses),
+            "skipped_reasons": dict(self.reasons),
+            "code_sources": dict(self.sources),
+            "distinct_codes": len(self.codes),
+            "no_code_subjects": dict(self.no_code_subjects.most_common(TOP_SUBJECTS)),
+        }
+
+
+def _match_record(name: str, match: MessageMatch) -> dict:
+    record = {"message": name, **match._asdict()}
+    record["date"] = match.date.isoformat() if match.date else None
+    return record
+
+
+def _print_summary(summary: ArchiveSummary, elapsed: float, workers: int, out) -> None:
+    rate = summary.total / elapsed if elapsed else 0.0
+    print(f"Писем: {summary.total} за {elapsed:.1f} с ({rate:.0f} писем/с, процессов: {workers})", file=out)
+    for status in (MATCH_CODE, MATCH_NO_CODE, MATCH_SKIPPED, MATCH_ERROR):
+        share = summary.statuses[status] / summary.total * 100 if summary.total else 0.0
+        print(f"  {status:<10}{summary.statuses[status]:>10}{share:>8.1f}%", file=out)
+    if summary.sources:
+        print("Где найден код: " + ", ".join(f"{s} {n}" for s, n in summary.sources.most_common()), file=out)
+        print(f"Разных кодов: {len(summary.codes)}", file=out)
+    if summary.reasons:
+        print("Отсеяно / ошибки: " + ", ".join(f"{r} {n}" for r, n in summary.reasons.most_common()), file=out)
+    if summary.no_code_subjects:
+        print("Частые темы писем без кода:", file=out)
+        for subject, count in summary.no_code_subjects.most_common(TOP_SUBJECTS):
+            print(f"  {count:>8}  {subject}", file=out)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Поиск кодов в выгрузках почты (mbox, Maildir, .eml) без IMAP")
+    parser.add_argument("paths", nargs="+", help="mbox, каталог Maildir, каталог с .eml или файл .eml")
+    parser.add_argument("--mode", choices=SOURCE_MODES, default=MODE_PLATFORM, help="режим поиска, как у источника")
+    parser.add_argument("--folder", default=DEFAULT_FOLDER,
+                        help="папка, по которой выбираются правила [rule:…] (по умолчанию %(default)s)")
+    parser.add_argument("--recipient", help="режим email: только письма на этот адрес (TO)")
+    parser.add_argument("--senders", default=",".join(PLATFORM_SENDERS), help="отправители через запятую (FROM)")
+    parser.add_argument("--sms-marker", help="подстрока тела SMS вместо SMS_BODY_MARKER")
+    parser.add_argument("--code-regex", help="выражение кода вместо CODE_REGEX (встроенные правила)")
+    parser.add_argument("--subject-format", help="формат темы платформы вместо SUBJECT_CODE_FORMAT")
+    parser.add_argument("--no-config-rules", action="store_true", help="не брать правила [rule:…] из config.ini")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="процессов (по умолчанию — ядер)")
+    parser.add_argument("--out", help="результаты по письмам в JSON Lines («-» — в stdout)")
+    parser.add_argument("--json", type=Path, help="сохранить сводку в JSON")
+    args = parser.parse_args(argv)
+
+    rules: tuple[CodeRule, ...] = ()
+    if not args.no_config_rules:
+        from config_loader import load_code_rules
+
+        rules, errors = load_code_rules()
+        for error in errors:
+            print(f"config.ini: {error}", file=sys.stderr)
+    options = ArchiveOptions(
+        mode=args.mode,
+        folder=args.folder,
+        recipient=args.recipient,
+        senders=tuple(s.strip() for s in args.senders.split(",") if s.strip()),
+        sms_marker=args.sms_marker,
+        rules=rules,
+        code_regex=args.code_regex,
+        subject_format=args.subject_format,
+    )
+    workers = max(1, args.workers)
+    summary = ArchiveSummary()
+    to_stdout = args.out == "-"
+    out = None
+    if args.out:
+        out = sys.stdout if to_stdout else open(args.out, "w", encoding="utf-8")
+    started = time.perf_counter()
+    try:
+        for name, match in scan_archives(args.paths, options, workers):
+            summary.add(match)
+            if out is not None:
+                out.write(json.dumps(_match_record(name, match), ensure_ascii=False) + "\n")
+    except (OSError, re.error) as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if out is not None and not to_stdout:
+            out.close()
+    _print_summary(summary, time.perf_counter() - started, workers, sys.stderr if to_stdout else sys.stdout)
+    if args.json:
+        args.json.write_text(json.dumps(summary.as_dict(), ensure_ascii=False, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,4 @@
+import copy
 import json
 from pathlib import Path
 
@@ -8,6 +9,7 @@ DEFAULTS = {
     "copy_to_clipboard": True,
     "always_on_top": False,
     "sms_subject": "SMS",
+    "folder_usage": {},  # источник (кнопка) -> число запросов; папки самых частых подключаются заранее
 }
 
 
@@ -18,15 +20,15 @@ def _path() -> Path:
 def load_settings() -> dict:
     p = _path()
     if not p.exists():
-        return DEFAULTS.copy()
+        return copy.deepcopy(DEFAULTS)
     try:
         with open(p, "r", encoding="utf-8") as f:
             data = json.load(f)
-        out = DEFAULTS.copy()
+        out = copy.deepcopy(DEFAULTS)
         out.update({k: v for k, v in data.items() if k in out})
         return out
     except Exception:
-        return DEFAULTS.copy()
+        return copy.deepcopy(DEFAULTS)
 
 
 def save_settings(data: dict) -> None:
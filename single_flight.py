@@ -0,0 +1,111 @@
+"""
+Склейка одновременных одинаковых запросов (single-flight) и короткий кэш результатов.
+
+Если поиск кода с тем же ключом (ящик, папка, режим, условия) уже идёт, новый
+вызывающий не открывает свою IMAP-сессию, а ждёт результат идущего поиска.
+Поиск отменяется, только когда его перестали ждать все. Готовые результаты
+(код и UID письма) какое-то время отдаются из памяти — повторный клик сразу после
+первого не ходит на сервер.
+
+SingleFlight привязан к циклу событий (задачи живут в нём): get_single_flight().
+ResultCache общий для всех циклов.
+"""
+import asyncio
+import threading
+import time
+import weakref
+from typing import Awaitable, Generic, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class Flight(Generic[T]):
+    """Идущий поиск: ключ, задача, до какого момента (time.monotonic) она ждёт писем, сколько вызывающих её ждут."""
+
+    __slots__ = ("key", "task", "deadline", "waiters")
+
+    def __init__(self, key: Hashable, task: "asyncio.Task[T]", deadline: float | None):
+        self.key = key
+        self.task = task
+        self.deadline = deadline
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights: dict[Hashable, Flight] = {}
+
+    def get(self, key: Hashable) -> Flight | None:
+        return self._flights.get(key)
+
+    def start(self, key: Hashable, coro: Awaitable[T], deadline: float | None) -> Flight[T]:
+        """Запускает поиск и регистрирует его под key (прежний, если был, доживает сам по себе)."""
+        flight = Flight(key, asyncio.ensure_future(coro), deadline)
+        self._flights[key] = flight
+        flight.task.add_done_callback(lambda _: self._forget(flight))
+        return flight
+
+    def _forget(self, flight: Flight) -> None:
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    async def join(self, flight: Flight[T], timeout: float | None = None) -> T:
+        """
+        Ждёт результат поиска (не дольше timeout — иначе asyncio.TimeoutError).
+        Ошибка поиска пробрасывается каждому ждущему. Когда ждать перестали все
+        (отмена, таймаут), недоделанный поиск отменяется и сразу снимается с учёта:
+        задача завершится позже, и новый вызывающий не должен присоединиться к ней.
+        """
+        flight.waiters += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(flight.task), timeout)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                self._forget(flight)
+                flight.task.cancel()
+
+
+_single_flights: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, SingleFlight]" = weakref.WeakKeyDictionary()
+
+
+def get_single_flight() -> SingleFlight:
+    """SingleFlight текущего цикла событий."""
+    loop = asyncio.get_running_loop()
+    flights = _single_flights.get(loop)
+    if flights is None:
+        flights = _single_flights[loop] = SingleFlight()
+    return flights
+
+
+class ResultCache(Generic[T]):
+    """Результаты с коротким сроком жизни; потокобезопасный."""
+
+    def __init__(self):
+        self._entries: dict[Hashable, tuple[float, T]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> T | None:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._entries[key]
+                return None
+            return entry[1]
+
+    def put(self, key: Hashable, value: T, ttl: float) -> None:
+        if ttl <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            # Просроченные выбрасываем при записи: ключей немного (папки × режимы), проход дешёвый
+            for stale in [k for k, (expires, _) in self._entries.items() if expires <= now]:
+                del self._entries[stale]
+            self._entries[key] = (now + ttl, value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,148 @@
+"""
+Кэш «водяных знаков» UID: для каждой пары (аккаунт, папка, условия поиска) помним
+UIDVALIDITY, самый большой уже просмотренный UID и последний найденный код.
+Следующий запрос смотрит только письма с UID выше отметки, а если папка по STATUS
+с тех пор не изменилась — не смотрит вовсе. Хранится в uid_watermarks.json
+рядом с config.ini/settings.json.
+
+Отметок не больше WATERMARKS_MAX (давно не использованные вытесняются), отметка,
+не менявшаяся WATERMARK_TTL, забывается. Файл пишется не на каждое изменение, а через
+WATERMARKS_SAVE_DELAY в отдельном потоке — поиск на цикле событий диском не блокируется.
+Найденный код попадает в файл, только пока его письмо не старше CODE_TTL.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+from app_dir import get_base_dir
+
+WATERMARKS_FILE = "uid_watermarks.json"
+WATERMARKS_MAX = 1000  # Отметок не больше (получатели автотестов дают по отметке на адрес)
+WATERMARK_TTL = 7 * 24 * 3600  # Отметка, не менявшаяся столько секунд, забывается
+WATERMARKS_SAVE_DELAY = 1.0  # Изменения копятся столько секунд и пишутся в файл одной записью
+CODE_TTL = 15 * 60  # Отметка с кодом старше этого (как CODE_MAX_AGE поиска) в файл не пишется
+
+
+class Watermark(NamedTuple):
+    uidvalidity: int
+    last_uid: int  # самый большой UID, уже проверенный по этим условиям
+    hit_uid: int | None = None  # UID письма с последним найденным кодом
+    code: str | None = None
+    hit_date: float | None = None  # дата письма с кодом (timestamp), для отсечки по возрасту
+    state: str | None = None  # состояние папки по STATUS перед этим поиском (см. email_code_fetcher._folder_state)
+    updated: float | None = None  # когда отметка последний раз менялась (timestamp)
+
+
+def _path() -> Path:
+    return get_base_dir() / WATERMARKS_FILE
+
+
+def _keep_on_disk(mark: Watermark, now: float) -> bool:
+    """
+    Отметку с устаревшим кодом в файл не пишем целиком: без кода она утверждала бы,
+    что ниже last_uid кода нет, — после перезапуска папка будет просмотрена заново.
+    """
+    if mark.updated is not None and mark.updated < now - WATERMARK_TTL:
+        return False
+    if mark.code is None:
+        return True
+    found = mark.hit_date if mark.hit_date is not None else mark.updated
+    return found is not None and found >= now - CODE_TTL
+
+
+class UidWatermarks:
+    """Потокобезопасное хранилище отметок; файл перечитывается только при создании."""
+
+    def __init__(self, path: Path | None = None, save_delay: float = WATERMARKS_SAVE_DELAY):
+        self.path = path or _path()
+        self.save_delay = save_delay
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # запись файла — по одной
+        self._timer: threading.Timer | None = None
+        self._data: dict[str, Watermark] = self._load()  # порядок — от давно использованных к недавним
+
+    def _load(self) -> dict[str, Watermark]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+            now = time.time()
+            marks = {key: Watermark(**value) for key, value in raw.items()}
+            return {key: mark for key, mark in marks.items() if _keep_on_disk(mark, now)}
+        except Exception:
+            return {}
+
+    def get(self, key: str, uidvalidity: int) -> Watermark | None:
+        """Отметка для key; None, если её нет или UIDVALIDITY папки сменился (UID больше не сопоставимы)."""
+        with self._lock:
+            mark = self._data.pop(key, None)
+            if mark is not None:
+                self._data[key] = mark
+        if mark is None or mark.uidvalidity != uidvalidity:
+            return None
+        return mark
+
+    def put(self, key: str, mark: Watermark) -> None:
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None and old._replace(updated=None) == mark._replace(updated=None):
+                self._data[key] = old
+                return
+            self._data[key] = mark._replace(updated=time.time())
+            while len(self._data) > WATERMARKS_MAX:
+                del self._data[next(iter(self._data))]
+            self._schedule_save()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+        self.flush()
+
+    def flush(self) -> None:
+        """Сразу пишет отметки в файл (отложенная запись, если была назначена, не нужна)."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            now = time.time()
+            # Заодно забываем давно не менявшиеся отметки: проход по словарю — раз на запись файла
+            for key in [k for k, v in self._data.items() if v.updated is not None and v.updated < now - WATERMARK_TTL]:
+                del self._data[key]
+            snapshot = {k: v._asdict() for k, v in self._data.items() if _keep_on_disk(v, now)}
+        with self._save_lock:
+            self._save(snapshot)
+
+    def _schedule_save(self) -> None:
+        if self._timer is not None:
+            return
+        self._timer = threading.Timer(self.save_delay, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _save(self, snapshot: dict[str, dict]) -> None:
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
+        except OSError:
+            # Нет прав на запись рядом с exe — кэш просто живёт только в памяти
+            pass
+
+
+_default_watermarks: UidWatermarks | None = None
+_default_lock = threading.Lock()
+
+
+def get_default_watermarks() -> UidWatermarks:
+    global _default_watermarks
+    if _default_watermarks is None:
+        with _default_lock:
+            if _default_watermarks is None:
+                _default_watermarks = UidWatermarks()
+                # Отложенная запись не должна теряться при выходе
+                atexit.register(_default_watermarks.flush)
+    return _default_watermarks